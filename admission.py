@@ -0,0 +1,164 @@
+#----------------------------------------------------------------------------#
+# Admission control.
+# Routes are put in groups (search, detail, listing...) with a budget each:
+# a cap on requests in flight in this process and a token bucket per client.
+# Requests over budget are turned away at once, so a spike of expensive
+# searches cannot starve the cheap pages. Buckets live in a pluggable store,
+# in process or redis when several workers should share one budget.
+#----------------------------------------------------------------------------#
+
+import math
+import threading
+import time
+from collections import namedtuple
+
+# concurrency: requests in flight per process, rate: tokens per second per
+# client, burst: bucket size; None disables that part of the budget
+Budget = namedtuple('Budget', 'concurrency rate burst')
+
+# why a request was turned away -> status code
+SHED_STATUS = {'concurrency': 503, 'rate': 429}
+
+class MemoryStore(object):
+  # token buckets of a single process
+
+  def __init__(self, max_keys=100000):
+    self.buckets = {}
+    self.lock = threading.Lock()
+    self.max_keys = max_keys
+
+  def take(self, key, rate, burst, now):
+    # (allowed, seconds until a token is available)
+    with self.lock:
+      tokens, at = self.buckets.get(key, (burst, now))
+      tokens = min(burst, tokens + (now - at) * rate)
+      allowed = tokens >= 1
+      if allowed:
+        tokens -= 1
+      if len(self.buckets) >= self.max_keys and key not in self.buckets:
+        self.prune(now, rate, burst)
+      self.buckets[key] = (tokens, now)
+    return allowed, 0 if allowed else (1 - tokens) / rate
+
+  def prune(self, now, rate, burst):
+    # buckets that have refilled completely hold no information
+    full = [key for key, (tokens, at) in self.buckets.items() if tokens + (now - at) * rate >= burst]
+    for key in full:
+      del self.buckets[key]
+
+# the same refill as MemoryStore.take, atomic on the redis server
+TAKE_SCRIPT = '''
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(state[1]) or burst
+local at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - at) * rate)
+local allowed = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+  allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+'''
+
+class RedisStore(object):
+  # buckets shared by every worker pointing at the same redis
+
+  def __init__(self, url, prefix='fyyur:admission:'):
+    import redis
+    self.client = redis.Redis.from_url(url)
+    self.prefix = prefix
+    self.script = self.client.register_script(TAKE_SCRIPT)
+
+  def take(self, key, rate, burst, now):
+    allowed, tokens = self.script(keys=[self.prefix + key], args=[rate, burst, now])
+    tokens = float(tokens)
+    return bool(allowed), 0 if allowed else (1 - tokens) / rate
+
+def store_from_url(url):
+  if not url or url == 'memory':
+    return MemoryStore()
+  if url.startswith(('redis://', 'rediss://', 'unix://')):
+    return RedisStore(url)
+  raise ValueError('Unknown admission store ' + url)
+
+class Group(object):
+  __slots__ = ('name', 'budget', 'in_flight', 'peak', 'admitted', 'shed')
+
+  def __init__(self, name, budget):
+    self.name = name
+    self.budget = budget
+    self.in_flight = 0
+    self.peak = 0
+    self.admitted = 0
+    self.shed = {reason: 0 for reason in SHED_STATUS}
+
+class Limiter(object):
+
+  def __init__(self, budgets, store=None, retry_after=1):
+    # budgets: group name -> Budget
+    self.groups = {name: Group(name, budget) for name, budget in budgets.items()}
+    self.store = store or MemoryStore()
+    self.retry_after = retry_after # for requests shed on concurrency
+    self.lock = threading.Lock()
+
+  def admit(self, name, client):
+    # None when admitted (release() must follow), else (status, retry after seconds)
+    group = self.groups[name]
+    budget = group.budget
+
+    # the cheap in-process check first, a full group never touches the store
+    with self.lock:
+      if budget.concurrency is not None and group.in_flight >= budget.concurrency:
+        group.shed['concurrency'] += 1
+        return SHED_STATUS['concurrency'], self.retry_after
+      group.in_flight += 1
+      group.peak = max(group.peak, group.in_flight)
+
+    if budget.rate:
+      try:
+        allowed, wait = self.store.take('%s:%s' % (name, client), budget.rate, budget.burst or 1, time.time())
+      except Exception:
+        # an unreachable shared store should not take the site down with it
+        allowed, wait = True, 0
+      if not allowed:
+        with self.lock:
+          group.in_flight -= 1
+          group.shed['rate'] += 1
+        return SHED_STATUS['rate'], max(1, int(math.ceil(wait)))
+
+    with self.lock:
+      group.admitted += 1
+    return None
+
+  def release(self, name):
+    with self.lock:
+      self.groups[name].in_flight -= 1
+
+  def metrics(self):
+    with self.lock:
+      return {name: {
+        'in_flight': group.in_flight,
+        'peak_in_flight': group.peak,
+        'concurrency_limit': group.budget.concurrency,
+        'rate': group.budget.rate,
+        'burst': group.budget.burst,
+        'admitted': group.admitted,
+        'shed_concurrency': group.shed['concurrency'],
+        'shed_rate': group.shed['rate'],
+      } for name, group in self.groups.items()}
+
+def prometheus(metrics, prefix='fyyur_admission_'):
+  # the text exposition format, one gauge or counter per metric and group
+  kinds = {'in_flight': 'gauge', 'peak_in_flight': 'gauge', 'concurrency_limit': 'gauge', 'rate': 'gauge',
+           'burst': 'gauge', 'admitted': 'counter', 'shed_concurrency': 'counter', 'shed_rate': 'counter'}
+  lines = []
+  for metric, kind in kinds.items():
+    name = prefix + metric + ('_total' if kind == 'counter' else '')
+    lines.append('# TYPE %s %s' % (name, kind))
+    for group, values in sorted(metrics.items()):
+      if values[metric] is not None:
+        lines.append('%s{group="%s"} %s' % (name, group, values[metric]))
+  return '\n'.join(lines) + '\n'
@@ -5,17 +5,47 @@
 import json
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, send_from_directory, abort, stream_with_context, jsonify, g, has_request_context, has_app_context, send_file
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm, create_engine
+from sqlalchemy.orm import with_loader_criteria
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
 from flask_migrate import Migrate
 import logging
-from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 from flask_script import Manager
-from datetime import datetime
+from datetime import datetime, timedelta
 import sys
+import os
+import zlib
+import hashlib
+import images
+import assets
+import matchmaking
+import geo
+import broadcast
+import prefix_index
+import catalogue
+import logs
+import admission
+import loaders
+import dedup
+import rollups
+import exports
+import calendars
+import sitemaps
+import fragments
+import shards
+import itertools
+from collections import Counter
+import uuid
+import time
+import threading
+import numpy as np
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -24,7 +54,61 @@ app = Flask(__name__)
 moment = Moment(app)
 manager = Manager(app) # extend flask with flask script to help in seed data
 app.config.from_object('config')
-db = SQLAlchemy(app)
+
+def log_context():
+  # attached to every record logged while a request is handled
+  if not has_request_context():
+    return {}
+  return {
+    "request_id": getattr(g, 'request_id', None),
+    "route": request.url_rule.rule if request.url_rule else None,
+    "method": request.method,
+  }
+
+# everything, including the module loggers, goes through the root logger's queue
+log_queue = logs.setup(logging.getLogger(), app.config['LOG_FILE'],
+                       level=app.config['LOG_LEVEL'],
+                       max_bytes=app.config['LOG_MAX_BYTES'],
+                       backup_count=app.config['LOG_BACKUP_COUNT'],
+                       queue_size=app.config['LOG_QUEUE_SIZE'],
+                       context=log_context,
+                       console=app.debug)
+
+@app.before_request
+def start_request():
+  g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+  g.started = time.perf_counter()
+
+@app.after_request
+def log_request(response):
+  # streamed pages are timed to their first chunk, the rest is sent after this
+  request_id = getattr(g, 'request_id', None)
+  if request_id:
+    response.headers['X-Request-ID'] = request_id
+  if app.config['LOG_REQUESTS'] and hasattr(g, 'started'):
+    app.logger.info('%s %s %s', request.method, request.full_path.rstrip('?'), response.status_code,
+                    extra={"status": response.status_code,
+                           "duration_ms": round((time.perf_counter() - g.started) * 1000, 2)})
+  return response
+
+class ShardingSession(SignallingSession):
+  # a request pinned to a shard (see pin_shard) runs every statement there
+  # but those of the MAIN_TABLES, everything else goes to the main database
+  def get_bind(self, mapper=None, clause=None, **kw):
+    if shard_set is not None:
+      table = mapper.persist_selectable if mapper is not None else getattr(clause, 'table', None)
+      if table is not None and table in MAIN_TABLES:
+        return db.engine
+      shard = pinned_shard()
+      if shard is not None:
+        return shard_set.engines[shard]
+    return super(ShardingSession, self).get_bind(mapper, clause)
+
+class ShardingSQLAlchemy(SQLAlchemy):
+  def create_session(self, options):
+    return orm.sessionmaker(class_=ShardingSession, db=self, **options)
+
+db = ShardingSQLAlchemy(app)
 
 # TODO: connect to a local postgresql database, already satisfied via config file
 # instantiate migration
@@ -48,9 +132,30 @@ class Venue(db.Model):
     website_link = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean)
     seeking_description = db.Column(db.String(500))
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))
+    # set by delete_venue, the row and what hangs off it go with "purge"
+    deleted_at = db.Column(db.DateTime)
+    # every write bumps it, incremental exports read the rows changed since a time
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # bumped by every ORM update, which only matches the version it read, see apply_edit()
+    version = db.Column(db.Integer, nullable=False, default=1)
     shows = db.relationship('Show', backref='venue', lazy=True)
     genres = db.relationship('VenueGenres', backref='venue', lazy=True)
 
+    # pattern ops so "geohash LIKE 'prefix%'" is an index range scan
+    __table_args__ = (
+        db.Index('ix_Venue_geohash', 'geohash', postgresql_ops={'geohash': 'varchar_pattern_ops'}),
+        db.Index('ix_Venue_city_state_id', 'city', 'state', 'id', postgresql_where=deleted_at.is_(None)),
+        db.Index('ix_Venue_deleted_at', 'deleted_at', postgresql_where=deleted_at.isnot(None)),
+        db.Index('ix_Venue_updated_at', 'updated_at'),
+        # natural key, creates upsert on it so a resubmitted venue is a no-op
+        db.Index('uq_Venue_natural_key', 'name', 'address', 'city', 'state', unique=True,
+                 postgresql_where=deleted_at.is_(None), sqlite_where=deleted_at.is_(None)),
+    )
+    __mapper_args__ = {'version_id_col': version}
+
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
 class Artist(db.Model):
@@ -67,13 +172,34 @@ class Artist(db.Model):
     website_link = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean)
     seeking_description = db.Column(db.String(500))
+    deleted_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1)
     shows = db.relationship('Show', backref='artist', lazy=True)
     genres = db.relationship('ArtistGenres', backref='artist', lazy=True)
 
+    # covering indexes for the /artists directory, one per sort order, over
+    # the rows that are not deleted since every query skips those
+    __table_args__ = (
+        db.Index('ix_Artist_name_id', 'name', 'id', postgresql_include=['city', 'state'],
+                 postgresql_where=deleted_at.is_(None)),
+        db.Index('ix_Artist_city_id', 'city', 'id', postgresql_include=['name', 'state'],
+                 postgresql_where=deleted_at.is_(None)),
+        db.Index('ix_Artist_state_name_id', 'state', 'name', 'id', postgresql_include=['city'],
+                 postgresql_where=deleted_at.is_(None)),
+        db.Index('ix_Artist_deleted_at', 'deleted_at', postgresql_where=deleted_at.isnot(None)),
+        db.Index('ix_Artist_updated_at', 'updated_at'),
+        db.Index('uq_Artist_natural_key', 'name', 'city', 'state', unique=True,
+                 postgresql_where=deleted_at.is_(None), sqlite_where=deleted_at.is_(None)),
+    )
+    __mapper_args__ = {'version_id_col': version}
+
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 
+# On postgres Show is range partitioned by month on show_date, so its real
+# primary key is (id, show_date); id alone is still unique through the sequence
 class Show(db.Model):
     __tablename__ = 'Show'
 
@@ -81,6 +207,37 @@ class Show(db.Model):
     venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
     artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
     show_date = db.Column(db.DateTime, nullable=False)
+    deleted_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_Show_artist_id_show_date', 'artist_id', 'show_date', postgresql_where=deleted_at.is_(None)),
+        db.Index('ix_Show_venue_id_show_date', 'venue_id', 'show_date', postgresql_where=deleted_at.is_(None)),
+        db.Index('ix_Show_deleted_at', 'deleted_at', postgresql_where=deleted_at.isnot(None)),
+        db.Index('ix_Show_updated_at', 'updated_at'),
+        # holds the partition key show_date, as unique indexes on a partitioned table must
+        db.Index('uq_Show_natural_key', 'venue_id', 'artist_id', 'show_date', unique=True,
+                 postgresql_where=deleted_at.is_(None), sqlite_where=deleted_at.is_(None)),
+    )
+
+# Old monthly partitions detached from Show by the "partitions" command, only
+# read by the past shows of the detail pages
+class ShowArchive(db.Model):
+    __tablename__ = 'Show_Archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
+    show_date = db.Column(db.DateTime, nullable=False)
+    deleted_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    venue = db.relationship('Venue', viewonly=True)
+    artist = db.relationship('Artist', viewonly=True)
+
+    __table_args__ = (
+        db.Index('ix_Show_Archive_artist_id_show_date', 'artist_id', 'show_date'),
+        db.Index('ix_Show_Archive_venue_id_show_date', 'venue_id', 'show_date'),
+    )
 
 # Adjacency List Relationships at https://docs.sqlalchemy.org/en/13/orm/self_referential.html
 class Lookup(db.Model):
@@ -99,12 +256,1740 @@ class VenueGenres(db.Model):
     venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), primary_key=True)
     genre_id = db.Column(db.Integer, db.ForeignKey('Lookup.id'), primary_key=True)
 
+    __table_args__ = (
+        db.Index('ix_Venue_Genres_genre_id_venue_id', 'genre_id', 'venue_id'),
+    )
+
 class ArtistGenres(db.Model):
     __tablename__ = 'Artist_Genres'
 
     artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), primary_key=True)
     genre_id = db.Column(db.Integer, db.ForeignKey('Lookup.id'), primary_key=True)
 
+    __table_args__ = (
+        db.Index('ix_Artist_Genres_genre_id_artist_id', 'genre_id', 'artist_id'),
+    )
+
+# Closure table of the Lookup hierarchy, one row per (ancestor, descendant) pair
+# including every lookup paired with itself at depth 0, so "everything under
+# genre X" is a single indexed join instead of a recursive walk
+class LookupClosure(db.Model):
+    __tablename__ = 'Lookup_Closure'
+
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('Lookup.id', ondelete='CASCADE'), primary_key=True)
+    descendant_id = db.Column(db.Integer, db.ForeignKey('Lookup.id', ondelete='CASCADE'), primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_Lookup_Closure_descendant_id', 'descendant_id', 'ancestor_id'),
+    )
+
+# Precomputed best artist/venue pairings, see matchmaking.py. Holds every
+# artist's top venues and every venue's top artists so either side is one
+# indexed read
+class Match(db.Model):
+    __tablename__ = 'Match'
+
+    artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'), primary_key=True)
+    venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_Match_artist_id_score', 'artist_id', 'score'),
+        db.Index('ix_Match_venue_id_score', 'venue_id', 'score'),
+    )
+
+# Append only log of every create/update/delete, written in the same
+# transaction as the change itself; seq is the sync cursor of /api/v1/changes
+class Change(db.Model):
+    __tablename__ = 'Change'
+
+    seq = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    data = db.Column(db.JSON)
+
+    __table_args__ = (
+        db.Index('ix_Change_changed_at', 'changed_at'),
+    )
+
+# Keys of create requests already applied, so a double-submitted form or a
+# retried call writes nothing the second time; reusable once expired
+class IdempotencyKey(db.Model):
+    __tablename__ = 'Idempotency_Key'
+
+    key = db.Column(db.String(64), primary_key=True)
+    endpoint = db.Column(db.String(40), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_Idempotency_Key_expires_at', 'expires_at'),
+    )
+
+# Likely duplicate venues/artists found by the "dedup" command, see dedup.py.
+# The older row is kept; status is pending until the pair is merged or rejected
+class MergeSuggestion(db.Model):
+    __tablename__ = 'Merge_Suggestion'
+
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    keep_id = db.Column(db.Integer, nullable=False)
+    duplicate_id = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('entity', 'keep_id', 'duplicate_id', name='uq_Merge_Suggestion_pair'),
+        db.Index('ix_Merge_Suggestion_status_score', 'status', 'score'),
+    )
+
+# Live show counts per grain (day/month) bucket and dimension key, see
+# rollups.py; kept current on every flush that adds, moves or deletes shows
+class ShowRollup(db.Model):
+    __tablename__ = 'Show_Rollup'
+
+    grain = db.Column(db.String(5), primary_key=True)
+    dimension = db.Column(db.String(10), primary_key=True)
+    key = db.Column(db.String, primary_key=True)
+    bucket = db.Column(db.Date, primary_key=True)
+    shows = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_Show_Rollup_grain_dimension_bucket', 'grain', 'dimension', 'bucket'),
+    )
+
+# How far a shard has replayed the artist changes of the main database's
+# Change log; kept on the shard and written with the rows it copies
+class ShardCursor(db.Model):
+    __tablename__ = 'Shard_Cursor'
+
+    name = db.Column(db.String(20), primary_key=True)
+    seq = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), nullable=False)
+
+#----------------------------------------------------------------------------#
+# Soft delete.
+#----------------------------------------------------------------------------#
+
+# Core tables so these subqueries are not themselves filtered by hide_deleted
+deleted_venue_ids = db.select([Venue.__table__.c.id]).where(Venue.__table__.c.deleted_at.isnot(None))
+deleted_artist_ids = db.select([Artist.__table__.c.id]).where(Artist.__table__.c.deleted_at.isnot(None))
+
+def live_shows(cls):
+  # a show of a deleted venue or artist is hidden until "purge" removes it,
+  # so a delete never has to touch all of the shows inside the request
+  return db.and_(cls.deleted_at.is_(None),
+                 cls.venue_id.notin_(deleted_venue_ids),
+                 cls.artist_id.notin_(deleted_artist_ids))
+
+@db.event.listens_for(db.session, 'do_orm_execute')
+def hide_deleted(execute_state):
+  # every ORM select skips deleted rows, joins and relationship loads included,
+  # unless it asks for them with .execution_options(include_deleted=True)
+  if not execute_state.is_select or execute_state.execution_options.get('include_deleted', False):
+    return
+  execute_state.statement = execute_state.statement.options(
+    with_loader_criteria(Venue, lambda cls: cls.deleted_at.is_(None), include_aliases=True),
+    with_loader_criteria(Artist, lambda cls: cls.deleted_at.is_(None), include_aliases=True),
+    with_loader_criteria(Show, live_shows, include_aliases=True),
+    with_loader_criteria(ShowArchive, live_shows, include_aliases=True),
+  )
+
+def delete_in_batches(key, condition, batch, pause):
+  # deletes the rows whose key matches condition, batch keys per transaction
+  # so neither the table nor the request that deleted the parent waits on it
+  table = key.table
+  total = 0
+  while True:
+    keys = [row[0] for row in db.session.execute(db.select([key]).where(condition).distinct().limit(batch),
+                                                 execution_options={'include_deleted': True})]
+    if not keys:
+      return total
+    db.session.execute(table.delete().where(key.in_(keys)))
+    db.session.commit()
+    total += len(keys)
+    time.sleep(pause)
+
+def purge_deleted(before, batch, pause=0):
+  # hard deletes what was soft deleted before the cutoff, children first
+  venues = db.select([Venue.__table__.c.id]).where(Venue.__table__.c.deleted_at <= before)
+  artists = db.select([Artist.__table__.c.id]).where(Artist.__table__.c.deleted_at <= before)
+  show, archive = Show.__table__.c, ShowArchive.__table__.c
+  venue_genres, artist_genres, match = VenueGenres.__table__.c, ArtistGenres.__table__.c, Match.__table__.c
+
+  counts = {}
+  counts['Show'] = delete_in_batches(show.id, db.or_(show.deleted_at <= before, show.venue_id.in_(venues),
+                                                     show.artist_id.in_(artists)), batch, pause)
+  counts['Show_Archive'] = delete_in_batches(archive.id, db.or_(archive.deleted_at <= before, archive.venue_id.in_(venues),
+                                                                archive.artist_id.in_(artists)), batch, pause)
+  counts['Venue_Genres'] = delete_in_batches(venue_genres.venue_id, venue_genres.venue_id.in_(venues), batch, pause)
+  counts['Artist_Genres'] = delete_in_batches(artist_genres.artist_id, artist_genres.artist_id.in_(artists), batch, pause)
+  counts['Match'] = delete_in_batches(match.venue_id, match.venue_id.in_(venues), batch, pause)
+  counts['Match'] += delete_in_batches(match.artist_id, match.artist_id.in_(artists), batch, pause)
+  counts['Venue'] = delete_in_batches(Venue.__table__.c.id, Venue.__table__.c.deleted_at <= before, batch, pause)
+  counts['Artist'] = delete_in_batches(Artist.__table__.c.id, Artist.__table__.c.deleted_at <= before, batch, pause)
+  keys = IdempotencyKey.__table__.c
+  counts['Idempotency_Key'] = delete_in_batches(keys.key, keys.expires_at < datetime.utcnow(), batch, pause)
+  return counts
+
+#----------------------------------------------------------------------------#
+# Genre taxonomy.
+#----------------------------------------------------------------------------#
+
+REBUILD_LOOKUP_CLOSURE = db.text('''
+  WITH RECURSIVE tree(ancestor_id, descendant_id, depth) AS (
+    SELECT id, id, 0 FROM "Lookup"
+    UNION ALL
+    SELECT tree.ancestor_id, child.id, tree.depth + 1
+    FROM tree JOIN "Lookup" child ON child.parent_id = tree.descendant_id
+  )
+  INSERT INTO "Lookup_Closure" (ancestor_id, descendant_id, depth)
+  SELECT ancestor_id, descendant_id, depth FROM tree
+''')
+
+def rebuild_lookup_closure(connection):
+  connection.execute(LookupClosure.__table__.delete())
+  connection.execute(REBUILD_LOOKUP_CLOSURE)
+
+@db.event.listens_for(Lookup, 'after_insert')
+def insert_lookup_closure(mapper, connection, target):
+  # a new leaf inherits every ancestor of its parent, one level deeper
+  closure = LookupClosure.__table__
+  connection.execute(closure.insert().values(ancestor_id=target.id, descendant_id=target.id, depth=0))
+  if target.parent_id is not None:
+    ancestors = db.select([closure.c.ancestor_id, db.literal(target.id), closure.c.depth + 1])\
+                  .where(closure.c.descendant_id == target.parent_id)
+    connection.execute(closure.insert().from_select(['ancestor_id', 'descendant_id', 'depth'], ancestors))
+
+@db.event.listens_for(Lookup, 'after_update')
+def update_lookup_closure(mapper, connection, target):
+  # moving a subtree is rare and the lookup table is small, so rebuild it all
+  if db.inspect(target).attrs.parent_id.history.has_changes():
+    rebuild_lookup_closure(connection)
+
+@db.event.listens_for(Lookup, 'after_delete')
+def delete_lookup_closure(mapper, connection, target):
+  closure = LookupClosure.__table__
+  connection.execute(closure.delete().where(db.or_(closure.c.ancestor_id == target.id,
+                                                   closure.c.descendant_id == target.id)))
+
+def genre_subtree(genre_id):
+  # ids of the genre and all of its subgenres
+  return db.session.query(LookupClosure.descendant_id).filter(LookupClosure.ancestor_id == genre_id)
+
+def artists_in_genre(genre_id):
+  return Artist.query.filter(Artist.id.in_(db.session.query(ArtistGenres.artist_id)
+                                                     .filter(ArtistGenres.genre_id.in_(genre_subtree(genre_id)))))
+
+def genre_facets(genres_model, owner_column, owner_ids, session=None):
+  # number of distinct owners (artists or venues) under every genre, subgenres included
+  count = db.func.count(db.distinct(owner_column))
+  return (session or db.session).query(Lookup.id, Lookup.description, count.label('count'))\
+                   .join(LookupClosure, LookupClosure.ancestor_id == Lookup.id)\
+                   .join(genres_model, genres_model.genre_id == LookupClosure.descendant_id)\
+                   .filter(owner_column.in_(owner_ids))\
+                   .filter(Lookup.parent_id.isnot(None))\
+                   .group_by(Lookup.id, Lookup.description)\
+                   .order_by(count.desc(), Lookup.description).all()
+
+def merge_facets(facets):
+  # the facets of several shards as one list; a venue is on one shard only,
+  # so its genres' counts add up
+  counts = Counter()
+  for facet in facets:
+    counts[(facet.id, facet.description)] += facet.count
+  return [{'id': genre_id, 'description': description, 'count': count} for (genre_id, description), count in
+          sorted(counts.items(), key=lambda item: (-item[1], item[0][1]))]
+
+#----------------------------------------------------------------------------#
+# Matchmaking.
+#----------------------------------------------------------------------------#
+
+def load_match_sides(artist_ids=None, venue_ids=None):
+  # seeking artists and venues as matchmaking sides, optionally restricted to ids
+  genre_index = {genre.id: i for i, genre in enumerate(db.session.query(Lookup.id).order_by(Lookup.id))}
+
+  artist_query = db.session.query(Artist.id, Artist.city, Artist.state).filter(Artist.seeking_venue.is_(True))
+  artist_genres = db.session.query(ArtistGenres.artist_id, ArtistGenres.genre_id)
+  venue_query = db.session.query(Venue.id, Venue.city, Venue.state).filter(Venue.seeking_talent.is_(True))
+  venue_genres = db.session.query(VenueGenres.venue_id, VenueGenres.genre_id)
+  shows = db.session.query(Show.artist_id, Show.venue_id)
+
+  if artist_ids is not None:
+    artist_query = artist_query.filter(Artist.id.in_(artist_ids))
+    artist_genres = artist_genres.filter(ArtistGenres.artist_id.in_(artist_ids))
+    shows = shows.filter(Show.artist_id.in_(artist_ids))
+  if venue_ids is not None:
+    venue_query = venue_query.filter(Venue.id.in_(venue_ids))
+    venue_genres = venue_genres.filter(VenueGenres.venue_id.in_(venue_ids))
+    shows = shows.filter(Show.venue_id.in_(venue_ids))
+
+  artists = matchmaking.build_side(artist_query.all(), artist_genres.all(), genre_index)
+  venues = matchmaking.build_side(venue_query.all(), venue_genres.all(), genre_index)
+  return artists, venues, matchmaking.history_matrix(artists, venues, shows.all())
+
+def match_thresholds(column, ids, k, batch=5000):
+  # k-th best stored score of the given entities that already have k matches,
+  # ranking only their own rows
+  thresholds = {}
+  for start in range(0, len(ids), batch):
+    rank = db.func.row_number().over(partition_by=column, order_by=Match.score.desc()).label('rank')
+    ranked = db.session.query(column.label('id'), Match.score.label('score'), rank)\
+                       .filter(column.in_(ids[start:start + batch])).subquery()
+    thresholds.update(db.session.query(ranked.c.id, ranked.c.score).filter(ranked.c.rank == k).all())
+  return thresholds
+
+def trim_matches(column, other, ids, k, batch=5000):
+  # drops the rows that fell below the k best of the given entities, unless
+  # they are still among the k best of their other side
+  def ranked(partition, order, ids, keep):
+    rows = set()
+    for start in range(0, len(ids), batch):
+      rank = db.func.row_number().over(partition_by=partition, order_by=(Match.score.desc(), order)).label('rank')
+      ranked = db.session.query(Match.artist_id, Match.venue_id, rank)\
+                         .filter(partition.in_(ids[start:start + batch])).subquery()
+      condition = ranked.c.rank <= k if keep else ranked.c.rank > k
+      rows.update(db.session.query(ranked.c.artist_id, ranked.c.venue_id).filter(condition).all())
+    return rows
+
+  below = ranked(column, other, ids, False)
+  side = 0 if other.key == 'artist_id' else 1
+  below -= ranked(other, column, sorted(set(row[side] for row in below)), True)
+  match = Match.__table__
+  below = list(below)
+  for start in range(0, len(below), batch):
+    db.session.execute(match.delete().where(db.tuple_(match.c.artist_id, match.c.venue_id).in_(below[start:start + batch])))
+  return len(below)
+
+def refresh_matches(artist_ids=None, venue_ids=None):
+  # without ids every pair is rescored, with ids only the rows of those
+  # entities are replaced and they are slotted into the other side's lists
+  # wherever they now beat the k-th best match, pushing the k-th out. The
+  # other side's lists that lost a stale row are topped up to their k best
+  if artist_ids is not None and venue_ids is not None:
+    refresh_matches(artist_ids=artist_ids)
+    refresh_matches(venue_ids=venue_ids)
+    return
+
+  k = app.config['MATCHES_PER_ENTITY']
+  match = Match.__table__
+  artists, venues, history = load_match_sides(artist_ids, venue_ids)
+  pairs = {}
+  displaced = None
+
+  # stale rows go first so they do not count towards the thresholds below
+  if artist_ids is not None:
+    lost = [venue_id for venue_id, in db.session.query(Match.venue_id).filter(Match.artist_id.in_(artist_ids)).distinct()]
+    db.session.execute(match.delete().where(match.c.artist_id.in_(artist_ids)))
+  elif venue_ids is not None:
+    lost = [artist_id for artist_id, in db.session.query(Match.artist_id).filter(Match.venue_id.in_(venue_ids)).distinct()]
+    db.session.execute(match.delete().where(match.c.venue_id.in_(venue_ids)))
+  else:
+    db.session.execute(match.delete())
+
+  if artist_ids is None and venue_ids is None:
+    for artist_id, venue_id, score in matchmaking.top_matches(artists, venues, history, k):
+      pairs[artist_id, venue_id] = score
+
+  elif len(artists.ids) and len(venues.ids):
+    scores = matchmaking.score_block(artists, venues, history, 0, len(artists.ids))
+    if artist_ids is not None:
+      own = matchmaking.top_k(scores, k, axis=1)
+      rows = np.repeat(np.arange(len(artists.ids)), own.shape[1])
+      columns = own.ravel()
+      # only rows scoring above zero are stored, so only those venues are ranked
+      limits = match_limits(Match.venue_id, venues.ids, (scores > 0).any(axis=0), k)
+      better = np.nonzero(scores > limits[None, :])
+      displaced = (Match.venue_id, Match.artist_id, venues.ids[np.unique(better[1])].tolist())
+    else:
+      own = matchmaking.top_k(scores, k, axis=0)
+      rows = own.ravel()
+      columns = np.tile(np.arange(len(venues.ids)), own.shape[0])
+      limits = match_limits(Match.artist_id, artists.ids, (scores > 0).any(axis=1), k)
+      better = np.nonzero(scores > limits[:, None])
+      displaced = (Match.artist_id, Match.venue_id, artists.ids[np.unique(better[0])].tolist())
+    for i, j in list(zip(rows, columns)) + list(zip(*better)):
+      pairs[int(artists.ids[i]), int(venues.ids[j])] = float(scores[i, j])
+
+  rows = [{'artist_id': artist_id, 'venue_id': venue_id, 'score': score}
+          for (artist_id, venue_id), score in pairs.items() if score > 0]
+  for start in range(0, len(rows), 5000):
+    db.session.execute(match.insert(), rows[start:start + 5000])
+  if artist_ids is not None or venue_ids is not None:
+    column, other = (Match.venue_id, Match.artist_id) if artist_ids is not None else (Match.artist_id, Match.venue_id)
+    if lost:
+      top_up_matches(column, lost, k)
+    # what the new rows and the top up pushed below the k best goes
+    trim_matches(column, other, sorted(set(lost) | set(displaced[2] if displaced else ())), k)
+  db.session.commit()
+  return len(rows)
+
+def top_up_matches(column, ids, k):
+  # stores the k best matches of the given artists or venues that are
+  # missing, each scored against the whole other side
+  if column.key == 'artist_id':
+    artists, venues, history = load_match_sides(artist_ids=ids)
+  else:
+    artists, venues, history = load_match_sides(venue_ids=ids)
+  if not len(artists.ids) or not len(venues.ids):
+    return 0
+  scores = matchmaking.score_block(artists, venues, history, 0, len(artists.ids))
+  if column.key == 'artist_id':
+    best = matchmaking.top_k(scores, k, axis=1)
+    rows, columns = np.repeat(np.arange(len(artists.ids)), best.shape[1]), best.ravel()
+  else:
+    best = matchmaking.top_k(scores, k, axis=0)
+    rows, columns = best.ravel(), np.tile(np.arange(len(venues.ids)), best.shape[0])
+  stored = set(db.session.query(Match.artist_id, Match.venue_id).filter(column.in_(ids)))
+  missing = [{'artist_id': int(artists.ids[i]), 'venue_id': int(venues.ids[j]), 'score': float(scores[i, j])}
+             for i, j in zip(rows, columns) if scores[i, j] > 0]
+  missing = [row for row in missing if (row['artist_id'], row['venue_id']) not in stored]
+  for start in range(0, len(missing), 5000):
+    db.session.execute(Match.__table__.insert(), missing[start:start + 5000])
+  return len(missing)
+
+def match_limits(column, ids, candidates, k):
+  # per entity of the other side the score a new row has to beat: its k-th
+  # best, nothing below k matches and unreachable for non candidates
+  limits = np.full(len(ids), np.inf)
+  limits[candidates] = -np.inf
+  thresholds = match_thresholds(column, ids[candidates].tolist(), k)
+  for i in np.nonzero(candidates)[0]:
+    limits[i] = thresholds.get(int(ids[i]), -np.inf)
+  return limits
+
+def refresh_queued_matches(shard, artist_ids, venue_ids):
+  # runs on the queue's thread, on the shard the write was pinned to
+  with app.app_context():
+    g.shard = shard
+    try:
+      refresh_matches(artist_ids, venue_ids)
+    except:
+      db.session.rollback()
+      raise
+    finally:
+      db.session.remove()
+
+match_queue = matchmaking.RefreshQueue(refresh_queued_matches, delay=app.config['MATCHES_REFRESH_DELAY'])
+
+def refresh_matches_after_write(artist_ids=None, venue_ids=None):
+  # queued, the refresh runs after the response on a thread of its own
+  if app.config['MATCHES_REFRESH_ON_WRITE']:
+    match_queue.put(artist_ids or (), venue_ids or (), key=pinned_shard())
+
+#----------------------------------------------------------------------------#
+# Geospatial.
+#----------------------------------------------------------------------------#
+
+gazetteer_places = None
+# (version, KDIndex), rebuilt once venue_geo_version moves
+venue_geo_index = None
+
+def gazetteer():
+  global gazetteer_places
+  if gazetteer_places is None:
+    gazetteer_places = geo.load_gazetteer(app.config['GAZETTEER_PATH'])
+  return gazetteer_places
+
+def locate(city, state):
+  # (latitude, longitude) of a city from the offline gazetteer, None when unknown
+  return gazetteer().get(((city or '').strip().lower(), (state or '').strip().upper()))
+
+def geocode_venue(venue):
+  place = locate(venue.city, venue.state)
+  if place is None:
+    venue.latitude, venue.longitude, venue.geohash = None, None, None
+  else:
+    venue.latitude, venue.longitude = place
+    venue.geohash = geo.encode(*place)
+
+def venue_geo_version():
+  # the newest updated_at and the number of live venues, of every shard: moves
+  # with each venue write once it commits, whichever process made it
+  return tuple(on_venues(lambda session: [tuple(session.query(db.func.max(Venue.updated_at), db.func.count(Venue.id)).one())]))
+
+def use_kdtree():
+  if app.config['GEO_INDEX'] == 'auto':
+    return db.engine.dialect.name == 'sqlite'
+  return app.config['GEO_INDEX'] == 'kdtree'
+
+def venues_near(latitude, longitude, k=None, radius_km=None):
+  # [(venue id, distance in km)] nearest first, the k nearest or all within
+  # radius_km; k only applies without a radius
+  global venue_geo_index
+  k = None if radius_km else k or app.config['GEO_NEAREST_K']
+
+  if use_kdtree():
+    # the version is read first, a write that commits while the rows are read
+    # leaves it behind and the next search rebuilds again
+    version = venue_geo_version()
+    cached = venue_geo_index
+    if cached is None or cached[0] != version:
+      rows = on_venues(lambda session: session.query(Venue.id, Venue.latitude, Venue.longitude)
+                                              .filter(Venue.latitude.isnot(None)).all())
+      cached = venue_geo_index = (version, geo.KDIndex([row.id for row in rows], [row.latitude for row in rows],
+                                                       [row.longitude for row in rows]))
+    if radius_km:
+      return cached[1].within(latitude, longitude, radius_km)
+    return cached[1].nearest(latitude, longitude, k)
+
+  def candidates(cells):
+    return on_venues(lambda session: session.query(Venue.id, Venue.latitude, Venue.longitude)
+                                            .filter(db.or_(*[Venue.geohash.like(cell + '%') for cell in cells])).all())
+  return geo.nearest_by_prefix(candidates, latitude, longitude, k, radius_km)
+
+#----------------------------------------------------------------------------#
+# Autocomplete.
+#----------------------------------------------------------------------------#
+
+autocomplete_index = None
+autocomplete_lock = threading.Lock()
+
+def city_label(city, state):
+  return '%s, %s' % (city.strip(), (state or '').strip().upper()) if city and city.strip() else None
+
+def autocomplete():
+  # built from one query per kind on first use, then kept current by the write handlers
+  global autocomplete_index
+  if autocomplete_index is None:
+    with autocomplete_lock:
+      if autocomplete_index is None:
+        index = prefix_index.Autocomplete()
+        index.indexes['venue'].build(on_venues(lambda session: session.query(Venue.id, Venue.name).all()))
+        index.indexes['artist'].build(db.session.query(Artist.id, Artist.name))
+        places = on_venues(lambda session: session.query(Venue.city, Venue.state).distinct().all()) + \
+                 db.session.query(Artist.city, Artist.state).distinct().all()
+        cities = set(city_label(city, state) for city, state in places)
+        index.indexes['city'].build((label, label) for label in cities if label)
+        index.indexes['genre'].build(db.session.query(Lookup.id, Lookup.description).filter(Lookup.parent_id.isnot(None)))
+        autocomplete_index = index
+  return autocomplete_index
+
+def index_autocomplete(kind, entity_id, name, city=None, state=None):
+  # after a successful write; an index that is not built yet reads the row itself later
+  index = autocomplete_index
+  if index is None:
+    return
+  index.indexes[kind].add(entity_id, name)
+  # cities are only ever added, a stale one still finds nothing on the search pages
+  label = city_label(city, state)
+  if label and label not in index.indexes['city'].labels:
+    index.indexes['city'].add(label, label)
+
+def unindex_autocomplete(kind, entity_id):
+  if autocomplete_index is not None:
+    autocomplete_index.indexes[kind].remove(entity_id)
+
+@app.before_first_request
+def warm_autocomplete():
+  # build off the request path so the first keystroke does not wait for it
+  def build():
+    with app.app_context():
+      try:
+        autocomplete()
+      except:
+        app.logger.exception('building the autocomplete index failed')
+      finally:
+        db.session.remove()
+  threading.Thread(target=build, daemon=True).start()
+
+#----------------------------------------------------------------------------#
+# Change feed.
+#----------------------------------------------------------------------------#
+
+CHANGE_FIELDS = {
+  'venue': ['name', 'city', 'state', 'address', 'phone', 'image_link', 'facebook_link', 'website_link',
+            'seeking_talent', 'seeking_description'],
+  'artist': ['name', 'city', 'state', 'phone', 'image_link', 'facebook_link', 'website_link',
+             'seeking_venue', 'seeking_description'],
+  'show': ['venue_id', 'artist_id', 'show_date'],
+}
+
+def change_payload(entity, obj, genres=None):
+  data = {}
+  for field in CHANGE_FIELDS[entity]:
+    value = getattr(obj, field)
+    data[field] = value.isoformat() if isinstance(value, datetime) else value
+  if genres is not None:
+    data['genres'] = list(genres)
+  return data
+
+def record_change(entity, entity_id, op, data=None):
+  # joins the caller's transaction, so the log and the row commit together
+  change = Change(entity=entity, entity_id=entity_id, op=op, data=data)
+  db.session.add(change)
+  return change
+
+def compact_changes(changes):
+  # one delta per entity: the latest data, a create stays a create, and an
+  # entity created and deleted inside the batch disappears altogether
+  deltas = {}
+  for change in changes:
+    key = (change.entity, change.entity_id)
+    previous = deltas.get(key)
+    op = change.op
+    if previous is not None:
+      if previous['op'] == 'create' and op == 'delete':
+        del deltas[key]
+        continue
+      if previous['op'] == 'create':
+        op = 'create'
+      del deltas[key]
+    deltas[key] = {'seq': change.seq, 'entity': change.entity, 'id': change.entity_id, 'op': op, 'data': change.data}
+  return sorted(deltas.values(), key=lambda delta: delta['seq'])
+
+#----------------------------------------------------------------------------#
+# Idempotent writes.
+#----------------------------------------------------------------------------#
+
+NATURAL_KEYS = {
+  'venue': (Venue, ['name', 'address', 'city', 'state']),
+  'artist': (Artist, ['name', 'city', 'state']),
+  'show': (Show, ['venue_id', 'artist_id', 'show_date']),
+}
+
+def dialect_insert(connection, table):
+  # INSERT with the ON CONFLICT clauses of the dialect in use
+  dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+  return dialect.insert(table)
+
+def column_values(obj):
+  # the columns set on a transient instance, the rest left to the table defaults
+  values = {}
+  for column in obj.__table__.columns:
+    value = getattr(obj, column.key)
+    if value is not None:
+      values[column.key] = value
+  return values
+
+def insert_unique(entity, values):
+  # one INSERT ... ON CONFLICT DO NOTHING on the natural key: the new id, or
+  # None when a live row with the same key exists. Core, so the ORM flush
+  # hooks (the show rollups) do not see it
+  model, key = NATURAL_KEYS[entity]
+  table = model.__table__
+  connection = db.session.connection()
+  shard = pinned_shard()
+  if shard is not None and connection.dialect.name == 'sqlite' and model in SHARD_ID_MODELS:
+    values = dict(values, id=next_shard_id(connection, model, shard))
+  statement = dialect_insert(connection, table).values(**values)\
+                .on_conflict_do_nothing(index_elements=key, index_where=table.c.deleted_at.is_(None))
+  if connection.dialect.name == 'postgresql':
+    return connection.execute(statement.returning(table.c.id)).scalar()
+  result = connection.execute(statement)
+  return result.inserted_primary_key[0] if result.rowcount else None
+
+def request_idempotency_key(form):
+  # the Idempotency-Key header of API clients, else the hidden field of the form
+  key = request.headers.get('Idempotency-Key') or form.idempotency_key.data
+  return key[:64] if key else None
+
+def claim_idempotency_key(key, endpoint):
+  # False when the key was already used and has not expired. Joins the
+  # caller's transaction, so a write that fails frees its key again, and a
+  # concurrent request with the same key waits on it and then sees it taken
+  if key is None:
+    return True
+  now = datetime.utcnow()
+  table = IdempotencyKey.__table__
+  connection = db.session.connection(bind_arguments={'mapper': db.inspect(IdempotencyKey)})
+  statement = dialect_insert(connection, table).values(
+    key=key, endpoint=endpoint, created_at=now, expires_at=now + timedelta(seconds=app.config['IDEMPOTENCY_KEY_TTL']))
+  statement = statement.on_conflict_do_update(index_elements=['key'], where=table.c.expires_at < now, set_={
+    'endpoint': statement.excluded.endpoint, 'created_at': statement.excluded.created_at,
+    'expires_at': statement.excluded.expires_at})
+  return connection.execute(statement).rowcount > 0
+
+#----------------------------------------------------------------------------#
+# Edits.
+#----------------------------------------------------------------------------#
+
+EDIT_GENRES = {'venue': (VenueGenres, VenueGenres.venue_id), 'artist': (ArtistGenres, ArtistGenres.artist_id)}
+
+def edit_values(entity, form):
+  # the column values an edit form submits, as stored
+  values = {field: getattr(form, field).data for field in CHANGE_FIELDS[entity]}
+  seeking = 'seeking_talent' if entity == 'venue' else 'seeking_venue'
+  values[seeking] = values[seeking] == 'Yes'
+  return values
+
+def genre_descriptions(entity, owner_id):
+  genres_model, owner_column = EDIT_GENRES[entity]
+  return {description: genre_id for description, genre_id in
+          db.session.query(Lookup.description, Lookup.id).join(genres_model, genres_model.genre_id == Lookup.id)
+                                                        .filter(owner_column == owner_id)}
+
+def apply_edit(entity, obj, values, genres):
+  # sets the columns and genre rows that differ from what is stored and
+  # returns their names. The flush is one UPDATE of those columns whose WHERE
+  # also matches the version that was read, so a concurrent save raises
+  # StaleDataError at commit instead of being overwritten
+  # genres first: their queries autoflush, the row must still be clean then
+  genres_model, owner_column = EDIT_GENRES[entity]
+  current = genre_descriptions(entity, obj.id)
+  removed = [genre_id for description, genre_id in current.items() if description not in genres]
+  added = [genre for genre in genres if genre not in current]
+  if removed:
+    genres_model.query.filter(owner_column == obj.id, genres_model.genre_id.in_(removed))\
+                      .delete(synchronize_session=False)
+  if added:
+    db.session.execute(genres_model.__table__.insert(), [
+      {owner_column.key: obj.id, 'genre_id': genre_id}
+      for genre_id, in db.session.query(Lookup.id).filter(Lookup.description.in_(added))])
+
+  changed = [field for field, value in values.items() if getattr(obj, field) != value]
+  for field in changed:
+    setattr(obj, field, values[field])
+  if removed or added:
+    changed.append('genres')
+  if changed:
+    # a genre only edit still updates the row, which moves its version
+    obj.updated_at = datetime.utcnow()
+  return changed
+
+def edit_conflicts(entity, obj, values, genres):
+  # (field, saved value, submitted value) where someone else's save and the
+  # rejected form disagree
+  conflicts = [(field, getattr(obj, field), value) for field, value in values.items() if getattr(obj, field) != value]
+  saved = sorted(genre_descriptions(entity, obj.id))
+  if saved != sorted(genres):
+    conflicts.append(('genres', ', '.join(saved), ', '.join(genres)))
+  return conflicts
+
+#----------------------------------------------------------------------------#
+# Sharding.
+#----------------------------------------------------------------------------#
+
+# with SHARDS set, venues with their shows, genre rows and matches live on the
+# shard of their region. Artists and the genre lookup are written to the main
+# database and copied to every shard. See shards.py
+shard_urls = shards.parse_urls(app.config['SHARDS'])
+shard_set = shards.ShardSet([(name, create_engine(url)) for name, url in shard_urls.items()],
+                            regions=shards.parse_urls(app.config['SHARD_REGIONS']),
+                            id_range=app.config['SHARD_ID_RANGE']) if shard_urls else None
+
+# found by id, so new rows take their id from the range of their shard
+SHARD_ID_MODELS = (Venue, Show)
+# copied to every shard, in this order; the closure and genre rows are replaced whole
+REPLICATED_MODELS = (Lookup, LookupClosure, Artist, ArtistGenres)
+# moved to the shard of their venue by "shard_split": model -> venue id column
+SHARDED_MODELS = ((Venue, 'id'), (VenueGenres, 'venue_id'), (Show, 'venue_id'), (ShowArchive, 'venue_id'), (Match, 'venue_id'))
+# always on the main database, also written by requests pinned to a shard:
+# the change log, the idempotency keys and the show rollups are read as one
+MAIN_TABLES = frozenset(model.__table__ for model in (Change, IdempotencyKey, ShowRollup))
+
+def pinned_shard():
+  # set by a request, or by a background job working on one shard
+  return g.get('shard') if has_app_context() else None
+
+def pin_shard(table, id):
+  # the rest of the request runs on the shard holding the row; an id no shard
+  # holds goes to the first one, where it is just as missing
+  if shard_set is not None:
+    g.shard = shard_set.locate(table, id) or shard_set.names[0]
+
+def pin_state(state):
+  # the rest of the request runs on the shard of the state's region
+  if shard_set is not None:
+    g.shard = shard_set.for_state(state)
+
+def shard_session(engine):
+  # a session of its own on one shard for the threads of a scatter, with the
+  # listeners of db.session (soft delete, rollups). No binds, those would send
+  # every model back to the main database
+  return db.session.session_factory(bind=engine, binds={})
+
+def on_shards(task):
+  # task(session) on every shard at once -> [result] in shard order
+  def run(name, engine):
+    session = shard_session(engine)
+    try:
+      return task(session)
+    finally:
+      session.close()
+  return [result for _, result in shard_set.scatter(run)]
+
+def on_venues(task):
+  # task(session) -> rows where the venues live: on every shard at once, the
+  # rows of all of them in one list, or on the main database
+  if shard_set is None:
+    return list(task(db.session))
+  return list(itertools.chain(*on_shards(task)))
+
+def gather_shards(stream, key, buffer=1000):
+  # stream(session) of every shard, each sorted by key, merged into one sorted
+  # iterator; every shard is read on a thread and a session of its own
+  def run(name, engine):
+    session = shard_session(engine)
+    try:
+      for row in stream(session):
+        yield row
+    finally:
+      session.close()
+  return shard_set.gather(run, key=key, buffer=buffer)
+
+def next_shard_id(connection, model, name):
+  # the id after the largest one in the shard's range. sqlite numbers a new row
+  # after the largest id, copied rows from before the split included, so its
+  # inserts set it explicitly; on postgres the sequence starts there
+  column = model.__table__.c.id
+  base = shard_set.id_base(name)
+  last = connection.execute(db.select([db.func.max(column)])
+                              .where(column >= base, column < base + shard_set.id_range)).scalar()
+  return base if last is None else last + 1
+
+def upsert_rows(connection, table, rows, replace=True):
+  # insert, or with replace overwrite the rows with the same primary key
+  if not rows:
+    return
+  statement = dialect_insert(connection, table)
+  keys = [column.name for column in table.primary_key]
+  values = {column.name: statement.excluded[column.name] for column in table.columns if column.name not in keys}
+  if replace and values:
+    statement = statement.on_conflict_do_update(index_elements=keys, set_=values)
+  else:
+    statement = statement.on_conflict_do_nothing()
+  connection.execute(statement, rows)
+
+def copy_rows(table, names, where=None, replace=True, batch=1000):
+  # streams the rows of the main database into the named shards, one
+  # transaction per batch and shard, the shards written at once
+  def write(name, engine):
+    with engine.begin() as connection:
+      upsert_rows(connection, table, rows, replace)
+  select = table.select().order_by(*table.primary_key.columns)
+  if where is not None:
+    select = select.where(where)
+  with db.engine.connect() as connection:
+    result = connection.execution_options(stream_results=True).execute(select)
+    while True:
+      rows = [dict(row._mapping) for row in result.fetchmany(batch)]
+      if not rows:
+        return
+      shard_set.scatter(write, names)
+
+def replicate_catalogue(batch=1000):
+  # the genre lookup and every artist, main database -> every shard. The
+  # artist changes logged while it copies are replayed by catch_up_shards
+  def clear(name, engine):
+    with engine.begin() as connection:
+      connection.execute(table.delete())
+  with db.engine.connect() as connection:
+    seq = connection.execute(db.select([db.func.max(Change.__table__.c.seq)])).scalar() or 0
+  for model in REPLICATED_MODELS:
+    table = model.__table__
+    if model in (LookupClosure, ArtistGenres):
+      shard_set.scatter(clear)
+    copy_rows(table, shard_set.names, batch=batch)
+  def mark(name, engine):
+    with engine.begin() as connection:
+      move_shard_cursor(connection, seq)
+  shard_set.scatter(mark)
+
+def move_shard_cursor(connection, seq):
+  # forward only, a slower run that read less does not move it back
+  table = ShardCursor.__table__
+  statement = dialect_insert(connection, table).values(name='artists', seq=seq)
+  connection.execute(statement.on_conflict_do_update(index_elements=['name'], where=table.c.seq < statement.excluded.seq,
+                                                     set_={'seq': statement.excluded.seq}))
+
+def replicate_artists(connection, artist_ids):
+  # the artists with their genre rows, main database -> the shard connection;
+  # artists purged from the main database go from the shard too
+  artist, genres = Artist.__table__, ArtistGenres.__table__
+  with db.engine.connect() as main:
+    artists = [dict(row._mapping) for row in main.execute(artist.select().where(artist.c.id.in_(artist_ids)))]
+    genre_rows = [dict(row._mapping) for row in main.execute(genres.select().where(genres.c.artist_id.in_(artist_ids)))]
+  upsert_rows(connection, artist, artists)
+  connection.execute(genres.delete().where(genres.c.artist_id.in_(artist_ids)))
+  upsert_rows(connection, genres, genre_rows)
+  purged = set(artist_ids) - set(row['id'] for row in artists)
+  if purged:
+    connection.execute(artist.delete().where(artist.c.id.in_(purged)))
+
+def catch_up_shard(engine, batch=1000):
+  # replays the artist changes logged after the shard's cursor: the changed
+  # artists are copied and the cursor moved in one transaction, so changes a
+  # failed run did not copy are copied by the next one. The cursor only moves
+  # over settled changes, a transaction that took a lower seq may still commit.
+  # Returns the number of artists copied
+  table = Change.__table__
+  copied = 0
+  while True:
+    settled = datetime.utcnow() - timedelta(seconds=app.config['CHANGES_SETTLE_SECONDS'])
+    with engine.begin() as connection:
+      since = connection.execute(db.select([ShardCursor.__table__.c.seq])
+                                   .where(ShardCursor.__table__.c.name == 'artists')).scalar() or 0
+      with db.engine.connect() as main:
+        changes = main.execute(db.select([table.c.seq, table.c.entity_id, table.c.changed_at])
+                                 .where(db.and_(table.c.entity == 'artist', table.c.seq > since))
+                                 .order_by(table.c.seq).limit(batch)).fetchall()
+      if not changes:
+        return copied
+      artist_ids = sorted(set(change.entity_id for change in changes))
+      replicate_artists(connection, artist_ids)
+      copied += len(artist_ids)
+      seq = max([change.seq for change in changes if change.changed_at <= settled] or [since])
+      move_shard_cursor(connection, seq)
+    if len(changes) < batch or seq == since:
+      return copied
+
+def catch_up_shards(batch=1000):
+  # every shard at once -> {name: artists copied}
+  return dict(shard_set.scatter(lambda name, engine: catch_up_shard(engine, batch)))
+
+def catch_up_shards_after_write():
+  # the write's Change row is committed, so a failure here only delays the
+  # copy until the next write or "shard_catch_up" replays it
+  if shard_set is None:
+    return
+  try:
+    catch_up_shards()
+  except:
+    app.logger.exception('catching up the shards failed')
+
+def split_shards(batch=1000):
+  # creates the schema on every shard, copies the artists and genres to all of
+  # them and every venue, with its genre rows, shows and matches, to the shard
+  # of its state. Rows a shard already holds are kept, so it can run again.
+  # Returns the venues per shard
+  for engine in shard_set.engines.values():
+    db.Model.metadata.create_all(engine)
+  replicate_catalogue(batch)
+  venue = Venue.__table__
+  homes = {name: [] for name in shard_set.names}
+  with db.engine.connect() as connection:
+    for venue_id, state in connection.execute(db.select([venue.c.id, venue.c.state]).order_by(venue.c.id)):
+      homes[shard_set.for_state(state)].append(venue_id)
+  for name, venue_ids in homes.items():
+    for start in range(0, len(venue_ids), batch):
+      chunk = venue_ids[start:start + batch]
+      for model, column in SHARDED_MODELS:
+        copy_rows(model.__table__, [name], model.__table__.c[column].in_(chunk), replace=False, batch=batch)
+  for name, engine in shard_set.engines.items():
+    with engine.begin() as connection:
+      if connection.dialect.name == 'postgresql':
+        for model in SHARD_ID_MODELS:
+          connection.execute(db.text("SELECT setval(pg_get_serial_sequence(:table, 'id'), :value, false)"),
+                             table='"%s"' % model.__tablename__, value=next_shard_id(connection, model, name))
+  return {name: len(venue_ids) for name, venue_ids in homes.items()}
+
+#----------------------------------------------------------------------------#
+# Live show updates.
+#----------------------------------------------------------------------------#
+
+broadcaster = broadcast.Broadcaster(broadcast.backend_from_url(app.config['BROADCAST_BACKEND']),
+                                    queue_size=app.config['BROADCAST_QUEUE_SIZE'])
+
+def show_events(show_ids):
+  # the payload pushed to /shows/stream subscribers, one joined query for all ids
+  rows = db.session.query(Show.id, Show.show_date, Venue.id.label('venue_id'), Venue.name.label('venue_name'),
+                          Venue.city, Artist.id.label('artist_id'), Artist.name.label('artist_name'),
+                          Artist.image_link.label('artist_image_link'))\
+                   .join(Venue, Show.venue_id == Venue.id)\
+                   .join(Artist, Show.artist_id == Artist.id)\
+                   .filter(Show.id.in_(show_ids)).all()
+  return {row.id: {
+    "id": row.id,
+    "venue_id": row.venue_id,
+    "venue_name": row.venue_name,
+    "city": row.city,
+    "artist_id": row.artist_id,
+    "artist_name": row.artist_name,
+    "artist_image_link": row.artist_image_link,
+    "start_time": str(row.show_date),
+  } for row in rows}
+
+def publish_show(show_id, seq):
+  # best effort like the other post-commit hooks
+  try:
+    event = show_events([show_id]).get(show_id)
+    if event is not None:
+      event['seq'] = seq
+      broadcaster.publish(event)
+  except:
+    app.logger.exception('publishing show %s failed', show_id)
+
+#----------------------------------------------------------------------------#
+# Show partitions.
+#----------------------------------------------------------------------------#
+
+def past_shows_of(show_column, archive_column, entity_id, today, other, session=None):
+  # past shows still attached to Show followed by the archived ones, each
+  # with its other side (the 'venue' or 'artist') loaded in the same query
+  session = session or db.session
+  shows = session.query(Show).filter(show_column == entity_id, Show.show_date < today)\
+                    .options(db.joinedload(getattr(Show, other)))\
+                    .order_by(Show.show_date.desc()).all()
+  archived = session.query(ShowArchive).filter(archive_column == entity_id, ShowArchive.show_date < today)\
+                                        .options(db.joinedload(getattr(ShowArchive, other)))\
+                                        .order_by(ShowArchive.show_date.desc()).all()
+  return shows + archived
+
+def show_tiles(shows, other):
+  # the show tiles of a venue or artist page; like those of /shows they are
+  # cached under the newest updated_at of the show and its other side
+  return [{
+    "id": show.id,
+    "version": max(show.updated_at, getattr(show, other).updated_at),
+    "show_date": show.show_date,
+    other: getattr(show, other),
+  } for show in shows]
+
+def month_start(date, months=0):
+  # first day of the month, shifted by months
+  index = date.year * 12 + date.month - 1 + months
+  return datetime(index // 12, index % 12 + 1, 1)
+
+def partition_name(start):
+  return 'Show_y%04dm%02d' % (start.year, start.month)
+
+def show_partitions(connection, parent):
+  # [(name, lower bound)] of the monthly partitions attached to parent
+  rows = connection.execute(db.text('''
+    SELECT child.relname
+    FROM pg_inherits
+    JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE parent.relname = :parent
+  '''), parent=parent).fetchall()
+  partitions = []
+  for name, in rows:
+    if name.startswith('Show_y'):
+      partitions.append((name, datetime(int(name[6:10]), int(name[11:13]), 1)))
+  return sorted(partitions, key=lambda partition: partition[1])
+
+def create_show_partition(connection, start):
+  # rows of the month that already landed in the default partition are moved
+  # into the new table before attaching it, attach would fail otherwise
+  name, end = partition_name(start), month_start(start, 1)
+  connection.execute(db.text('CREATE TABLE "%s" (LIKE "Show" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)' % name))
+  connection.execute(db.text('''
+    WITH moved AS (
+      DELETE FROM "Show_default" WHERE show_date >= :start AND show_date < :end RETURNING *
+    )
+    INSERT INTO "%s" (id, venue_id, artist_id, show_date, deleted_at, updated_at)
+    SELECT id, venue_id, artist_id, show_date, deleted_at, updated_at FROM moved
+  ''' % name), start=start, end=end)
+  connection.execute(db.text('ALTER TABLE "Show" ATTACH PARTITION "%s" FOR VALUES FROM (:start) TO (:end)' % name)
+                     .bindparams(start=start, end=end))
+  return name
+
+def archive_show_partition(connection, name, start):
+  connection.execute(db.text('ALTER TABLE "Show" DETACH PARTITION "%s"' % name))
+  connection.execute(db.text('ALTER TABLE "Show_Archive" ATTACH PARTITION "%s" FOR VALUES FROM (:start) TO (:end)' % name)
+                     .bindparams(start=start, end=month_start(start, 1)))
+
+def maintain_show_partitions(ahead, retain):
+  # creates the next months' partitions and archives the ones older than
+  # retain months, returns (created, archived) partition names
+  connection = db.session.connection()
+  this_month = month_start(datetime.now())
+  attached = dict(show_partitions(connection, 'Show'))
+  existing = set(attached.values())
+  created, archived = [], []
+
+  # the coming months, plus any month whose rows fell into the default partition
+  months = set(month_start(this_month, months) for months in range(ahead + 1))
+  months.update(row[0] for row in connection.execute(db.text(
+    'SELECT DISTINCT date_trunc(\'month\', show_date) FROM "Show_default"')))
+  for start in sorted(months - existing):
+    created.append(create_show_partition(connection, start))
+    attached[partition_name(start)] = start
+
+  cutoff = month_start(this_month, -retain)
+  for name, start in sorted(attached.items(), key=lambda partition: partition[1]):
+    if start < cutoff:
+      archive_show_partition(connection, name, start)
+      archived.append(name)
+
+  db.session.commit()
+  return created, archived
+
+#----------------------------------------------------------------------------#
+# Deduplication.
+#----------------------------------------------------------------------------#
+
+# entity -> (model, genres model, genre owner column, show column, archive show column)
+DEDUP_MODELS = {
+  'venue': (Venue, VenueGenres, VenueGenres.venue_id, Show.venue_id, ShowArchive.venue_id),
+  'artist': (Artist, ArtistGenres, ArtistGenres.artist_id, Show.artist_id, ShowArchive.artist_id),
+}
+
+def dedup_blocks(model):
+  # (id, name) lists per city/state block, streamed in block order so only
+  # one block is ever held in memory
+  place = (db.func.upper(db.func.trim(model.state)), db.func.lower(db.func.trim(model.city)))
+  rows = stream_query(db.session.query(model.id, model.name, *place).order_by(*place + (model.id,)))
+  for _, block in itertools.groupby(rows, key=lambda row: (row[2], row[3])):
+    yield [(row[0], row[1]) for row in block]
+
+def find_merge_suggestions(entity, threshold, batch=5000):
+  # replaces the pending suggestions of entity, pairs already merged or
+  # rejected are not suggested again; returns the number written
+  model = DEDUP_MODELS[entity][0]
+  suggestions = MergeSuggestion.__table__
+  db.session.execute(suggestions.delete().where(db.and_(suggestions.c.entity == entity,
+                                                        suggestions.c.status == 'pending')))
+  decided = set(db.session.query(MergeSuggestion.keep_id, MergeSuggestion.duplicate_id)
+                          .filter(MergeSuggestion.entity == entity))
+  params = dedup.minhash_params()
+  now = datetime.utcnow()
+  rows, total = [], 0
+  for block in dedup_blocks(model):
+    for keep_id, duplicate_id, score in dedup.find_duplicates(block, threshold, params,
+                                                              max_bucket=app.config['DEDUP_MAX_BUCKET']):
+      if (keep_id, duplicate_id) not in decided:
+        rows.append({'entity': entity, 'keep_id': keep_id, 'duplicate_id': duplicate_id, 'score': score,
+                     'status': 'pending', 'created_at': now})
+    if len(rows) >= batch:
+      db.session.execute(suggestions.insert(), rows)
+      total += len(rows)
+      rows = []
+  if rows:
+    db.session.execute(suggestions.insert(), rows)
+    total += len(rows)
+  db.session.commit()
+  return total
+
+def collide_shows(model, owner, other, keep_id, duplicate_id, now):
+  # soft deletes the live shows of the duplicate that the kept row also has
+  # (same other side and date) and returns them
+  table = model.__table__
+  kept = db.select([table.c[other], table.c.show_date]).where(db.and_(table.c[owner] == keep_id,
+                                                                     table.c.deleted_at.is_(None)))
+  rows = db.session.execute(db.select([table.c.id, table.c.venue_id, table.c.artist_id, table.c.show_date])
+                              .where(db.and_(table.c[owner] == duplicate_id, table.c.deleted_at.is_(None),
+                                             db.tuple_(table.c[other], table.c.show_date).in_(kept)))).fetchall()
+  if rows:
+    db.session.execute(table.update().where(table.c.id.in_([row.id for row in rows]))
+                                     .values(deleted_at=now, updated_at=now))
+  return rows
+
+def merge_entities(entity, keep_id, duplicate_id):
+  # moves the shows, genres and blank fields of the duplicate onto the kept
+  # row and soft deletes the duplicate, all in one transaction; the shows are
+  # re-pointed with one UPDATE however many there are
+  model, genres_model, owner_column, show_column, archive_column = DEDUP_MODELS[entity]
+  keep = model.query.filter(model.id == keep_id).first()
+  duplicate = model.query.filter(model.id == duplicate_id).first()
+  if keep is None or duplicate is None or keep_id == duplicate_id:
+    raise ValueError('cannot merge %s %s into %s' % (entity, duplicate_id, keep_id))
+
+  for field in CHANGE_FIELDS[entity]:
+    if getattr(keep, field) in (None, '') and getattr(duplicate, field) not in (None, ''):
+      setattr(keep, field, getattr(duplicate, field))
+  duplicate.deleted_at = datetime.utcnow()
+  # its genres and shows change in other tables
+  keep.updated_at = duplicate.deleted_at
+
+  # shows both rows have would break the natural key once moved: the
+  # duplicate's copies are soft deleted and taken off the rollups instead
+  other = 'artist_id' if entity == 'venue' else 'venue_id'
+  collided = collide_shows(Show, show_column.key, other, keep_id, duplicate_id, duplicate.deleted_at)
+  collided_ids = set(row.id for row in collided)
+  gone = [(row.venue_id, row.artist_id, row.show_date) for row in collided] + \
+         [(row.venue_id, row.artist_id, row.show_date)
+          for row in collide_shows(ShowArchive, archive_column.key, other, keep_id, duplicate_id, duplicate.deleted_at)]
+  for show_id in collided_ids:
+    record_change('show', show_id, 'delete')
+
+  # the feed sees every other re-pointed show as updated
+  show = Show.__table__.c
+  archive = ShowArchive.__table__.c
+  moved = db.session.execute(db.select([show.id, show.venue_id, show.artist_id, show.show_date, show.deleted_at])
+                               .where(show[show_column.key] == duplicate_id)).fetchall()
+  archived = db.session.execute(db.select([archive.venue_id, archive.artist_id, archive.show_date])
+                                  .where(db.and_(archive[archive_column.key] == duplicate_id,
+                                                 archive.deleted_at.is_(None)))).fetchall()
+  db.session.execute(Show.__table__.update().where(show[show_column.key] == duplicate_id)
+                                            .values({show_column.key: keep_id, 'updated_at': datetime.utcnow()}))
+  db.session.execute(ShowArchive.__table__.update().where(archive[archive_column.key] == duplicate_id)
+                                                   .values({archive_column.key: keep_id, 'updated_at': datetime.utcnow()}))
+  updates = [{
+    'entity': 'show', 'entity_id': row.id, 'op': 'update',
+    'data': dict(change_payload('show', row), **{show_column.key: keep_id}),
+  } for row in moved if row.id not in collided_ids]
+  if updates:
+    db.session.execute(Change.__table__.insert(), updates)
+
+  # and their rollup counts move from the duplicate's keys to the kept row's
+  counted = [(row.venue_id, row.artist_id, row.show_date) for row in moved if row.deleted_at is None] + \
+            [tuple(row) for row in archived]
+  if counted or gone:
+    position = ['venue', 'artist'].index(entity)
+    connection = db.session.connection()
+    counts = rollups.increments(rollup_facts(connection, counted + gone), -1)
+    counted = [tuple(keep_id if i == position else value for i, value in enumerate(row)) for row in counted]
+    upsert_rollups(rollup_connection(db.session), rollups.increments(rollup_facts(connection, counted), counts=counts))
+
+  # genres the kept row lacks are copied over with one INSERT ... SELECT
+  genres = genres_model.__table__
+  owner = genres.c[owner_column.key]
+  kept_genres = db.select([genres.c.genre_id]).where(owner == keep_id)
+  db.session.execute(genres.insert().from_select(
+    [owner_column.key, 'genre_id'],
+    db.select([db.literal(keep_id), genres.c.genre_id]).where(db.and_(owner == duplicate_id,
+                                                                      genres.c.genre_id.notin_(kept_genres)))))
+  db.session.execute(genres.delete().where(owner == duplicate_id))
+  match = Match.__table__
+  db.session.execute(match.delete().where(match.c[owner_column.key] == duplicate_id))
+
+  genre_names = [row[0] for row in db.session.query(Lookup.description).join(genres_model)
+                                                .filter(owner_column == keep_id)]
+  record_change(entity, keep_id, 'update', change_payload(entity, keep, genre_names))
+  record_change(entity, duplicate_id, 'delete')
+
+  # the pair is settled; other pending pairs of the duplicate are stale now
+  suggestions = MergeSuggestion.__table__
+  db.session.execute(suggestions.update().where(db.and_(suggestions.c.entity == entity,
+                                                        suggestions.c.keep_id == keep_id,
+                                                        suggestions.c.duplicate_id == duplicate_id))
+                                         .values(status='merged'))
+  db.session.execute(suggestions.delete().where(db.and_(
+    suggestions.c.entity == entity, suggestions.c.status == 'pending',
+    db.or_(suggestions.c.keep_id == duplicate_id, suggestions.c.duplicate_id == duplicate_id))))
+  name, city, state = keep.name, keep.city, keep.state
+  cities = [(city, state), (duplicate.city, duplicate.state)] if entity == 'venue' else []
+  db.session.commit()
+
+  unindex_autocomplete(entity, duplicate_id)
+  index_autocomplete(entity, keep_id, name, city, state)
+  if entity == 'venue':
+    refresh_matches_after_write(venue_ids=[keep_id])
+    refresh_feeds_after_write(venue_ids=[keep_id, duplicate_id], cities=cities)
+  else:
+    refresh_matches_after_write(artist_ids=[keep_id])
+    refresh_feeds_after_write(artist_ids=[keep_id, duplicate_id])
+  return len(moved)
+
+#----------------------------------------------------------------------------#
+# Analytics.
+#----------------------------------------------------------------------------#
+
+ROLLUP_FIELDS = ('venue_id', 'artist_id', 'show_date', 'deleted_at')
+
+stats_cache = {}
+stats_cache_lock = threading.Lock()
+
+def rollup_lookups(connection, venue_ids=None, artist_ids=None):
+  # venue id -> city label and artist id -> genre ids, of the given ids or all;
+  # Core so it can run inside a flush
+  venue, artist_genres = Venue.__table__.c, ArtistGenres.__table__.c
+  venues = db.select([venue.id, venue.city, venue.state])
+  genre_rows = db.select([artist_genres.artist_id, artist_genres.genre_id])
+  if venue_ids is not None:
+    venues = venues.where(venue.id.in_(venue_ids))
+  if artist_ids is not None:
+    genre_rows = genre_rows.where(artist_genres.artist_id.in_(artist_ids))
+  cities = {row.id: city_label(row.city, row.state) for row in connection.execute(venues)}
+  genres = {}
+  for artist_id, genre_id in connection.execute(genre_rows):
+    genres.setdefault(artist_id, []).append(genre_id)
+  return cities, genres
+
+def rollup_facts(connection, shows):
+  # (venue_id, artist_id, show_date) rows -> what rollups.increments takes;
+  # values set as strings (form data, the seed) are still strings inside the flush
+  shows = [(int(venue_id), int(artist_id), dateutil.parser.parse(show_date) if isinstance(show_date, str) else show_date)
+           for venue_id, artist_id, show_date in shows]
+  cities, genres = rollup_lookups(connection, set(show[0] for show in shows), set(show[1] for show in shows))
+  return [(venue_id, artist_id, show_date, cities.get(venue_id), genres.get(artist_id, ()))
+          for venue_id, artist_id, show_date in shows]
+
+def rollup_connection(session):
+  # Show_Rollup lives on the main database, also for a request pinned to a shard
+  return session.connection(bind_arguments={'mapper': db.inspect(ShowRollup)})
+
+def upsert_rollups(connection, counts, batch=5000):
+  # adds the deltas to Show_Rollup, one INSERT ... ON CONFLICT per batch
+  rows = [{'grain': grain, 'dimension': dimension, 'key': key, 'bucket': bucket, 'shows': delta}
+          for (grain, dimension, key, bucket), delta in counts.items() if delta]
+  if not rows:
+    return
+  statement = dialect_insert(connection, ShowRollup.__table__)
+  statement = statement.on_conflict_do_update(index_elements=['grain', 'dimension', 'key', 'bucket'],
+                                              set_={'shows': ShowRollup.__table__.c.shows + statement.excluded.shows})
+  for start in range(0, len(rows), batch):
+    connection.execute(statement, rows[start:start + batch])
+
+def rollup_value(show, name, before):
+  history = db.inspect(show).attrs[name].history
+  return history.deleted[0] if before and history.deleted else getattr(show, name)
+
+@db.event.listens_for(db.session, 'after_flush')
+def rollup_shows(session, flush_context):
+  # counts the shows this flush added, and moves the counts of the ones it
+  # re-dated, re-pointed or soft deleted, in the same transaction
+  added, removed = [], []
+  for show in session.new:
+    if isinstance(show, Show) and show.deleted_at is None:
+      added.append((show.venue_id, show.artist_id, show.show_date))
+  for show in session.dirty:
+    if not isinstance(show, Show) or not any(db.inspect(show).attrs[name].history.has_changes() for name in ROLLUP_FIELDS):
+      continue
+    before = [rollup_value(show, name, True) for name in ROLLUP_FIELDS]
+    after = [rollup_value(show, name, False) for name in ROLLUP_FIELDS]
+    if before[3] is None:
+      removed.append(tuple(before[:3]))
+    if after[3] is None:
+      added.append(tuple(after[:3]))
+  for show in session.deleted:
+    if isinstance(show, Show) and show.deleted_at is None:
+      removed.append((show.venue_id, show.artist_id, show.show_date))
+  if added or removed:
+    # the venues are read where the shows are, the counts go to the main database
+    connection = session.connection()
+    counts = rollups.increments(rollup_facts(connection, removed), -1)
+    upsert_rollups(rollup_connection(session), rollups.increments(rollup_facts(connection, added), counts=counts))
+
+def count_rollups(session):
+  # the rollup counts of every live show of one database, current and archived
+  cities, genres = rollup_lookups(session.connection())
+  counts = Counter()
+  for model in (Show, ShowArchive):
+    shows = stream_query(session.query(model.venue_id, model.artist_id, model.show_date))
+    counts = rollups.increments(((venue_id, artist_id, show_date, cities.get(venue_id), genres.get(artist_id, ()))
+                                 for venue_id, artist_id, show_date in shows), counts=counts)
+  return counts
+
+def rebuild_rollups(batch=10000):
+  # recounts every live show, current and archived; for what the flush hook
+  # does not see: purged venues and artists, merges and genre edits
+  if shard_set is None:
+    counts = count_rollups(db.session)
+  else:
+    counts = sum(on_shards(count_rollups), Counter())
+  db.session.execute(ShowRollup.__table__.delete())
+  upsert_rollups(rollup_connection(db.session), counts)
+  db.session.commit()
+  return len(counts)
+
+def rollup_labels(dimension, keys):
+  # display names of rollup keys; keys of deleted venues and artists are left out
+  ids = [int(key) for key in keys if key.isdigit()]
+  if dimension == 'venue':
+    return {str(row.id): row.name for row in
+            on_venues(lambda session: session.query(Venue.id, Venue.name).filter(Venue.id.in_(ids)).all())}
+  if dimension == 'artist':
+    return {str(row.id): row.name for row in db.session.query(Artist.id, Artist.name).filter(Artist.id.in_(ids))}
+  genres = {row.id: row.description for row in db.session.query(Lookup.id, Lookup.description)}
+  if dimension == 'genre':
+    return {key: genres.get(int(key)) for key in keys}
+  if dimension == 'genre_city':
+    return {key: '%s in %s' % (genres.get(int(key.split('|', 1)[0])), key.split('|', 1)[1]) for key in keys}
+  return {key: key or 'All shows' for key in keys}
+
+def show_stats(dimension, grain, start, end, limit):
+  # the top keys over [start, end] and the total per bucket, read from the
+  # rollup only, so the cost follows the number of keys and buckets
+  in_range = db.and_(ShowRollup.grain == grain, ShowRollup.bucket >= rollups.bucket(grain, start),
+                     ShowRollup.bucket <= end)
+  total = db.func.sum(ShowRollup.shows).label('shows')
+  # a few spare rows stand in for deleted venues and artists
+  top = db.session.query(ShowRollup.key, total).filter(in_range, ShowRollup.dimension == dimension)\
+                  .group_by(ShowRollup.key).having(total > 0)\
+                  .order_by(total.desc(), ShowRollup.key).limit(limit * 2).all()
+  series = db.session.query(ShowRollup.bucket, ShowRollup.shows)\
+                     .filter(in_range, ShowRollup.dimension == 'all').order_by(ShowRollup.bucket).all()
+  labels = rollup_labels(dimension, [key for key, _ in top])
+  return {
+    'dimension': dimension,
+    'grain': grain,
+    'from': start.isoformat(),
+    'to': end.isoformat(),
+    'top': [{'key': key, 'label': labels[key], 'shows': int(shows)} for key, shows in top if labels.get(key)][:limit],
+    'series': [{'bucket': bucket.isoformat(), 'shows': shows} for bucket, shows in series],
+  }
+
+def cached_show_stats(*args):
+  # the dashboard repeats the same few questions, answered for STATS_CACHE_SECONDS
+  now = time.time()
+  hit = stats_cache.get(args)
+  if hit is not None and hit[0] > now:
+    return hit[1]
+  data = show_stats(*args)
+  with stats_cache_lock:
+    if len(stats_cache) >= app.config['STATS_CACHE_ENTRIES']:
+      stats_cache.clear()
+    stats_cache[args] = (now + app.config['STATS_CACHE_SECONDS'], data)
+  return data
+
+def stats_params():
+  # (dimension, grain, from, to, limit) of the request, 400 on bad values
+  dimension = request.args.get('dimension', 'venue')
+  grain = request.args.get('grain', 'month')
+  if dimension not in rollups.DIMENSIONS or grain not in rollups.GRAINS:
+    abort(400)
+  try:
+    end = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else datetime.utcnow().date()
+    start = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') \
+            else end - timedelta(days=app.config['STATS_DEFAULT_DAYS'])
+    limit = min(int(request.args.get('limit', app.config['STATS_TOP_N'])), app.config['STATS_MAX_TOP_N'])
+  except ValueError:
+    abort(400)
+  if start > end or limit < 1:
+    abort(400)
+  return dimension, grain, start, end, limit
+
+#----------------------------------------------------------------------------#
+# Export.
+#----------------------------------------------------------------------------#
+
+# table -> model; genre rows follow the updated_at of their owner
+EXPORT_TABLES = {
+  'venue': Venue,
+  'artist': Artist,
+  'show': Show,
+  'venue_genres': VenueGenres,
+  'artist_genres': ArtistGenres,
+  'genres': Lookup,
+}
+GENRE_OWNERS = {VenueGenres: (Venue, VenueGenres.venue_id), ArtistGenres: (Artist, ArtistGenres.artist_id)}
+EXPORT_KINDS = [(db.Boolean, 'bool'), (db.Integer, 'int'), (db.Float, 'float'), (db.DateTime, 'datetime'),
+                (db.Date, 'date')]
+
+def export_columns(model):
+  # [(name, kind)] in table order, the kinds exports.py maps to file types
+  columns = []
+  for column in model.__table__.columns:
+    kind = next((kind for type_, kind in EXPORT_KINDS if isinstance(column.type, type_)), 'str')
+    columns.append((column.key, kind))
+  return columns
+
+def export_rows(table, since=None):
+  # every row of table through a server side cursor in primary key order.
+  # Without since only live rows; with it the rows written since then,
+  # soft deleted ones included so the reader can drop them
+  model = EXPORT_TABLES[table]
+  names = [name for name, _ in export_columns(model)]
+  sharded = dict(SHARDED_MODELS)
+  # archived shows are shows too
+  for model in [model, ShowArchive] if model is Show else [model]:
+    def rows(session, model=model):
+      query = session.query(*[getattr(model, name) for name in names])
+      if model in GENRE_OWNERS:
+        owner, owner_column = GENRE_OWNERS[model]
+        query = query.join(owner, owner.id == owner_column)
+        if since is not None:
+          query = query.filter(owner.updated_at >= since)
+      elif since is not None and hasattr(model, 'updated_at'):
+        query = query.filter(model.updated_at >= since)
+      if since is not None:
+        query = query.execution_options(include_deleted=True)
+      for row in stream_query(query.order_by(*model.__table__.primary_key.columns)):
+        yield tuple(row)
+    if model in sharded and shard_set is not None:
+      # every shard in primary key order, merged
+      positions = [names.index(column.key) for column in model.__table__.primary_key.columns]
+      for row in gather_shards(rows, key=lambda row: [row[i] for i in positions],
+                               buffer=app.config['STREAM_YIELD_PER']):
+        yield row
+    else:
+      for row in rows(db.session):
+        yield row
+
+def export_chunks(table, format, since, meter):
+  return meter.count_bytes(exports.chunks(format, export_columns(EXPORT_TABLES[table]),
+                                          meter.count_rows(export_rows(table, since)),
+                                          app.config['EXPORT_BATCH_SIZE']))
+
+#----------------------------------------------------------------------------#
+# Calendar feeds.
+#----------------------------------------------------------------------------#
+
+feed_etags = calendars.Etags()
+
+def feed_path(kind, key):
+  # kind is venue, artist or city; a city key is (city, state)
+  if kind == 'city':
+    key = hashlib.sha1(('%s|%s' % key).encode('utf-8')).hexdigest()[:16]
+  return os.path.join(app.config['ICS_DIR'], '%s-%s.ics' % (kind, key))
+
+def feed_shows(kind, key, session=None):
+  # upcoming shows of the venue, artist or city: one range scan of the
+  # (venue_id|artist_id, show_date) index, or of the venue city index for a city
+  if kind == 'artist' and session is None and shard_set is not None:
+    # an artist plays on every shard
+    shows = sorted(itertools.chain(*on_shards(lambda session: feed_shows(kind, key, session))),
+                   key=lambda show: (show.show_date, show.id))
+    return shows[:app.config['ICS_MAX_EVENTS']]
+  session = session or db.session
+  query = session.query(Show.id, Show.show_date, Show.updated_at, Venue.id.label('venue_id'),
+                        Venue.name.label('venue_name'), Venue.address, Venue.city, Venue.state,
+                        Artist.name.label('artist_name'))\
+                 .join(Venue, Show.venue_id == Venue.id)\
+                 .join(Artist, Show.artist_id == Artist.id)\
+                 .filter(Show.show_date > datetime.now())
+  if kind == 'venue':
+    query = query.filter(Show.venue_id == key)
+  elif kind == 'artist':
+    query = query.filter(Show.artist_id == key)
+  else:
+    query = query.filter(Venue.city == key[0], Venue.state == key[1])
+  return query.order_by(Show.show_date, Show.id).limit(app.config['ICS_MAX_EVENTS']).all()
+
+def render_feed(kind, key):
+  # the .ics bytes, None for a venue or artist that does not exist (any more)
+  if kind == 'venue':
+    owner = db.session.query(Venue.name).filter(Venue.id == key).first()
+  elif kind == 'artist':
+    owner = db.session.query(Artist.name).filter(Artist.id == key).first()
+  else:
+    owner = ('Shows in ' + city_label(*key),)
+  if owner is None:
+    return None
+  hours = timedelta(hours=app.config['ICS_EVENT_HOURS'])
+  events = [calendars.Event(
+    uid='show-%d@%s' % (show.id, app.config['ICS_UID_DOMAIN']),
+    start=show.show_date,
+    end=show.show_date + hours,
+    stamp=show.updated_at,
+    summary='%s at %s' % (show.artist_name, show.venue_name),
+    location=', '.join(part for part in (show.venue_name, show.address, city_label(show.city, show.state)) if part),
+    url='%s/venues/%d' % (app.config['SITE_URL'].rstrip('/'), show.venue_id),
+  ) for show in feed_shows(kind, key)]
+  return calendars.render(owner[0], events)
+
+def refresh_feed(kind, key):
+  # (re)writes the feed file, returns its path or None when it has no owner
+  path = feed_path(kind, key)
+  data = render_feed(kind, key)
+  if data is None:
+    if os.path.exists(path):
+      os.remove(path)
+    return None
+  calendars.write_if_changed(path, data)
+  return path
+
+def refresh_feeds_after_write(venue_ids=(), artist_ids=(), cities=()):
+  # best effort like the other post-commit hooks. Only feeds somebody already
+  # fetched exist as files; the others are rendered on their first request
+  feeds = [('venue', key) for key in venue_ids] + [('artist', key) for key in artist_ids] + \
+          [('city', key) for key in cities if key[0]]
+  for kind, key in feeds:
+    try:
+      if os.path.exists(feed_path(kind, key)):
+        refresh_feed(kind, key)
+    except:
+      app.logger.exception('refreshing the %s %s calendar failed', kind, key)
+
+def serve_feed(kind, key):
+  path = feed_path(kind, key)
+  try:
+    age = time.time() - os.path.getmtime(path)
+  except OSError:
+    age = None
+  # past shows fall out of a feed nobody wrote to for a while
+  if age is None or age > app.config['ICS_MAX_AGE']:
+    if refresh_feed(kind, key) is None:
+      abort(404)
+  response = send_file(path, mimetype='text/calendar', conditional=True, add_etags=False,
+                       cache_timeout=app.config['ICS_CACHE_SECONDS'])
+  response.set_etag(feed_etags.get(path))
+  return response.make_conditional(request)
+
+#----------------------------------------------------------------------------#
+# Sitemaps.
+#----------------------------------------------------------------------------#
+
+SITEMAP_PAGES = ['/', '/venues', '/artists', '/shows']
+
+def keyset_scan(model, chunk, session=None):
+  # (id, updated_at) of the live rows in id order, chunk rows per query; each
+  # query starts after the last id seen so none gets slower deeper in the table
+  session = session or db.session
+  last = 0
+  while True:
+    rows = session.query(model.id, model.updated_at).filter(model.id > last)\
+                     .order_by(model.id).limit(chunk).all()
+    if not rows:
+      return
+    for row in rows:
+      yield row
+    last = rows[-1].id
+
+def generate_sitemaps():
+  # writes the urlsets, the index and robots.txt to SITEMAP_DIR, returns the
+  # [(filename, lastmod, changed)] of the urlsets and the number of stale files removed
+  directory = app.config['SITEMAP_DIR']
+  os.makedirs(directory, exist_ok=True)
+  site = app.config['SITE_URL'].rstrip('/')
+  max_urls, chunk = app.config['SITEMAP_MAX_URLS'], app.config['SITEMAP_CHUNK_SIZE']
+
+  pages = sitemaps.SitemapWriter(directory, 'pages', max_urls)
+  for path in SITEMAP_PAGES:
+    pages.add(site + path)
+  parts = pages.close()
+  for name, model in (('venues', Venue), ('artists', Artist)):
+    writer = sitemaps.SitemapWriter(directory, name, max_urls)
+    if model is Venue and shard_set is not None:
+      rows = gather_shards(lambda session: keyset_scan(Venue, chunk, session), key=lambda row: row.id)
+    else:
+      rows = keyset_scan(model, chunk)
+    for row in rows:
+      writer.add('%s/%s/%d' % (site, name, row.id), row.updated_at)
+    parts += writer.close()
+
+  # the urlsets are static files, the index names them by their static url
+  base = '%s%s/%s' % (site, app.static_url_path, os.path.relpath(directory, app.static_folder).replace(os.sep, '/'))
+  sitemaps.write_index(directory, base, [(name, lastmod) for name, lastmod, _ in parts])
+  with open(os.path.join(directory, 'robots.txt'), 'w') as robots:
+    robots.write('User-agent: *\nAllow: /\nSitemap: %s/sitemap.xml\n' % site)
+  removed = sitemaps.clean(directory, set(name for name, _, _ in parts) | {'sitemap.xml'})
+  return parts, removed
+
+#----------------------------------------------------------------------------#
+# Catalogue snapshot.
+#----------------------------------------------------------------------------#
+
+def catalogue_version():
+  # every write records a Change, so the newest seq versions the whole catalogue
+  with app.app_context():
+    try:
+      return db.session.query(db.func.max(Change.seq)).scalar() or 0
+    finally:
+      db.session.remove()
+
+def upcoming_show_counts(session, owner_column):
+  # subquery of (owner_id, num_upcoming_shows) per venue or artist
+  return session.query(owner_column.label('owner_id'), db.func.count(Show.id).label('num_upcoming_shows'))\
+                .filter(Show.show_date > datetime.now()).group_by(owner_column).subquery()
+
+def venue_listing(session):
+  # (id, name, city, state, num_upcoming_shows) of every venue in city order,
+  # what /venues prints whether it reads the snapshot or the database
+  upcoming = upcoming_show_counts(session, Show.venue_id)
+  return session.query(Venue.id, Venue.name, Venue.city, Venue.state,
+                       db.func.coalesce(upcoming.c.num_upcoming_shows, 0).label('num_upcoming_shows'))\
+                .outerjoin(upcoming, upcoming.c.owner_id == Venue.id)\
+                .order_by(Venue.city, Venue.id)
+
+def load_catalogue(version):
+  # runs on the catalogue thread; plain column tuples, no ORM instances
+  with app.app_context():
+    try:
+      now = datetime.now()
+      venue_rows = venue_listing(db.session)
+
+      artist_upcoming = db.session.query(Show.artist_id, db.func.count(Show.id).label('num_upcoming_shows'))\
+                                  .filter(Show.show_date > now).group_by(Show.artist_id).subquery()
+      artist_rows = db.session.query(Artist.id, Artist.name, Artist.city, Artist.state, artist_upcoming.c.num_upcoming_shows)\
+                              .outerjoin(artist_upcoming, artist_upcoming.c.artist_id == Artist.id)
+
+      # every ancestor of an artist's genres, so a parent genre filter matches its subgenres
+      artist_genre_rows = db.session.query(ArtistGenres.artist_id, Lookup.description)\
+                                    .join(LookupClosure, LookupClosure.descendant_id == ArtistGenres.genre_id)\
+                                    .join(Lookup, Lookup.id == LookupClosure.ancestor_id)
+
+      show_rows = stream_query(db.session.query(Show.show_date, Venue.id, Venue.name, Artist.id, Artist.name, Artist.image_link,
+                                                Show.id, Show.updated_at, Venue.updated_at, Artist.updated_at)
+                                         .join(Venue, Show.venue_id == Venue.id)
+                                         .join(Artist, Show.artist_id == Artist.id)
+                                         .order_by(Show.show_date))
+
+      return catalogue.build_snapshot(version, venue_rows, artist_rows, artist_genre_rows, show_rows)
+    finally:
+      db.session.remove()
+
+listing_catalogue = catalogue.Catalogue(load_catalogue, catalogue_version,
+                                        check_seconds=app.config['CATALOGUE_CHECK_SECONDS'],
+                                        max_age=app.config['CATALOGUE_MAX_AGE'])
+
+def catalogue_snapshot():
+  # None when the mode is off or the first snapshot is still building; the
+  # snapshot is read from the main database, so sharded listings skip it
+  if not app.config['CATALOGUE_SNAPSHOT'] or shard_set is not None:
+    return None
+  return listing_catalogue.current()
+
+@db.event.listens_for(db.session, 'after_commit')
+def bump_catalogue(session):
+  # a commit without catalogue changes only costs the thread one version check
+  if app.config['CATALOGUE_SNAPSHOT']:
+    listing_catalogue.bump()
+
+#----------------------------------------------------------------------------#
+# Admission control.
+#----------------------------------------------------------------------------#
+
+limiter = admission.Limiter({name: admission.Budget(**budget) for name, budget in app.config['ADMISSION_BUDGETS'].items()},
+                            admission.store_from_url(app.config['ADMISSION_STORE']),
+                            retry_after=app.config['ADMISSION_RETRY_AFTER'])
+
+@app.before_request
+def admit_request():
+  # over budget requests are answered before any query runs
+  group = app.config['ADMISSION_ROUTES'].get(request.endpoint)
+  if not app.config['ADMISSION_ENABLED'] or group is None:
+    return None
+  shed = limiter.admit(group, request.remote_addr)
+  if shed is not None:
+    status, retry_after = shed
+    message = 'Too many requests' if status == 429 else 'Server busy'
+    return Response(message + ', retry in %d seconds\n' % retry_after, status=status, mimetype='text/plain',
+                    headers={'Retry-After': str(retry_after)})
+  g.admission_group = group
+
+@app.teardown_request
+def release_request(exception=None):
+  # streamed pages keep their slot until the last chunk is sent
+  group = g.pop('admission_group', None)
+  if group is not None:
+    limiter.release(group)
+
+#----------------------------------------------------------------------------#
+# Batch API.
+#----------------------------------------------------------------------------#
+
+# in the order they are dispatched, a type only wants the ones after it
+BATCH_TYPES = ('shows', 'venues', 'artists', 'genres')
+
+def request_loaders():
+  # one set per request, so ids already read are never read twice
+  if 'batch_loaders' not in g:
+    g.batch_loaders = {
+      "shows": loaders.Loader(fetch_shows),
+      "venues": loaders.Loader(genre_owner_fetcher(Venue, VenueGenres.venue_id, 'venue')),
+      "artists": loaders.Loader(genre_owner_fetcher(Artist, ArtistGenres.artist_id, 'artist')),
+      "genres": loaders.Loader(fetch_genres),
+    }
+  return g.batch_loaders
+
+def fetch_shows(ids):
+  rows = db.session.query(Show.id, Show.venue_id, Show.artist_id, Show.show_date).filter(Show.id.in_(ids))
+  found = {row.id: {
+    "id": row.id,
+    "venue_id": row.venue_id,
+    "artist_id": row.artist_id,
+    "start_time": str(row.show_date),
+  } for row in rows}
+  batch = request_loaders()
+  batch['venues'].want_many(show['venue_id'] for show in found.values())
+  batch['artists'].want_many(show['artist_id'] for show in found.values())
+  return found
+
+def genre_owner_fetcher(model, owner_column, entity):
+  # venues or artists with the fields of the change feed plus their genre ids
+  columns = [model.id] + [getattr(model, field) for field in CHANGE_FIELDS[entity]]
+  genre_column = owner_column.class_.genre_id
+
+  def fetch(ids):
+    found = {row.id: dict(row._asdict(), genre_ids=[]) for row in db.session.query(*columns).filter(model.id.in_(ids))}
+    if found:
+      for owner_id, genre_id in db.session.query(owner_column, genre_column).filter(owner_column.in_(list(found))):
+        found[owner_id]['genre_ids'].append(genre_id)
+      request_loaders()['genres'].want_many(genre_id for owner in found.values() for genre_id in owner['genre_ids'])
+    return found
+  return fetch
+
+def fetch_genres(ids):
+  rows = db.session.query(Lookup.id, Lookup.description, Lookup.parent_id).filter(Lookup.id.in_(ids))
+  return {row.id: row._asdict() for row in rows}
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
@@ -119,10 +2004,112 @@ def format_datetime(value, format='medium'):
   
 app.jinja_env.filters['datetime'] = format_datetime
 
+thumbnail_index = images.ThumbnailIndex(app.config['THUMBNAIL_DIR'], app.config['MANIFEST_CHECK_SECONDS'])
+
+def thumbnail(image_link):
+  # serve the locally stored thumbnail when one was prefetched, else hotlink the original
+  filename = thumbnail_index.lookup(image_link)
+  if filename is None:
+    return image_link
+  directory = os.path.relpath(app.config['THUMBNAIL_DIR'], app.static_folder).replace(os.sep, '/')
+  return url_for('static', filename=directory + '/' + filename)
+
+app.jinja_env.filters['thumbnail'] = thumbnail
+
+@app.after_request
+def cache_thumbnails(response):
+  # thumbnail names are content hashes, so they never change once written
+  if request.endpoint == 'static' and request.path.startswith('/static/img/thumbs/') \
+      and not request.path.endswith(images.MANIFEST):
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['THUMBNAIL_MAX_AGE']
+    response.cache_control.immutable = True
+  return response
+
+asset_index = assets.AssetIndex(app.config['ASSETS_DIR'], app.config['MANIFEST_CHECK_SECONDS'])
+
+def asset_urls(bundle):
+  # hashed bundle url once "build_assets" ran, the individual source files otherwise
+  filename = asset_index.lookup(bundle)
+  if filename is None:
+    return [url_for('static', filename=source) for source in assets.BUNDLES[bundle]]
+  return [url_for('dist_asset', filename=filename)]
+
+app.jinja_env.globals['asset_urls'] = asset_urls
+
+# {% cache %} blocks, see fragments.py
+fragment_cache = fragments.FragmentCache(app.config['FRAGMENT_CACHE_ENTRIES'], app.config['FRAGMENT_CACHE_BYTES'])
+app.jinja_env.add_extension(fragments.FragmentCacheExtension)
+if app.config['FRAGMENT_CACHE']:
+  app.jinja_env.fragment_cache = fragment_cache
+
+@app.context_processor
+def check_fragment_cache():
+  # cached tiles hold thumbnail urls, a "thumbnails" run replaces them all
+  fragment_cache.check(thumbnail_index.refresh())
+  return {}
+
+#----------------------------------------------------------------------------#
+# Streaming.
+#----------------------------------------------------------------------------#
+
+def stream_template(template_name, **context):
+  # render in chunks so the first bytes go out before the whole page is built
+  app.update_template_context(context)
+  stream = app.jinja_env.get_template(template_name).stream(context)
+  stream.enable_buffering(app.config['STREAM_BUFFER_SIZE'])
+  return stream
+
+def gzip_chunks(chunks):
+  # sync flush after every chunk so compression does not hold back the stream
+  compressor = zlib.compressobj(app.config['STREAM_GZIP_LEVEL'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  for chunk in chunks:
+    data = compressor.compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+    data += compressor.flush(zlib.Z_SYNC_FLUSH)
+    if data:
+      yield data
+  yield compressor.flush()
+
+def streamed_response(template_name, **context):
+  chunks = stream_with_context(stream_template(template_name, **context))
+  response = Response(chunks, mimetype='text/html')
+  if request.accept_encodings['gzip']:
+    response.response = gzip_chunks(chunks)
+    response.headers['Content-Encoding'] = 'gzip'
+  response.vary.add('Accept-Encoding')
+  return response
+
+def stream_query(query):
+  # server side cursor, rows are fetched in batches instead of all at once
+  return query.execution_options(stream_results=True).yield_per(app.config['STREAM_YIELD_PER'])
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
+# bundles live under static/ so relative urls inside the stylesheets keep working
+@app.route('/static/dist/<path:filename>')
+def dist_asset(filename):
+  if filename == assets.MANIFEST or filename.endswith(('.gz', '.br', '.tmp')):
+    abort(404)
+
+  accepted = request.accept_encodings
+  encoding, suffix = None, ''
+  for name, extension in assets.ENCODINGS:
+    if accepted[name] and os.path.exists(os.path.join(app.config['ASSETS_DIR'], filename + extension)):
+      encoding, suffix = name, extension
+      break
+
+  response = send_from_directory(app.config['ASSETS_DIR'], filename + suffix,
+                                 mimetype='text/css' if filename.endswith('.css') else 'application/javascript')
+  if encoding:
+    response.headers['Content-Encoding'] = encoding
+  response.vary.add('Accept-Encoding')
+  response.cache_control.public = True
+  response.cache_control.max_age = app.config['ASSETS_MAX_AGE']
+  response.cache_control.immutable = True
+  return response
+
 @app.route('/')
 def index():
   return render_template('pages/home.html')
@@ -131,25 +2118,41 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
+def venue_search(session, search_term, ids=None, genres=None):
+  # (genre facets, [(id, name, num_upcoming_shows)]) of the venues of one
+  # database named like the term, or with the ids; genres, the ids of a genre
+  # subtree, narrows the venues but not the facets
+  matches = session.query(Venue.id)
+  if ids is not None:
+    matches = matches.filter(Venue.id.in_(ids))
+  else:
+    matches = matches.filter(Venue.name.like('%'+ search_term +'%'))
+  facets = genre_facets(VenueGenres, VenueGenres.venue_id, matches, session)
+  if genres is not None:
+    matches = matches.filter(Venue.id.in_(session.query(VenueGenres.venue_id).filter(VenueGenres.genre_id.in_(genres))))
+  upcoming = upcoming_show_counts(session, Show.venue_id)
+  venues = session.query(Venue.id, Venue.name, db.func.coalesce(upcoming.c.num_upcoming_shows, 0).label('num_upcoming_shows'))\
+                  .outerjoin(upcoming, upcoming.c.owner_id == Venue.id)\
+                  .filter(Venue.id.in_(matches)).all()
+  return facets, venues
+
+def venue_areas(session):
+  # the venues of one database grouped by city, each with its upcoming shows
+  return catalogue.group_areas(venue_listing(session).all())
+
 @app.route('/venues')
 def venues():
   # TODO: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
-  venues = db.session.query(db.func.count(Show.venue_id), Venue.id, Venue.name, Venue.city)\
-                     .outerjoin(Show)\
-                     .group_by(Venue.id).all()
-
-  cities = db.session.query(Venue.city, Venue.state).distinct(Venue.city).all()
-
-  data=[{
-    "city": city.city,
-    "state": city.state,
-    "venues": [{
-      "id": venue.id,
-      "name": venue.name,
-      "num_upcoming_shows": venue.count,
-    } for venue in venues if venue.city == city.city]
-  } for city in cities]
+  snapshot = catalogue_snapshot()
+  if snapshot is not None:
+    return render_template('pages/venues.html', areas=snapshot.areas)
+
+  if shard_set is not None:
+    # a city lives on a single shard, the areas of all of them are read at once
+    data = list(itertools.chain(*on_shards(venue_areas)))
+  else:
+    data = venue_areas(db.session)
 
   return render_template('pages/venues.html', areas=data)
 
@@ -159,13 +2162,36 @@ def search_venues():
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
   search_term = request.form.get('search_term', '')
-  venues = Venue.query.filter(Venue.name.like('%'+ search_term +'%')).all()
-  today = datetime.now()
+  genre_id = request.form.get('genre_id', type=int)
+  mode = request.form.get('mode', 'name')
+  distances = {}
+  ids = None
+
+  if mode == 'near':
+    # the term is a "City, ST" place from the gazetteer, or explicit coordinates
+    latitude = request.form.get('latitude', type=float)
+    longitude = request.form.get('longitude', type=float)
+    if latitude is None or longitude is None:
+      city, _, state = search_term.rpartition(',')
+      place = locate(city, state)
+      latitude, longitude = place if place else (None, None)
+    if latitude is not None and longitude is not None:
+      distances = dict(venues_near(latitude, longitude, radius_km=request.form.get('radius_km', type=float)))
+    ids = list(distances)
+
+  # venues may be spread over shards, each is searched on its own
+  genres = [genre for genre, in genre_subtree(genre_id)] if genre_id else None
+  results = on_venues(lambda session: [venue_search(session, search_term, ids, genres)])
+  facets = merge_facets(itertools.chain(*(facets for facets, _ in results)))
+  venues = sorted(itertools.chain(*(rows for _, rows in results)), key=lambda venue: venue.id)
+  if distances:
+    venues.sort(key=lambda venue: distances[venue.id])
 
   data = [{
     "id": venue.id, 
     "name": venue.name, 
-    "num_upcoming_shows": len([show for show in venue.shows if show.show_date > today])
+    "num_upcoming_shows": venue.num_upcoming_shows,
+    "distance_km": distances.get(venue.id)
     } for venue in venues]
 
   response={
@@ -173,20 +2199,29 @@ def search_venues():
     "data": data
   }
 
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''),
+                         facets=facets, genre_id=genre_id, mode=mode)
 
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
-  venue = Venue.query.get(venue_id)
-  genres = [genre.lookup.description for genre in venue.genres]
+  pin_shard(Venue.__table__, venue_id)
+  venue = Venue.query.get_or_404(venue_id)
+  # only queried when the cached genre block misses
+  genres = (description for description, in db.session.query(Lookup.description)
+                                                        .join(VenueGenres, VenueGenres.genre_id == Lookup.id)
+                                                        .filter(VenueGenres.venue_id == venue_id)
+                                                        .order_by(Lookup.description))
   today = datetime.now()
-  past_shows = [show for show in venue.shows if show.show_date < today]
-  upcoming_shows = [show for show in venue.shows if show.show_date > today]
+  # range filters on show_date so postgres only scans the matching partitions
+  past_shows = past_shows_of(Show.venue_id, ShowArchive.venue_id, venue_id, today, 'artist')
+  upcoming_shows = Show.query.filter(Show.venue_id == venue_id, Show.show_date > today)\
+                             .options(db.joinedload(Show.artist)).order_by(Show.show_date).all()
 
   data={
     "id": venue.id,
+    "updated_at": venue.updated_at,
     "name": venue.name,
     "genres": genres,
     "address": venue.address,
@@ -198,14 +2233,24 @@ def show_venue(venue_id):
     "seeking_talent": venue.seeking_talent,
     "seeking_description": venue.seeking_description,
     "image_link": venue.image_link,
-    "past_shows": past_shows,
-    "upcoming_shows": upcoming_shows,
+    "past_shows": show_tiles(past_shows, 'artist'),
+    "upcoming_shows": show_tiles(upcoming_shows, 'artist'),
     "past_shows_count": len(past_shows),
     "upcoming_shows_count": len(upcoming_shows),
+    "matches": db.session.query(Artist.id, Artist.name, Artist.image_link, Match.score)
+                         .join(Match, Match.artist_id == Artist.id)
+                         .filter(Match.venue_id == venue_id)
+                         .order_by(Match.score.desc())
+                         .limit(app.config['MATCHES_PER_ENTITY']).all() if venue.seeking_talent else [],
   }
 
   return render_template('pages/show_venue.html', venue=data)
 
+@app.route('/venues/<int:venue_id>/shows.ics')
+def venue_calendar(venue_id):
+  pin_shard(Venue.__table__, venue_id)
+  return serve_feed('venue', venue_id)
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
@@ -222,6 +2267,8 @@ def create_venue_submission():
   form = VenueForm(request.form)
   
   if form.validate():
+    venue_id = None
+    pin_state(form.state.data)
     try:
       name = form.name.data
       city = form.city.data
@@ -234,20 +2281,26 @@ def create_venue_submission():
       facebook_link = form.facebook_link.data
       image_link = form.image_link.data
       genres = form.genres.data
-      venue = Venue(name=name, address=address, city=city, state=state, phone=phone, website_link=website_link, facebook_link=facebook_link, seeking_talent=seeking_talent, seeking_description=seeking_description, image_link=image_link)
-      db.session.add(venue)
-
-      for genre in genres:
-        genre_id = Lookup.query.filter_by(description=genre).first().id
-        venueGenres = VenueGenres(venue_id=venue.id, genre_id=genre_id)
-        db.session.add(venueGenres)
-
+      # a resubmitted form (same key) or an already listed venue writes nothing
+      replay = not claim_idempotency_key(request_idempotency_key(form), 'create_venue')
+      if not replay:
+        venue = Venue(name=name, address=address, city=city, state=state, phone=phone, website_link=website_link, facebook_link=facebook_link, seeking_talent=seeking_talent, seeking_description=seeking_description, image_link=image_link)
+        geocode_venue(venue)
+        venue_id = insert_unique('venue', column_values(venue))
+
+      if venue_id is not None:
+        for genre in genres:
+          genre_id = Lookup.query.filter_by(description=genre).first().id
+          venueGenres = VenueGenres(venue_id=venue_id, genre_id=genre_id)
+          db.session.add(venueGenres)
+
+        record_change('venue', venue_id, 'create', change_payload('venue', venue, genres))
       db.session.commit()
 
     except:
       error = True
       db.session.rollback()
-      print(sys.exc_info())
+      app.logger.exception('creating venue failed')
     
     finally:
       db.session.close()
@@ -256,30 +2309,41 @@ def create_venue_submission():
       # TODO: on unsuccessful db insert, flash an error instead.
       flash('An error occurred. Venue ' + name + ' could not be listed.')
       # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
+    elif replay:
+      flash('Venue ' + name + ' was successfully listed!')
+    elif venue_id is None:
+      flash('Venue ' + name + ' is already listed.')
     else:
       # on successful db insert, flash success
       flash('Venue ' + name + ' was successfully listed!')
+      index_autocomplete('venue', venue_id, name, city, state)
+      refresh_matches_after_write(venue_ids=[venue_id])
   
   else:
     flash('Validation error occurred: ' + ' '.join(form.errors))
 
   return render_template('pages/home.html')
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@app.route('/venues/<int:venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
   # TODO: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
   error = False
+  pin_shard(Venue.__table__, venue_id)
+  venue = Venue.query.get_or_404(venue_id)
+  name = venue.name
+  city = (venue.city, venue.state)
   
   try:
-    venue = Venue.query.get(venue_id)
-    name = venue.name
-    venue.delete()
+    # only marks the venue; its shows are hidden with it and removed, together
+    # with the genre rows, by the batched "purge" command
+    venue.deleted_at = datetime.utcnow()
+    record_change('venue', venue_id, 'delete')
     db.session.commit()
   except:
     error = True
     db.session.rollback()
-    print(sys.exc_info())
+    app.logger.exception('deleting venue %s failed', venue_id)
   finally:
     db.session.close()
   
@@ -290,19 +2354,78 @@ def delete_venue(venue_id):
   else:
     # on successful db delete, flash success
     flash('Venue ' + name + ' was successfully deleted!')
+    unindex_autocomplete('venue', venue_id)
+    refresh_matches_after_write(venue_ids=[venue_id])
+    refresh_feeds_after_write(venue_ids=[venue_id], cities=[city])
 
   # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
-  render_template('pages/home.html')
+  return jsonify({"success": not error, "redirect": url_for('index')})
 
 
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
 def artists():
-  # TODO: replace with real data returned from querying the database
-  data = Artist.query.all()
-  return render_template('pages/artists.html', artists=data)
+  # paginated directory, only the listed columns are loaded and pages are
+  # navigated by keyset (the last row of the previous page) instead of offset
+  sort = request.args.get('sort', 'name')
+  if sort not in ('name', 'city', 'upcoming'):
+    sort = 'name'
+  state = request.args.get('state', '')
+  genre = request.args.get('genre', '')
+  # a malformed cursor is dropped, which serves the first page
+  after_key = request.args.get('after_key', type=int if sort == 'upcoming' else str)
+  after_id = request.args.get('after_id', type=int)
+  per_page = app.config['ARTISTS_PER_PAGE']
+
+  snapshot = catalogue_snapshot()
+  if snapshot is not None:
+    rows = snapshot.artist_page(sort, state, genre, after_key, after_id, per_page)
+  else:
+    upcoming = db.session.query(Show.artist_id, db.func.count(Show.id).label('num_upcoming_shows'))\
+                         .filter(Show.show_date > datetime.now())\
+                         .group_by(Show.artist_id).subquery()
+    num_upcoming_shows = db.func.coalesce(upcoming.c.num_upcoming_shows, 0)
+
+    query = db.session.query(Artist.id, Artist.name, Artist.city, Artist.state, num_upcoming_shows.label('num_upcoming_shows'))\
+                      .outerjoin(upcoming, upcoming.c.artist_id == Artist.id)
+
+    if state:
+      query = query.filter(Artist.state == state)
+    if genre:
+      # subgenres of the selected genre are included through the closure table
+      genre_ids = db.session.query(LookupClosure.descendant_id)\
+                            .join(Lookup, LookupClosure.ancestor_id == Lookup.id)\
+                            .filter(Lookup.description == genre)
+      query = query.filter(Artist.id.in_(db.session.query(ArtistGenres.artist_id)
+                                                   .filter(ArtistGenres.genre_id.in_(genre_ids))))
+
+    if sort == 'upcoming':
+      # busiest first, ties broken by id so the keyset is unique
+      if after_key is not None and after_id is not None:
+        query = query.filter(db.or_(num_upcoming_shows < after_key,
+                                    db.and_(num_upcoming_shows == after_key, Artist.id > after_id)))
+      query = query.order_by(num_upcoming_shows.desc(), Artist.id)
+    else:
+      column = Artist.name if sort == 'name' else Artist.city
+      if after_key is not None and after_id is not None:
+        query = query.filter(db.tuple_(column, Artist.id) > db.tuple_(after_key, after_id))
+      query = query.order_by(column, Artist.id)
+
+    # one extra row tells whether there is a next page
+    rows = query.limit(per_page + 1).all()
+
+  next_page = None
+  if len(rows) > per_page:
+    rows = rows[:per_page]
+    last = rows[-1]
+    key = {'name': last.name, 'city': last.city, 'upcoming': last.num_upcoming_shows}[sort]
+    next_page = url_for('artists', sort=sort, state=state, genre=genre, after_key=key, after_id=last.id)
+
+  return streamed_response('pages/artists.html', artists=rows, sort=sort, state=state, genre=genre,
+                           states=STATE_CHOICES, genres=GENRE_CHOICES, next_page=next_page,
+                           first_page=after_id is not None and url_for('artists', sort=sort, state=state, genre=genre))
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
@@ -310,7 +2433,12 @@ def search_artists():
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
   search_term = request.form.get('search_term', '')
-  artists = Artist.query.filter(Artist.name.ilike('%'+ search_term +'%')).all()
+  genre_id = request.form.get('genre_id', type=int)
+  matches = Artist.query.filter(Artist.name.ilike('%'+ search_term +'%'))
+  facets = genre_facets(ArtistGenres, ArtistGenres.artist_id, matches.with_entities(Artist.id))
+  if genre_id:
+    matches = matches.filter(Artist.id.in_(artists_in_genre(genre_id).with_entities(Artist.id)))
+  artists = matches.all()
   today = datetime.now()
 
   data = [{
@@ -324,20 +2452,38 @@ def search_artists():
     "data": data
   }
 
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''),
+                         facets=facets, genre_id=genre_id)
+
+def artist_shows(session, artist_id, today):
+  # (past, upcoming) shows of the artist in one database, with their venues
+  past_shows = past_shows_of(Show.artist_id, ShowArchive.artist_id, artist_id, today, 'venue', session)
+  upcoming_shows = session.query(Show).filter(Show.artist_id == artist_id, Show.show_date > today)\
+                                      .options(db.joinedload(Show.venue)).order_by(Show.show_date).all()
+  return past_shows, upcoming_shows
 
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
-  artist = Artist.query.get(artist_id)
-  genres = [genre.lookup.description for genre in artist.genres]
+  artist = Artist.query.get_or_404(artist_id)
+  # only queried when the cached genre block misses
+  genres = (description for description, in db.session.query(Lookup.description)
+                                                        .join(ArtistGenres, ArtistGenres.genre_id == Lookup.id)
+                                                        .filter(ArtistGenres.artist_id == artist_id)
+                                                        .order_by(Lookup.description))
   today = datetime.now()
-  past_shows = [show for show in artist.shows if show.show_date < today]
-  upcoming_shows = [show for show in artist.shows if show.show_date > today]
+  if shard_set is not None:
+    # an artist plays on every shard, all of them are read at once
+    shows = on_shards(lambda session: artist_shows(session, artist_id, today))
+    past_shows = sorted(itertools.chain(*[past for past, _ in shows]), key=lambda show: show.show_date, reverse=True)
+    upcoming_shows = sorted(itertools.chain(*[upcoming for _, upcoming in shows]), key=lambda show: show.show_date)
+  else:
+    past_shows, upcoming_shows = artist_shows(db.session, artist_id, today)
 
   data={
     "id": artist.id,
+    "updated_at": artist.updated_at,
     "name": artist.name,
     "genres": genres,
     "city": artist.city,
@@ -348,21 +2494,62 @@ def show_artist(artist_id):
     "seeking_venue": artist.seeking_venue,
     "seeking_description": artist.seeking_description,
     "image_link": artist.image_link,
-    "past_shows": past_shows,
-    "upcoming_shows": upcoming_shows,
+    "past_shows": show_tiles(past_shows, 'venue'),
+    "upcoming_shows": show_tiles(upcoming_shows, 'venue'),
     "past_shows_count": len(past_shows),
     "upcoming_shows_count": len(upcoming_shows),
+    "matches": db.session.query(Venue.id, Venue.name, Venue.image_link, Match.score)
+                         .join(Match, Match.venue_id == Venue.id)
+                         .filter(Match.artist_id == artist_id)
+                         .order_by(Match.score.desc())
+                         .limit(app.config['MATCHES_PER_ENTITY']).all() if artist.seeking_venue else [],
   }
 
   return render_template('pages/show_artist.html', artist=data)
 
+@app.route('/artists/<int:artist_id>/shows.ics')
+def artist_calendar(artist_id):
+  return serve_feed('artist', artist_id)
+
+@app.route('/artists/<int:artist_id>', methods=['DELETE'])
+def delete_artist(artist_id):
+  error = False
+  artist = Artist.query.get_or_404(artist_id)
+  name = artist.name
+
+  try:
+    # like venues, the shows and genre rows go with the "purge" command
+    artist.deleted_at = datetime.utcnow()
+    record_change('artist', artist_id, 'delete')
+    db.session.commit()
+  except:
+    error = True
+    db.session.rollback()
+    app.logger.exception('deleting artist %s failed', artist_id)
+  finally:
+    db.session.close()
+
+  if error:
+    flash('An error occurred. Artist ' + name + ' could not be deleted.')
+  else:
+    flash('Artist ' + name + ' was successfully deleted!')
+    unindex_autocomplete('artist', artist_id)
+    catch_up_shards_after_write()
+    refresh_matches_after_write(artist_ids=[artist_id])
+    refresh_feeds_after_write(artist_ids=[artist_id])
+
+  return jsonify({"success": not error, "redirect": url_for('index')})
+
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
+  return edit_artist_form(Artist.query.get_or_404(artist_id))
+
+def edit_artist_form(artist, conflicts=None):
+  # the form as saved now; after a rejected edit with what the editor had sent
   form = ArtistForm()
-  artist = Artist.query.get(artist_id)
-  genres = [genre.lookup.description for genre in artist.genres]
+  genres = sorted(genre_descriptions('artist', artist.id))
   
   data={
     "id": artist.id,
@@ -381,59 +2568,64 @@ def edit_artist(artist_id):
   form.state.default = data["state"]
   form.seeking_venue.default = data["seeking_venue"]
   form.genres.default = data["genres"]
+  form.version.default = artist.version
   form.process()
   
   # TODO: populate form with fields from artist with ID <artist_id>
-  return render_template('forms/edit_artist.html', form=form, artist=data)
+  return render_template('forms/edit_artist.html', form=form, artist=data, conflicts=conflicts), 409 if conflicts else 200
 
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
   # TODO: take values from the form submitted, and update existing
   # artist record with ID <artist_id> using the new attributes
-  error = False
+  error = duplicate = False
+  conflicts = None
   form = ArtistForm(request.form)
-  artist = Artist.query.get(artist_id)
+  artist = Artist.query.get_or_404(artist_id)
   
   if form.validate():
+    values, genres = edit_values('artist', form), form.genres.data
     try:
-      artist.name = form.name.data
-      artist.city = form.city.data
-      artist.state = form.state.data
-      artist.phone = form.phone.data
-      artist.seeking_venue = True if form.seeking_venue.data == 'Yes' else False
-      artist.seeking_description = form.seeking_description.data
-      artist.website_link = form.website_link.data
-      artist.facebook_link = form.facebook_link.data
-      artist.image_link = form.image_link.data
-      db.session.commit()
-      
-      genres = form.genres.data
-      # delete old genres
-      ArtistGenres.query.filter_by(artist_id=artist_id).delete()
-      db.session.commit()
-      
-      for genre in genres:
-        genre_id = Lookup.query.filter_by(description=genre).first().id
-        artistGenres = ArtistGenres(artist_id=artist_id, genre_id=genre_id)
-        db.session.add(artistGenres)
-
+      # one transaction, and only if nobody saved the artist since the form
+      # was rendered from its version
+      if form.version.data != str(artist.version):
+        conflicts = edit_conflicts('artist', artist, values, genres)
+      elif apply_edit('artist', artist, values, genres):
+        record_change('artist', artist_id, 'update', change_payload('artist', artist, genres))
       db.session.commit()
 
+    except StaleDataError:
+      db.session.rollback()
+      conflicts = edit_conflicts('artist', Artist.query.get_or_404(artist_id), values, genres)
+    except IntegrityError:
+      duplicate = True
+      db.session.rollback()
     except:
       error = True
       db.session.rollback()
-      print(sys.exc_info())
+      app.logger.exception('updating artist %s failed', artist_id)
     
-    finally:
+    # a version that moved to exactly what was submitted is no conflict
+    if conflicts:
+      flash('Artist ' + form.name.data + ' was changed by someone else while you were editing, nothing was saved.')
+      response = edit_artist_form(Artist.query.get_or_404(artist_id), conflicts)
       db.session.close()
+      return response
+    db.session.close()
     
     if error:
       # TODO: on unsuccessful db update, flash an error instead.
       flash('An error occurred. Artist ' + form.name.data + ' could not be updated.')
       # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
+    elif duplicate:
+      flash('Another artist ' + form.name.data + ' is already listed in ' + form.city.data + '.')
     else:
       # on successful db update, flash success
       flash('Artist ' + form.name.data + ' was successfully updated!')
+      index_autocomplete('artist', artist_id, form.name.data, form.city.data, form.state.data)
+      catch_up_shards_after_write()
+      refresh_matches_after_write(artist_ids=[artist_id])
+      refresh_feeds_after_write(artist_ids=[artist_id])
   
   else:
     flash('Validation error occurred: ' + ' '.join(form.errors))
@@ -442,9 +2634,12 @@ def edit_artist_submission(artist_id):
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
+  pin_shard(Venue.__table__, venue_id)
+  return edit_venue_form(Venue.query.get_or_404(venue_id))
+
+def edit_venue_form(venue, conflicts=None):
   form = VenueForm()
-  venue = Venue.query.get(venue_id)
-  genres = [genre.lookup.description for genre in venue.genres]
+  genres = sorted(genre_descriptions('venue', venue.id))
   
   data={
     "id": venue.id,
@@ -464,60 +2659,67 @@ def edit_venue(venue_id):
   form.state.default = data["state"]
   form.seeking_talent.default = data["seeking_talent"]
   form.genres.default = data["genres"]
+  form.version.default = venue.version
   form.process()
   
   # TODO: populate form with values from venue with ID <venue_id>
-  return render_template('forms/edit_venue.html', form=form, venue=data)
+  return render_template('forms/edit_venue.html', form=form, venue=data, conflicts=conflicts), 409 if conflicts else 200
 
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
   # TODO: take values from the form submitted, and update existing
   # venue record with ID <venue_id> using the new attributes
-  error = False
+  error = duplicate = False
+  conflicts = None
   form = VenueForm(request.form)
-  venue = Venue.query.get(venue_id)
+  pin_shard(Venue.__table__, venue_id)
+  venue = Venue.query.get_or_404(venue_id)
+  cities = [(venue.city, venue.state)]
   
   if form.validate():
+    values, genres = edit_values('venue', form), form.genres.data
     try:
-      venue.name = form.name.data
-      venue.city = form.city.data
-      venue.state = form.state.data
-      venue.address = form.address.data
-      venue.phone = form.phone.data
-      venue.seeking_talent = True if form.seeking_talent.data == 'Yes' else False
-      venue.seeking_description = form.seeking_description.data
-      venue.website_link = form.website_link.data
-      venue.facebook_link = form.facebook_link.data
-      venue.image_link = form.image_link.data
-      db.session.commit()
-      
-      genres = form.genres.data
-      # delete old genres
-      VenueGenres.query.filter_by(venue_id=venue_id).delete()
-      db.session.commit()
-      
-      for genre in genres:
-        genre_id = Lookup.query.filter_by(description=genre).first().id
-        venueGenres = VenueGenres(venue_id=venue_id, genre_id=genre_id)
-        db.session.add(venueGenres)
-
+      if form.version.data != str(venue.version):
+        conflicts = edit_conflicts('venue', venue, values, genres)
+      else:
+        changed = apply_edit('venue', venue, values, genres)
+        if 'city' in changed or 'state' in changed:
+          geocode_venue(venue)
+        if changed:
+          record_change('venue', venue_id, 'update', change_payload('venue', venue, genres))
       db.session.commit()
 
+    except StaleDataError:
+      db.session.rollback()
+      conflicts = edit_conflicts('venue', Venue.query.get_or_404(venue_id), values, genres)
+    except IntegrityError:
+      duplicate = True
+      db.session.rollback()
     except:
       error = True
       db.session.rollback()
-      print(sys.exc_info())
+      app.logger.exception('updating venue %s failed', venue_id)
     
-    finally:
+    # a version that moved to exactly what was submitted is no conflict
+    if conflicts:
+      flash('Venue ' + form.name.data + ' was changed by someone else while you were editing, nothing was saved.')
+      response = edit_venue_form(Venue.query.get_or_404(venue_id), conflicts)
       db.session.close()
+      return response
+    db.session.close()
     
     if error:
       # TODO: on unsuccessful db update, flash an error instead.
       flash('An error occurred. Venue ' + form.name.data + ' could not be updated.')
       # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
+    elif duplicate:
+      flash('Another venue ' + form.name.data + ' is already listed at ' + form.address.data + '.')
     else:
       # on successful db update, flash success
       flash('Venue ' + form.name.data + ' was successfully updated!')
+      index_autocomplete('venue', venue_id, form.name.data, form.city.data, form.state.data)
+      refresh_matches_after_write(venue_ids=[venue_id])
+      refresh_feeds_after_write(venue_ids=[venue_id], cities=cities + [(form.city.data, form.state.data)])
   
   else:
     flash('Validation error occurred: ' + ' '.join(form.errors))
@@ -541,6 +2743,7 @@ def create_artist_submission():
   form = ArtistForm(request.form)
   
   if form.validate():
+    artist_id = None
     try:
       name = form.name.data
       city = form.city.data
@@ -552,20 +2755,24 @@ def create_artist_submission():
       facebook_link = form.facebook_link.data
       image_link = form.image_link.data
       genres = form.genres.data
-      artist = Artist(name=name, city=city, state=state, phone=phone, website_link=website_link, facebook_link=facebook_link, seeking_venue=seeking_venue, seeking_description=seeking_description, image_link=image_link)
-      db.session.add(artist)
-
-      for genre in genres:
-        genre_id = Lookup.query.filter_by(description=genre).first().id
-        artistGenres = ArtistGenres(artist_id=artist.id, genre_id=genre_id)
-        db.session.add(artistGenres)
-
+      replay = not claim_idempotency_key(request_idempotency_key(form), 'create_artist')
+      if not replay:
+        artist = Artist(name=name, city=city, state=state, phone=phone, website_link=website_link, facebook_link=facebook_link, seeking_venue=seeking_venue, seeking_description=seeking_description, image_link=image_link)
+        artist_id = insert_unique('artist', column_values(artist))
+
+      if artist_id is not None:
+        for genre in genres:
+          genre_id = Lookup.query.filter_by(description=genre).first().id
+          artistGenres = ArtistGenres(artist_id=artist_id, genre_id=genre_id)
+          db.session.add(artistGenres)
+
+        record_change('artist', artist_id, 'create', change_payload('artist', artist, genres))
       db.session.commit()
 
     except:
       error = True
       db.session.rollback()
-      print(sys.exc_info())
+      app.logger.exception('creating artist failed')
     
     finally:
       db.session.close()
@@ -573,9 +2780,16 @@ def create_artist_submission():
     if error:
       # TODO: on unsuccessful db insert, flash an error instead.
       flash('An error occurred. Artist ' + name + ' could not be listed.')
+    elif replay:
+      flash('Artist ' + name + ' was successfully listed!')
+    elif artist_id is None:
+      flash('Artist ' + name + ' is already listed.')
     else:
       # on successful db insert, flash success
       flash('Artist ' + name + ' was successfully listed!')
+      index_autocomplete('artist', artist_id, name, city, state)
+      catch_up_shards_after_write()
+      refresh_matches_after_write(artist_ids=[artist_id])
   
   else:
     flash('Validation error occurred: ' + ' '.join(form.errors))
@@ -586,22 +2800,93 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
+def show_listing(session):
+  # every show of one database in date order, through a server side cursor
+  return stream_query(session.query(Show.id, Show.show_date, Venue.id.label('venue_id'), Venue.name.label('venue_name'),
+                                    Artist.id.label('artist_id'), Artist.name.label('artist_name'),
+                                    Artist.image_link.label('artist_image_link'), Show.updated_at,
+                                    Venue.updated_at.label('venue_updated_at'), Artist.updated_at.label('artist_updated_at'))
+                             .join(Venue, Show.venue_id == Venue.id)
+                             .join(Artist, Show.artist_id == Artist.id)
+                             .order_by(Show.show_date))
+
 @app.route('/shows')
 def shows():
   # displays list of shows at /shows
   # TODO: replace with real venues data.
-  shows = Show.query.all()
-
-  data=[{
-    "venue_id": show.venue.id,
-    "venue_name": show.venue.name,
-    "artist_id": show.artist.id,
-    "artist_name": show.artist.name,
-    "artist_image_link": show.artist.image_link,
+  snapshot = catalogue_snapshot()
+  if snapshot is not None:
+    return streamed_response('pages/shows.html', shows=snapshot.shows)
+
+  if shard_set is not None:
+    # every shard streams its shows in date order on a thread of its own,
+    # merged into one list while the page renders
+    shows = gather_shards(show_listing, key=lambda show: show.show_date, buffer=app.config['STREAM_YIELD_PER'])
+  else:
+    shows = show_listing(db.session)
+
+  # a generator, rows are turned into dicts while the page streams
+  data=({
+    "id": show.id,
+    "version": max(show.updated_at, show.venue_updated_at, show.artist_updated_at),
+    "venue_id": show.venue_id,
+    "venue_name": show.venue_name,
+    "artist_id": show.artist_id,
+    "artist_name": show.artist_name,
+    "artist_image_link": show.artist_image_link,
     "start_time": str(show.show_date)
-  } for show in shows]
+  } for show in shows)
+
+  return streamed_response('pages/shows.html', shows=data)
+
+@app.route('/cities/<state>/<city>/shows.ics')
+def city_calendar(state, city):
+  pin_state(state)
+  return serve_feed('city', (city, state))
+
+@app.route('/shows/stream')
+def stream_shows():
+  # Server-Sent Events of newly listed shows, optionally for one venue, artist
+  # or city. Each idle connection is only a queue, run under gevent workers
+  # (see README) so thousands of them do not need thousands of threads
+  filters = {
+    "venue_id": request.args.get('venue_id', type=int),
+    "artist_id": request.args.get('artist_id', type=int),
+    "city": request.args.get('city'),
+  }
+  last_event_id = request.headers.get('Last-Event-ID', type=int)
+  subscription = broadcaster.subscribe(**filters)
+
+  # shows listed while a reconnecting client was away, from the change feed
+  missed = []
+  if last_event_id is not None:
+    changes = Change.query.filter(Change.entity == 'show', Change.op == 'create', Change.seq > last_event_id)\
+                          .order_by(Change.seq).limit(app.config['BROADCAST_QUEUE_SIZE']).all()
+    events = show_events([change.entity_id for change in changes])
+    for change in changes:
+      event = events.get(change.entity_id)
+      if event is not None and subscription.matches(event):
+        event['seq'] = change.seq
+        missed.append(event)
+  db.session.remove()
+
+  def events():
+    try:
+      yield 'retry: %d\n\n' % (app.config['BROADCAST_RETRY_SECONDS'] * 1000)
+      for event in missed:
+        yield broadcast.format_event(event, event['seq'])
+      while not subscription.closed:
+        event = subscription.get(timeout=app.config['BROADCAST_HEARTBEAT_SECONDS'])
+        if event is None:
+          # comment line, keeps proxies from timing out and notices closed clients
+          yield ': heartbeat %d\n\n' % time.time()
+        else:
+          yield broadcast.format_event(event, event.get('seq'))
+    finally:
+      broadcaster.unsubscribe(subscription)
 
-  return render_template('pages/shows.html', shows=data)
+  return Response(events(), mimetype='text/event-stream',
+                  headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/shows/create')
 def create_shows():
@@ -617,18 +2902,36 @@ def create_show_submission():
   form = ShowForm(request.form)
   
   if form.validate():
+    show_id = None
+    pin_shard(Venue.__table__, form.venue_id.data)
     try:
       artist_id = form.artist_id.data
       venue_id = form.venue_id.data
       start_time = form.start_time.data
-      show = Show(artist_id=artist_id, venue_id=venue_id, show_date=start_time)
-      db.session.add(show)
+      replay = not claim_idempotency_key(request_idempotency_key(form), 'create_show')
+      if not replay:
+        # a deleted venue or artist would only collect hidden shows
+        venue = Venue.query.get(venue_id)
+        if venue is None or Artist.query.get(artist_id) is None:
+          raise ValueError('venue or artist does not exist')
+        city = (venue.city, venue.state)
+        show = Show(artist_id=artist_id, venue_id=venue_id, show_date=start_time)
+        show_id = insert_unique('show', column_values(show))
+
+      if show_id is not None:
+        # counted here, the insert bypasses the flush that keeps the rollups
+        connection = db.session.connection()
+        upsert_rollups(rollup_connection(db.session),
+                       rollups.increments(rollup_facts(connection, [(venue_id, artist_id, start_time)])))
+        change = record_change('show', show_id, 'create', change_payload('show', show))
       db.session.commit()
+      if show_id is not None:
+        change_seq = change.seq
 
     except:
       error = True
       db.session.rollback()
-      print(sys.exc_info())
+      app.logger.exception('creating show failed')
     
     finally:
       db.session.close()
@@ -637,15 +2940,179 @@ def create_show_submission():
       # TODO: on unsuccessful db insert, flash an error instead.
       flash('An error occurred. Show could not be listed.')
       # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
+    elif replay:
+      flash('Show was successfully listed!')
+    elif show_id is None:
+      flash('This show is already listed.')
     else:
       # on successful db insert, flash success
       flash('Show was successfully listed!')
+      publish_show(show_id, change_seq)
+      # show history is part of the score
+      refresh_matches_after_write(artist_ids=[artist_id], venue_ids=[venue_id])
+      refresh_feeds_after_write(venue_ids=[venue_id], artist_ids=[artist_id], cities=[city])
   
   else:
     flash('Validation error occurred: ' + ' '.join(form.errors))
   
   return render_template('pages/home.html')
 
+@app.route('/shows/<int:show_id>', methods=['DELETE'])
+def delete_show(show_id):
+  error = False
+  pin_shard(Show.__table__, show_id)
+  show = Show.query.get_or_404(show_id)
+  artist_id, venue_id = show.artist_id, show.venue_id
+  city = (show.venue.city, show.venue.state)
+
+  try:
+    show.deleted_at = datetime.utcnow()
+    record_change('show', show_id, 'delete')
+    db.session.commit()
+  except:
+    error = True
+    db.session.rollback()
+    app.logger.exception('deleting show %s failed', show_id)
+  finally:
+    db.session.close()
+
+  if error:
+    flash('An error occurred. Show could not be deleted.')
+  else:
+    flash('Show was successfully deleted!')
+    refresh_matches_after_write(artist_ids=[artist_id], venue_ids=[venue_id])
+    refresh_feeds_after_write(venue_ids=[venue_id], artist_ids=[artist_id], cities=[city])
+
+  return jsonify({"success": not error, "redirect": url_for('shows')})
+
+#  Stats
+#  ----------------------------------------------------------------
+
+@app.route('/stats')
+def stats_dashboard():
+  dimension, grain, start, end, limit = stats_params()
+  data = cached_show_stats(dimension, grain, start, end, limit)
+  peak = max([row['shows'] for row in data['series']] or [0])
+  return render_template('pages/stats.html', stats=data, peak=peak, limit=limit,
+                         dimensions=rollups.DIMENSIONS, grains=rollups.GRAINS)
+
+#  API
+#  ----------------------------------------------------------------
+
+@app.route('/api/v1/changes')
+def changes():
+  # everything after the client's cursor, compacted to one delta per entity.
+  # The newest few seconds are held back so a transaction that took a lower
+  # seq but commits later is not skipped by a client that already moved past it
+  since = request.args.get('since', 0, type=int)
+  limit = min(request.args.get('limit', app.config['CHANGES_PAGE_SIZE'], type=int), app.config['CHANGES_PAGE_SIZE'])
+  settled = datetime.utcnow() - timedelta(seconds=app.config['CHANGES_SETTLE_SECONDS'])
+
+  batch = Change.query.filter(Change.seq > since, Change.changed_at <= settled)\
+                      .order_by(Change.seq).limit(limit + 1).all()
+  has_more = len(batch) > limit
+  batch = batch[:limit]
+
+  return jsonify({
+    "since": since,
+    "next": batch[-1].seq if batch else since,
+    "has_more": has_more,
+    "changes": compact_changes(batch),
+  })
+
+@app.route('/api/v1/batch', methods=['GET', 'POST'])
+def batch_read():
+  # ids per type as a JSON body {"shows": [1, 2], "venues": [3]} or as comma
+  # separated query args. The venues and artists of the shows and the genres
+  # of those are included, and each type is read with a single IN query
+  if request.method == 'POST':
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+      return jsonify({"error": "expected a JSON object of id lists"}), 400
+  else:
+    body = {kind: request.args[kind].split(',') for kind in BATCH_TYPES if request.args.get(kind)}
+
+  try:
+    wanted = {kind: [int(entity_id) for entity_id in body.get(kind) or []] for kind in BATCH_TYPES}
+  except (TypeError, ValueError):
+    return jsonify({"error": "ids must be integers"}), 400
+  if any(len(ids) > app.config['BATCH_MAX_IDS'] for ids in wanted.values()):
+    return jsonify({"error": "at most %d ids per type" % app.config['BATCH_MAX_IDS']}), 400
+
+  batch = request_loaders()
+  for kind, ids in wanted.items():
+    batch[kind].want_many(ids)
+  loaders.resolve([batch[kind] for kind in BATCH_TYPES])
+
+  result = {kind: batch[kind].loaded() for kind in BATCH_TYPES}
+  result['missing'] = {kind: sorted(set(entity_id for entity_id in ids if batch[kind].get(entity_id) is None))
+                       for kind, ids in wanted.items() if ids}
+  return jsonify(result)
+
+@app.route('/api/v1/stats')
+def stats_api():
+  response = jsonify(cached_show_stats(*stats_params()))
+  response.cache_control.max_age = app.config['STATS_CACHE_SECONDS']
+  return response
+
+@app.route('/api/v1/export/<table>.<format>')
+def export_download(table, format):
+  # streams a whole table, or with ?since=<ISO time> the rows written since then
+  if table not in EXPORT_TABLES or format not in exports.available_formats():
+    abort(404)
+  try:
+    since = dateutil.parser.parse(request.args['since']).replace(tzinfo=None) if request.args.get('since') else None
+  except (ValueError, OverflowError):
+    abort(400)
+  meter = exports.Meter()
+
+  def generate():
+    try:
+      for chunk in export_chunks(table, format, since, meter):
+        yield chunk
+    finally:
+      app.logger.info('exported %s as %s', table, format, extra=dict(meter.report(), table=table))
+
+  mimetype, extension = exports.FORMATS[format]
+  chunks = stream_with_context(generate())
+  response = Response(chunks, mimetype=mimetype)
+  response.headers['Content-Disposition'] = 'attachment; filename=%s.%s' % (table, extension)
+  if format != 'parquet' and request.accept_encodings['gzip']:
+    response.response = gzip_chunks(chunks)
+    response.headers['Content-Encoding'] = 'gzip'
+  response.vary.add('Accept-Encoding')
+  return response
+
+# a front web server can alias these two to the files in SITEMAP_DIR
+@app.route('/sitemap.xml')
+def sitemap_index():
+  return send_from_directory(app.config['SITEMAP_DIR'], 'sitemap.xml', mimetype='application/xml', conditional=True)
+
+@app.route('/robots.txt')
+def robots_txt():
+  return send_from_directory(app.config['SITEMAP_DIR'], 'robots.txt', mimetype='text/plain', conditional=True)
+
+@app.route('/metrics')
+def metrics():
+  # prometheus text format
+  text = admission.prometheus(limiter.metrics())
+  text += '# TYPE fyyur_log_records_dropped_total counter\nfyyur_log_records_dropped_total %d\n' % log_queue.dropped
+  text += fragments.prometheus(fragment_cache.stats())
+  return Response(text, mimetype='text/plain; version=0.0.4')
+
+@app.route('/autocomplete')
+def autocomplete_search():
+  # type-ahead suggestions for the search boxes, kind is a comma separated subset
+  # of venue, artist, city and genre
+  q = request.args.get('q', '')
+  limit = min(request.args.get('limit', app.config['AUTOCOMPLETE_LIMIT'], type=int), app.config['AUTOCOMPLETE_LIMIT'])
+  kinds = [kind for kind in request.args.get('kind', '').split(',') if kind in prefix_index.Autocomplete.KINDS]
+
+  return jsonify({
+    "q": q,
+    "results": autocomplete().search(q, kinds or None, max(limit, 1)),
+  })
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -654,6 +3121,204 @@ def not_found_error(error):
 def server_error(error):
     return render_template('errors/500.html'), 500
 
+# recompute the genre closure table from the Lookup adjacency list
+@manager.command
+def rebuild_genres():
+  rebuild_lookup_closure(db.session.connection())
+  db.session.commit()
+  print('%d closure rows' % LookupClosure.query.count())
+
+# rescore every seeking artist against every seeking venue
+@manager.command
+def rescore_matches():
+  print('%d matches stored' % refresh_matches())
+
+# offline geocoding of venues from the gazetteer file, city level precision
+@manager.command
+def geocode(refresh=False):
+  venues = Venue.query if refresh else Venue.query.filter(Venue.latitude.is_(None))
+  located = missing = 0
+  for venue in venues.yield_per(1000):
+    geocode_venue(venue)
+    if venue.latitude is None:
+      missing += 1
+    else:
+      located += 1
+  db.session.commit()
+  print('located %d venues, %d not in the gazetteer' % (located, missing))
+
+# nearest-k and radius query latencies for the geohash scan and the KD-tree
+@manager.option('-n', '--venues', dest='venues', type=int, default=1000000)
+@manager.option('-q', '--queries', dest='queries', type=int, default=200)
+def bench_geo(venues, queries):
+  for name, value in geo.benchmark(venues, queries).items():
+    print('%-24s %s' % (name, round(value, 4) if isinstance(value, float) else value))
+
+# prefix search latency, build time and memory of the autocomplete index on
+# synthetic names, plus the memory of the index over the current database
+@manager.option('-n', '--entries', dest='entries', type=int, default=1000000)
+@manager.option('-q', '--queries', dest='queries', type=int, default=2000)
+def bench_autocomplete(entries, queries):
+  for name, value in prefix_index.benchmark(entries, queries).items():
+    print('%-22s %s' % (name, round(value, 4) if isinstance(value, float) else value))
+  for kind, size in autocomplete().memory().items():
+    print('%-22s %s' % ('database_' + kind + '_kb', size // 1024))
+
+# memory of the snapshot records per 100k rows, then requests per second of the
+# listing pages over the current database with the snapshot off and on
+@manager.option('-n', '--rows', dest='rows', type=int, default=100000)
+@manager.option('-s', '--seconds', dest='seconds', type=float, default=3)
+def bench_catalogue(rows, seconds):
+  for name, value in catalogue.memory_per_rows(rows).items():
+    print('%-24s %s' % (name, value))
+
+  client = app.test_client()
+  enabled = app.config['CATALOGUE_SNAPSHOT']
+  for mode in (False, True):
+    app.config['CATALOGUE_SNAPSHOT'] = mode
+    if mode:
+      listing_catalogue.refresh()
+    for path in ('/venues', '/artists', '/shows'):
+      count, started = 0, time.perf_counter()
+      while time.perf_counter() - started < seconds:
+        client.get(path).get_data()
+        count += 1
+      print('%-24s %.1f' % ('%s_%s_rps' % ('snapshot' if mode else 'database', path.strip('/')),
+                            count / (time.perf_counter() - started)))
+  app.config['CATALOGUE_SNAPSHOT'] = enabled
+
+# hard delete what was soft deleted more than --days ago, in short batches; run from cron
+@manager.option('-d', '--days', dest='days', type=int, default=None)
+@manager.option('-b', '--batch', dest='batch', type=int, default=None)
+def purge(days, batch):
+  days = app.config['PURGE_AFTER_DAYS'] if days is None else days
+  before = datetime.utcnow() - timedelta(days=days)
+  counts = purge_deleted(before, batch or app.config['PURGE_BATCH_SIZE'], app.config['PURGE_PAUSE_SECONDS'])
+  for table, count in counts.items():
+    print('%-16s %s' % (table, count))
+  # shows of purged venues and artists were never taken off the rollups one by one
+  if counts['Venue'] or counts['Artist']:
+    print('%-16s %s' % ('Show_Rollup', rebuild_rollups()))
+
+# write tables to EXPORT_DIR as csv, jsonl or parquet files, optionally only
+# the rows written since an ISO time, and report the throughput of each
+@manager.option('-t', '--tables', dest='tables', default=None)
+@manager.option('-f', '--format', dest='format', default='csv')
+@manager.option('-s', '--since', dest='since', default=None)
+@manager.option('-o', '--out', dest='out', default=None)
+def export(tables, format, since, out):
+  tables = tables.split(',') if tables else list(EXPORT_TABLES)
+  unknown = [table for table in tables if table not in EXPORT_TABLES]
+  if unknown or format not in exports.available_formats():
+    print('tables are %s, formats %s' % (', '.join(EXPORT_TABLES), ', '.join(exports.available_formats())))
+    return
+  since = dateutil.parser.parse(since).replace(tzinfo=None) if since else None
+  out = out or app.config['EXPORT_DIR']
+  os.makedirs(out, exist_ok=True)
+  started = datetime.utcnow()
+  stamp = started.strftime('%Y%m%dT%H%M%S')
+  for table in tables:
+    meter = exports.Meter()
+    path = os.path.join(out, '%s-%s%s.%s' % (table, stamp, '-incremental' if since else '', exports.FORMATS[format][1]))
+    # a reader never sees a half written file
+    with open(path + '.part', 'wb') as output:
+      for chunk in export_chunks(table, format, since, meter):
+        output.write(chunk)
+    os.replace(path + '.part', path)
+    report = meter.report()
+    print('%-14s %9d rows %8.1f MB %6.2fs %9d rows/s %7.2f MB/s  %s' % (
+      table, report['rows'], report['bytes'] / 1e6, report['seconds'], report['rows_per_second'],
+      report['mb_per_second'], path))
+  # rows written while this ran are picked up by the next run
+  print('next incremental run: --since %s' % started.isoformat())
+
+# write the sitemap index and urlsets of every venue and artist page; run from cron
+@manager.command
+def sitemap():
+  parts, removed = generate_sitemaps()
+  for name, lastmod, changed in parts:
+    print('%-18s %s%s' % (name, lastmod or '-', '' if changed else '  unchanged'))
+  print('removed %d stale files' % removed)
+
+# recount Show_Rollup from every live show
+@manager.command
+def rollup():
+  print('%d rollup rows' % rebuild_rollups())
+
+# "busiest venues over a quarter" from raw shows and from the rollup at growing show counts
+@manager.option('-q', '--queries', dest='queries', type=int, default=20)
+def bench_stats(queries):
+  for name, value in rollups.benchmark(queries=queries).items():
+    print('%-26s %s' % (name, round(value, 3) if isinstance(value, float) else value))
+
+# write likely duplicate venues and artists to Merge_Suggestion for review
+@manager.option('-e', '--entity', dest='entity', choices=sorted(DEDUP_MODELS), default=None)
+@manager.option('-t', '--threshold', dest='threshold', type=float, default=None)
+def find_duplicates(entity, threshold):
+  for name in [entity] if entity else sorted(DEDUP_MODELS):
+    count = find_merge_suggestions(name, app.config['DEDUP_THRESHOLD'] if threshold is None else threshold)
+    print('%-8s %d pending suggestions' % (name, count))
+
+# merge one suggestion by id, or every pending one scoring at least --min-score
+@manager.option('-i', '--id', dest='suggestion_id', type=int, default=None)
+@manager.option('-m', '--min-score', dest='min_score', type=float, default=None)
+@manager.option('-e', '--entity', dest='entity', choices=sorted(DEDUP_MODELS), default=None)
+def merge(suggestion_id, min_score, entity):
+  suggestions = MergeSuggestion.query.filter(MergeSuggestion.status == 'pending')
+  if suggestion_id is not None:
+    suggestions = suggestions.filter(MergeSuggestion.id == suggestion_id)
+  elif min_score is not None:
+    suggestions = suggestions.filter(MergeSuggestion.score >= min_score)
+  else:
+    print('pass --id or --min-score')
+    return
+  if entity:
+    suggestions = suggestions.filter(MergeSuggestion.entity == entity)
+  pairs = [(suggestion.id, suggestion.entity, suggestion.keep_id, suggestion.duplicate_id)
+           for suggestion in suggestions.order_by(MergeSuggestion.score.desc(), MergeSuggestion.id)]
+  for pair_id, name, keep_id, duplicate_id in pairs:
+    # an earlier merge in this run may have settled the pair already
+    if not MergeSuggestion.query.filter_by(id=pair_id, status='pending').count():
+      continue
+    try:
+      moved = merge_entities(name, keep_id, duplicate_id)
+      print('%s %d merged into %d, %d shows moved' % (name, duplicate_id, keep_id, moved))
+    except ValueError as error:
+      db.session.rollback()
+      print(error)
+
+# candidate generation and scoring throughput of dedup.py on synthetic names
+@manager.option('-n', '--records', dest='records', type=int, default=1000000)
+@manager.option('-b', '--blocks', dest='blocks', type=int, default=2000)
+def bench_dedup(records, blocks):
+  for name, value in dedup.benchmark(records, blocks).items():
+    print('%-20s %s' % (name, round(value, 4) if isinstance(value, float) else value))
+
+# create upcoming monthly Show partitions and archive the old ones (postgres only)
+@manager.option('-a', '--ahead', dest='ahead', type=int, default=None)
+@manager.option('-r', '--retain', dest='retain', type=int, default=None)
+def partitions(ahead, retain):
+  if db.engine.dialect.name != 'postgresql':
+    print('Show is only partitioned on postgresql, nothing to do')
+    return
+  created, archived = maintain_show_partitions(app.config['SHOW_PARTITIONS_AHEAD'] if ahead is None else ahead,
+                                               app.config['SHOW_PARTITIONS_RETAIN'] if retain is None else retain)
+  print('created %s' % (', '.join(created) or 'nothing'))
+  print('archived %s' % (', '.join(archived) or 'nothing'))
+
+# fan-out cost in process, or idle SSE connections against a running server with --url
+@manager.option('-n', '--subscribers', dest='subscribers', type=int, default=10000)
+@manager.option('-e', '--events', dest='events', type=int, default=1000)
+@manager.option('-u', '--url', dest='url', default=None)
+@manager.option('-s', '--seconds', dest='seconds', type=int, default=30)
+def sse_loadtest(subscribers, events, url, seconds):
+  if url:
+    results = broadcast.http_load_test(url, subscribers, seconds)
+  else:
+    results = broadcast.load_test(subscribers, events)
+  for name, value in results.items():
+    print('%-22s %s' % (name, round(value, 4) if isinstance(value, float) else value))
+
 # initial seeding of db with sample data
 @manager.command
 def seed():
@@ -702,6 +3367,8 @@ def seed():
   venue1 = Venue(name='The Musical Hop', address='1015 Folsom Street', city='San Francisco', state='CA', phone='123-123-1234', website_link='https://www.themusicalhop.com', facebook_link='https://www.facebook.com/TheMusicalHop', seeking_talent=True, seeking_description='We are on the lookout for a local artist to play every two weeks. Please call us.', image_link='https://images.unsplash.com/photo-1543900694-133f37abaaa5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=400&q=60')
   venue2 = Venue(name='The Dueling Pianos Bar', address='335 Delancey Street', city='New York', state='NY', phone='914-003-1132', website_link='https://www.theduelingpianos.com', facebook_link='https://www.facebook.com/theduelingpianos', seeking_talent=False, image_link='https://images.unsplash.com/photo-1497032205916-ac775f0649ae?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=750&q=80')
   venue3 = Venue(name='Park Square Live Music & Coffee', address='34 Whiskey Moore Ave', city='San Francisco', state='CA', phone='415-000-1234', website_link='https://www.parksquarelivemusicandcoffee.com', facebook_link='https://www.facebook.com/ParkSquareLiveMusicAndCoffee', seeking_talent=False, image_link='https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80')
+  for venue in [venue1, venue2, venue3]:
+    geocode_venue(venue)
   db.session.add_all([venue1, venue2, venue3])
   db.session.commit()
 
@@ -727,15 +3394,64 @@ def seed():
   db.session.add_all([show1, show2, show3, show4, show5])
   db.session.commit()
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+  # sample data goes into the change feed like any other write
+  for venue in Venue.query.all():
+    record_change('venue', venue.id, 'create', change_payload('venue', venue, [genre.lookup.description for genre in venue.genres]))
+  for artist in Artist.query.all():
+    record_change('artist', artist.id, 'create', change_payload('artist', artist, [genre.lookup.description for genre in artist.genres]))
+  for show in Show.query.all():
+    record_change('show', show.id, 'create', change_payload('show', show))
+  db.session.commit()
+
+# fetch every venue and artist image link once and store thumbnails under static/
+@manager.command
+def thumbnails(refresh=False):
+  links = [venue.image_link for venue in db.session.query(Venue.image_link)] + \
+          [artist.image_link for artist in db.session.query(Artist.image_link)]
+  fetched, skipped, failed = images.prefetch(links, app.config['THUMBNAIL_DIR'],
+                                             size=app.config['THUMBNAIL_SIZE'],
+                                             timeout=app.config['THUMBNAIL_FETCH_TIMEOUT'],
+                                             refresh=refresh)
+  print('fetched %d, skipped %d, failed %d' % (fetched, skipped, len(failed)))
+  for url, reason in failed:
+    print('  %s: %s' % (url, reason))
+
+# concatenate, minify, fingerprint and precompress the css/js bundles
+@manager.command
+def build_assets():
+  manifest = assets.build(app.static_folder, app.config['ASSETS_DIR'])
+  removed = assets.clean(app.config['ASSETS_DIR'], manifest)
+  for bundle, filename in sorted(manifest.items()):
+    print('%s -> %s' % (bundle, filename))
+  print('removed %d stale files' % removed)
+
+# create the shards, copy every venue with its shows, genres and matches to the
+# shard of its region and the artists and genre lookup to all of them
+@manager.option('-b', '--batch', dest='batch', type=int, default=1000)
+def shard_split(batch):
+  if shard_set is None:
+    print('no shards, set FYYUR_SHARDS')
+    return
+  for name, venues in split_shards(batch).items():
+    print('%-16s %d venues' % (name, venues))
+
+# copy the artists and the genre lookup to every shard again
+@manager.option('-b', '--batch', dest='batch', type=int, default=1000)
+def shard_replicate(batch):
+  if shard_set is None:
+    print('no shards, set FYYUR_SHARDS')
+    return
+  replicate_catalogue(batch)
+
+# copy the artists changed since a shard's last catch up, e.g. after a failed
+# copy or a shard that was down; run from cron
+@manager.option('-b', '--batch', dest='batch', type=int, default=1000)
+def shard_catch_up(batch):
+  if shard_set is None:
+    print('no shards, set FYYUR_SHARDS')
+    return
+  for name, artists in catch_up_shards(batch).items():
+    print('%-16s %d artists' % (name, artists))
 
 #----------------------------------------------------------------------------#
 # Launch.
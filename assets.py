@@ -0,0 +1,152 @@
+#----------------------------------------------------------------------------#
+# Asset pipeline.
+# Concatenates and minifies the stylesheets and scripts in static/ into
+# bundles named after their content hash, and precompresses them so they
+# can be served with long lived immutable caching.
+#----------------------------------------------------------------------------#
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+
+try:
+  import brotli
+except ImportError: # brotli is optional, only gzip copies are written without it
+  brotli = None
+
+try:
+  from rjsmin import jsmin
+except ImportError: # scripts are concatenated as is without rjsmin
+  jsmin = None
+
+MANIFEST = 'manifest.json'
+
+# bundle name -> source files relative to static/, in load order
+BUNDLES = {
+  'main.css': [
+    'css/bootstrap.min.css',
+    'css/layout.main.css',
+    'css/main.css',
+    'css/main.responsive.css',
+    'css/main.quickfix.css',
+  ],
+  'head.js': [
+    'js/libs/modernizr-2.8.2.min.js',
+    'js/libs/moment.min.js',
+  ],
+  'main.js': [
+    'js/libs/bootstrap-3.1.1.min.js',
+    'js/plugins.js',
+    'js/script.js',
+  ],
+}
+
+# content encodings in order of preference -> file suffix of the precompressed copy
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+# quoted strings and unquoted url() values are copied as they are, comments are dropped
+CSS_VERBATIM = re.compile(r'''"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|url\([^"')]*\)|(/\*.*?\*/)''', re.S | re.I)
+
+def squeeze_css(source):
+  source = re.sub(r'\s+', ' ', source)
+  # colons are left alone, removing the space in "a :hover" would change the selector
+  source = re.sub(r'\s*([{};,>])\s*', r'\1', source)
+  return source.replace(';}', '}')
+
+def minify_css(source):
+  parts, text, position = [], '', 0
+  for match in CSS_VERBATIM.finditer(source):
+    text += source[position:match.start()]
+    position = match.end()
+    if not match.group(1):
+      parts += [squeeze_css(text), match.group(0)]
+      text = ''
+  parts.append(squeeze_css(text + source[position:]))
+  return ''.join(parts).strip()
+
+def minify_js(source):
+  return jsmin(source) if jsmin else source
+
+def build_bundle(static_folder, name, sources):
+  contents = []
+  for source in sources:
+    with open(os.path.join(static_folder, source), encoding='utf-8') as f:
+      contents.append(f.read())
+
+  if name.endswith('.css'):
+    return '\n'.join(minify_css(content) for content in contents).encode('utf-8')
+  # a leading semicolon guards against files that end without one
+  return '\n;'.join(minify_js(content) for content in contents).encode('utf-8')
+
+def write_file(path, data):
+  with open(path + '.tmp', 'wb') as f:
+    f.write(data)
+  os.replace(path + '.tmp', path)
+
+def build(static_folder, output_dir, bundles=BUNDLES):
+  # writes every bundle with its compressed copies and returns the new manifest
+  os.makedirs(output_dir, exist_ok=True)
+  manifest = {}
+
+  for name, sources in bundles.items():
+    data = build_bundle(static_folder, name, sources)
+    stem, extension = os.path.splitext(name)
+    filename = stem + '.' + hashlib.sha256(data).hexdigest()[:12] + extension
+    path = os.path.join(output_dir, filename)
+
+    write_file(path, data)
+    write_file(path + '.gz', gzip.compress(data, compresslevel=9))
+    if brotli is not None:
+      write_file(path + '.br', brotli.compress(data))
+    manifest[name] = filename
+
+  write_file(os.path.join(output_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+  return manifest
+
+def clean(output_dir, manifest):
+  # removes bundles that are no longer referenced by the manifest
+  keep = set(manifest.values())
+  removed = 0
+  for filename in os.listdir(output_dir):
+    base = re.sub(r'\.(gz|br)$', '', filename)
+    if filename != MANIFEST and base not in keep:
+      os.remove(os.path.join(output_dir, filename))
+      removed += 1
+  return removed
+
+class AssetIndex(object):
+  # in memory view of the manifest, reloaded when the file changes on disk;
+  # the file is looked at no more than every check_every seconds
+
+  def __init__(self, directory, check_every=0):
+    self.directory = directory
+    self.check_every = check_every
+    self.checked = None
+    self.mtime = None
+    self.manifest = {}
+
+  def refresh(self):
+    # mtime of the manifest, None while there is none
+    now = time.monotonic()
+    if self.checked is not None and now - self.checked < self.check_every:
+      return self.mtime
+    self.checked = now
+    path = os.path.join(self.directory, MANIFEST)
+    try:
+      mtime = os.path.getmtime(path)
+    except OSError:
+      self.manifest, self.mtime = {}, None
+      return None
+    if mtime != self.mtime:
+      with open(path) as f:
+        self.manifest = json.load(f)
+      self.mtime = mtime
+    return mtime
+
+  def lookup(self, name):
+    if self.refresh() is None:
+      return None
+    return self.manifest.get(name)
@@ -0,0 +1,205 @@
+#----------------------------------------------------------------------------#
+# Broadcaster.
+# Fans show events out to Server-Sent Events subscribers. Subscriptions are
+# indexed by their filter so a publish only touches the matching ones, and
+# the backend is pluggable: in-process, or redis pub/sub when the app runs
+# in several processes.
+#----------------------------------------------------------------------------#
+
+import json
+import queue
+import threading
+
+# keys a subscription can filter on, in the order they are indexed
+FILTERS = ('venue_id', 'artist_id', 'city')
+
+class Subscription(object):
+  __slots__ = ('filters', 'events', 'closed')
+
+  def __init__(self, filters, size):
+    self.filters = filters
+    self.events = queue.Queue(maxsize=size)
+    self.closed = False
+
+  def matches(self, event):
+    return all(normalise(key, event.get(key)) == value for key, value in self.filters.items())
+
+  def get(self, timeout):
+    # the next event, or None when nothing arrived within timeout
+    try:
+      return self.events.get(timeout=timeout)
+    except queue.Empty:
+      return None
+
+def normalise(key, value):
+  if value is None:
+    return None
+  return str(value).strip().lower() if key == 'city' else int(value)
+
+class Broadcaster(object):
+
+  def __init__(self, backend=None, queue_size=100):
+    self.backend = backend or MemoryBackend()
+    self.queue_size = queue_size
+    self.lock = threading.Lock()
+    self.index = {}
+    self.backend.start(self.deliver)
+
+  def subscribe(self, **filters):
+    filters = {key: normalise(key, value) for key, value in filters.items() if key in FILTERS and value not in (None, '')}
+    subscription = Subscription(filters, self.queue_size)
+    with self.lock:
+      self.index.setdefault(self.key(filters), set()).add(subscription)
+    return subscription
+
+  def unsubscribe(self, subscription):
+    subscription.closed = True
+    with self.lock:
+      subscribers = self.index.get(self.key(subscription.filters))
+      if subscribers is not None:
+        subscribers.discard(subscription)
+        if not subscribers:
+          del self.index[self.key(subscription.filters)]
+
+  def key(self, filters):
+    # subscriptions are indexed on their first filter, the rest is checked on delivery
+    for name in FILTERS:
+      if name in filters:
+        return (name, filters[name])
+    return ('all', None)
+
+  def publish(self, event):
+    self.backend.publish(event)
+
+  def deliver(self, event):
+    keys = [('all', None)] + [(name, normalise(name, event.get(name))) for name in FILTERS if event.get(name) is not None]
+    with self.lock:
+      candidates = [subscription for key in keys for subscription in self.index.get(key, ())]
+    delivered = 0
+    for subscription in candidates:
+      if not subscription.matches(event):
+        continue
+      try:
+        subscription.events.put_nowait(event)
+        delivered += 1
+      except queue.Full:
+        # a client that stopped reading is dropped instead of buffering forever
+        self.unsubscribe(subscription)
+    return delivered
+
+  def count(self):
+    with self.lock:
+      return sum(len(subscribers) for subscribers in self.index.values())
+
+class MemoryBackend(object):
+  # single process, publish delivers straight away
+
+  def start(self, deliver):
+    self.deliver = deliver
+
+  def publish(self, event):
+    self.deliver(event)
+
+class RedisBackend(object):
+  # every process publishes to one channel and delivers what it hears to its own subscribers
+
+  def __init__(self, url, channel='fyyur:shows'):
+    import redis
+    self.client = redis.Redis.from_url(url)
+    self.channel = channel
+
+  def start(self, deliver):
+    pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(**{self.channel: lambda message: deliver(json.loads(message['data']))})
+    self.thread = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+  def publish(self, event):
+    self.client.publish(self.channel, json.dumps(event))
+
+def backend_from_url(url):
+  if not url or url == 'memory':
+    return MemoryBackend()
+  if url.startswith(('redis://', 'rediss://', 'unix://')):
+    return RedisBackend(url)
+  raise ValueError('Unknown broadcast backend ' + url)
+
+def format_event(event, event_id=None, name='show'):
+  lines = []
+  if event_id is not None:
+    lines.append('id: %s' % event_id)
+  lines.append('event: %s' % name)
+  lines.append('data: %s' % json.dumps(event, separators=(',', ':')))
+  return '\n'.join(lines) + '\n\n'
+
+def load_test(subscribers=10000, events=1000, cities=50, venues=1000):
+  # in-process fan-out cost: memory per idle subscriber and publish latency
+  # with subscribers spread over city and venue filters
+  import random
+  import time
+  import tracemalloc
+
+  broadcaster = Broadcaster(queue_size=events + 1)
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  subscriptions = []
+  for i in range(subscribers):
+    if i % 2:
+      subscriptions.append(broadcaster.subscribe(city='city %d' % random.randrange(cities)))
+    else:
+      subscriptions.append(broadcaster.subscribe(venue_id=random.randrange(venues)))
+  memory = tracemalloc.get_traced_memory()[0] - before
+  tracemalloc.stop()
+
+  delivered, timings = 0, []
+  for i in range(events):
+    event = {'venue_id': random.randrange(venues), 'city': 'city %d' % random.randrange(cities)}
+    started = time.perf_counter()
+    delivered += broadcaster.deliver(event)
+    timings.append((time.perf_counter() - started) * 1000)
+  timings.sort()
+
+  return {
+    'subscribers': subscribers,
+    'events': events,
+    'delivered': delivered,
+    'bytes_per_subscriber': memory // max(subscribers, 1),
+    'publish_p50_ms': timings[len(timings) // 2],
+    'publish_p99_ms': timings[int(len(timings) * 0.99) - 1],
+  }
+
+def http_load_test(url, subscribers=1000, seconds=30):
+  # opens idle SSE connections against a running server and counts the events
+  # they receive, publish shows meanwhile to see them fan out
+  import http.client
+  import time
+  from urllib.parse import urlsplit
+
+  parts = urlsplit(url)
+  received, connected, failed = [0], [0], [0]
+  lock = threading.Lock()
+  deadline = time.time() + seconds
+
+  def subscriber():
+    try:
+      connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=seconds)
+      connection.request('GET', parts.path + ('?' + parts.query if parts.query else ''))
+      response = connection.getresponse()
+      with lock:
+        connected[0] += 1
+      while time.time() < deadline:
+        line = response.fp.readline()
+        if not line:
+          break
+        if line.startswith(b'event: show'):
+          with lock:
+            received[0] += 1
+    except Exception:
+      with lock:
+        failed[0] += 1
+
+  threads = [threading.Thread(target=subscriber, daemon=True) for _ in range(subscribers)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join(max(deadline - time.time(), 0) + 1)
+  return {'subscribers': subscribers, 'connected': connected[0], 'failed': failed[0], 'events_received': received[0]}
@@ -0,0 +1,90 @@
+#----------------------------------------------------------------------------#
+# Calendar feeds.
+# iCalendar (RFC 5545) rendering of show lists, and the small file cache the
+# .ics routes serve from: a feed is rewritten only when its content changes
+# and its ETag is a content hash kept per file modification time, so a
+# polling calendar client costs a stat and a 304.
+#----------------------------------------------------------------------------#
+
+import hashlib
+import os
+import threading
+from collections import namedtuple
+
+Event = namedtuple('Event', 'uid start end stamp summary location url')
+
+def escape(text):
+  # TEXT values escape backslashes, separators and newlines
+  return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+def fold(line, limit=75):
+  # content lines longer than 75 octets continue on lines starting with a space,
+  # never splitting a utf-8 sequence
+  data = line.encode('utf-8')
+  if len(data) <= limit:
+    return line
+  parts, start = [], 0
+  while start < len(data):
+    end = min(start + (limit if not parts else limit - 1), len(data))
+    while end < len(data) and (data[end] & 0xC0) == 0x80:
+      end -= 1
+    parts.append(data[start:end].decode('utf-8'))
+    start = end
+  return '\r\n '.join(parts)
+
+def timestamp(value, utc=False):
+  # floating local time, the shows carry no zone; DTSTAMP must be UTC
+  return value.strftime('%Y%m%dT%H%M%S') + ('Z' if utc else '')
+
+def render(name, events, product='-//Fyyur//Shows//EN'):
+  lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:' + product, 'CALSCALE:GREGORIAN', 'METHOD:PUBLISH',
+           'X-WR-CALNAME:' + escape(name)]
+  for event in events:
+    lines += [
+      'BEGIN:VEVENT',
+      'UID:' + event.uid,
+      'DTSTAMP:' + timestamp(event.stamp, utc=True),
+      'DTSTART:' + timestamp(event.start),
+      'DTEND:' + timestamp(event.end),
+      'SUMMARY:' + escape(event.summary),
+      'LOCATION:' + escape(event.location),
+      'URL:' + event.url,
+      'END:VEVENT',
+    ]
+  lines.append('END:VCALENDAR')
+  return ''.join(fold(line) + '\r\n' for line in lines).encode('utf-8')
+
+def write_if_changed(path, data):
+  # True when the file was (re)written; an unchanged feed is only touched so
+  # its age restarts, and keeps its ETag
+  try:
+    with open(path, 'rb') as existing:
+      if existing.read() == data:
+        os.utime(path)
+        return False
+  except OSError:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+  temporary = '%s.%d.%d' % (path, os.getpid(), threading.get_ident())
+  with open(temporary, 'wb') as output:
+    output.write(data)
+  os.replace(temporary, path)
+  return True
+
+class Etags(object):
+  # content hash of a file, read again only when its mtime moves
+
+  def __init__(self):
+    self.known = {}
+    self.lock = threading.Lock()
+
+  def get(self, path):
+    mtime = os.stat(path).st_mtime_ns
+    with self.lock:
+      hit = self.known.get(path)
+    if hit is not None and hit[0] == mtime:
+      return hit[1]
+    with open(path, 'rb') as feed:
+      etag = hashlib.sha1(feed.read()).hexdigest()
+    with self.lock:
+      self.known[path] = (mtime, etag)
+    return etag
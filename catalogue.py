@@ -0,0 +1,205 @@
+#----------------------------------------------------------------------------#
+# Catalogue snapshot.
+# An immutable, compact copy of what the listing pages print, held by every
+# worker so /venues, /artists and /shows render without a query. A background
+# thread rebuilds it when the catalogue version moves and swaps it in with a
+# single assignment; readers always see one complete snapshot.
+#----------------------------------------------------------------------------#
+
+import bisect
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+class VenueRecord(object):
+  __slots__ = ('id', 'name', 'city', 'state', 'num_upcoming_shows')
+
+  def __init__(self, id, name, city, state, num_upcoming_shows):
+    self.id, self.name, self.city, self.state = id, name, city, state
+    self.num_upcoming_shows = num_upcoming_shows
+
+class ArtistRecord(object):
+  __slots__ = ('id', 'name', 'city', 'state', 'num_upcoming_shows', 'genres')
+
+  def __init__(self, id, name, city, state, num_upcoming_shows, genres):
+    self.id, self.name, self.city, self.state = id, name, city, state
+    self.num_upcoming_shows = num_upcoming_shows
+    # descriptions of the artist's genres and all their ancestors
+    self.genres = genres
+
+class ShowRecord(object):
+  __slots__ = ('id', 'version', 'start_time', 'venue_id', 'venue_name', 'artist_id', 'artist_name', 'artist_image_link')
+
+  def __init__(self, id, version, start_time, venue_id, venue_name, artist_id, artist_name, artist_image_link):
+    # version is the newest updated_at of the show, its venue and its artist
+    self.id, self.version = id, version
+    self.start_time = start_time
+    self.venue_id, self.venue_name = venue_id, venue_name
+    self.artist_id, self.artist_name, self.artist_image_link = artist_id, artist_name, artist_image_link
+
+class Area(object):
+  __slots__ = ('city', 'state', 'venues')
+
+  def __init__(self, city, state, venues):
+    self.city, self.state, self.venues = city, state, venues
+
+def group_areas(venues):
+  # venues in city order -> one Area per city and state, the /venues page of
+  # the snapshot and of the database alike
+  areas = {}
+  for venue in venues:
+    areas.setdefault((venue.city, venue.state), []).append(venue)
+  return tuple(Area(city, state, tuple(members)) for (city, state), members in areas.items())
+
+# sort name of the artist directory -> keyset of a record, matching the ORDER BY of the query
+ARTIST_ORDER = {
+  'name': lambda artist: (artist.name or '', artist.id),
+  'city': lambda artist: (artist.city or '', artist.id),
+  'upcoming': lambda artist: (-artist.num_upcoming_shows, artist.id),
+}
+
+class Snapshot(object):
+  __slots__ = ('version', 'built_at', 'areas', 'artists', 'shows')
+
+  def __init__(self, version, venues, artists, shows):
+    self.version = version
+    self.built_at = time.time()
+
+    self.areas = group_areas(venues)
+
+    # every directory order is presorted, with its keys alongside for bisecting
+    self.artists = {}
+    for sort, order in ARTIST_ORDER.items():
+      records = tuple(sorted(artists, key=order))
+      self.artists[sort] = ([order(artist) for artist in records], records)
+
+    self.shows = tuple(shows)
+
+  def artist_page(self, sort, state, genre, after_key, after_id, per_page):
+    # the page after (after_key, after_id) plus one extra row, like the keyset query
+    keys, records = self.artists[sort]
+    position = 0
+    if after_key is not None and after_id is not None:
+      try:
+        if sort == 'upcoming':
+          after_key = -int(after_key)
+        position = bisect.bisect_right(keys, (after_key, int(after_id)))
+      except (TypeError, ValueError):
+        # a malformed cursor serves the first page, like the query does
+        position = 0
+
+    rows = []
+    for artist in records[position:]:
+      if state and artist.state != state:
+        continue
+      if genre and genre not in artist.genres:
+        continue
+      rows.append(artist)
+      if len(rows) > per_page:
+        break
+    return rows
+
+  def rows(self):
+    return sum(len(area.venues) for area in self.areas) + len(self.artists['name'][1]) + len(self.shows)
+
+def build_snapshot(version, venue_rows, artist_rows, artist_genre_rows, show_rows):
+  # venue_rows (id, name, city, state, num_upcoming_shows), artist_rows the
+  # same, artist_genre_rows (artist id, genre description) and show_rows
+  # (show_date, venue_id, venue_name, artist_id, artist_name, artist_image_link,
+  # id, then the updated_at of the show, venue and artist)
+  # strings repeated across rows (cities, states, genres) are stored once
+  intern = {}
+  def shared(value):
+    return intern.setdefault(value, value) if isinstance(value, str) else value
+
+  genres = {}
+  for artist_id, description in artist_genre_rows:
+    genres.setdefault(artist_id, set()).add(shared(description))
+
+  venues = [VenueRecord(row[0], row[1], shared(row[2]), shared(row[3]), row[4] or 0) for row in venue_rows]
+  artists = [ArtistRecord(row[0], row[1], shared(row[2]), shared(row[3]), row[4] or 0, frozenset(genres.get(row[0], ())))
+             for row in artist_rows]
+  shows = [ShowRecord(row[6], max(row[7:10]), str(row[0]), row[1], row[2], row[3], row[4], row[5]) for row in show_rows]
+  return Snapshot(version, venues, artists, shows)
+
+class Catalogue(object):
+  # current() never blocks on a rebuild: it returns the last complete snapshot,
+  # or None before the first one exists so callers fall back to the database
+
+  def __init__(self, load, version, check_seconds=5, max_age=300):
+    self.load = load # load(version) -> Snapshot
+    self.version = version # version() -> current catalogue version
+    self.check_seconds = check_seconds
+    self.max_age = max_age
+    self.snapshot = None
+    self.wakeup = threading.Event()
+    self.thread = None
+    self.lock = threading.Lock()
+
+  def current(self):
+    if self.thread is None:
+      self.start()
+    return self.snapshot
+
+  def start(self):
+    with self.lock:
+      if self.thread is None:
+        self.thread = threading.Thread(target=self.run, name='catalogue', daemon=True)
+        self.thread.start()
+
+  def bump(self):
+    # called after a write commits, the rebuild happens on the background thread
+    self.wakeup.set()
+
+  def refresh(self):
+    version = self.version()
+    snapshot = self.snapshot
+    # upcoming counts age as shows pass, so an old snapshot is rebuilt anyway
+    if snapshot is None or snapshot.version != version or time.time() - snapshot.built_at > self.max_age:
+      self.snapshot = self.load(version)
+      return True
+    return False
+
+  def run(self):
+    while True:
+      try:
+        self.refresh()
+      except Exception:
+        log.exception('rebuilding the catalogue snapshot failed')
+      self.wakeup.wait(self.check_seconds)
+      self.wakeup.clear()
+
+def memory_per_rows(rows=100000, seed=0):
+  # bytes per 100k rows for the slotted records against the dicts and ORM-like
+  # instances with a __dict__ the listing pages used to build
+  import random
+  import tracemalloc
+
+  random.seed(seed)
+  cities = ['City %d' % i for i in range(200)]
+  states = ['CA', 'NY', 'TX', 'WA', 'IL']
+  genres = [frozenset(['Jazz', 'Blues']), frozenset(['Rock n Roll']), frozenset()]
+
+  class Plain(object):
+    def __init__(self, **fields):
+      self.__dict__.update(fields)
+
+  def measure(make):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [make(i) for i in range(rows)]
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return size * 100000 // rows
+
+  fields = lambda i: dict(id=i, name='Artist %d' % i, city=random.choice(cities), state=random.choice(states),
+                          num_upcoming_shows=random.randint(0, 5), genres=random.choice(genres))
+  return {
+    'rows': rows,
+    'slots_bytes_per_100k': measure(lambda i: ArtistRecord(**fields(i))),
+    'dict_bytes_per_100k': measure(lambda i: fields(i)),
+    'object_bytes_per_100k': measure(lambda i: Plain(**fields(i))),
+  }
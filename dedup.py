@@ -0,0 +1,134 @@
+#----------------------------------------------------------------------------#
+# Duplicate detection.
+# Names are normalised to tokens and character shingles, MinHash signatures
+# are computed for a whole block of records at once with numpy, and
+# locality sensitive hashing over signature bands proposes candidate pairs,
+# which are then scored by their exact shingle Jaccard similarity. Callers
+# feed one block (city/state) at a time, so memory is bounded by the largest
+# block rather than the catalogue. The database side lives in app.py.
+#----------------------------------------------------------------------------#
+
+import re
+import unicodedata
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+STOP_WORDS = {'the', 'a', 'an', 'of'}
+PRIME = (1 << 61) - 1 # hash family modulus, a * x + b stays below 2**64
+
+def tokens(name):
+  # "The Guns N' Petals!" -> ['guns', 'n', 'petals']
+  name = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode('ascii').lower()
+  name = name.replace('&', ' and ').replace("'", '')
+  return [token for token in re.split(r'[^a-z0-9]+', name) if token and token not in STOP_WORDS]
+
+def shingles(words, size=3):
+  # character shingles of the normalised name, padded so short words count
+  text = ' %s ' % ' '.join(words)
+  if len(text) <= size:
+    return {text}
+  return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def hash_shingles(grams):
+  return np.array([zlib.crc32(gram.encode('utf-8')) for gram in grams], dtype=np.uint64)
+
+def minhash_params(k=32, seed=0):
+  random = np.random.default_rng(seed)
+  return (random.integers(1, 1 << 29, size=k, dtype=np.uint64),
+          random.integers(0, PRIME, size=k, dtype=np.uint64))
+
+def signatures(hashed, params, chunk=2048):
+  # k x n matrix of minhashes for n shingle hash arrays, chunk records at a
+  # time so the k x shingles intermediate stays small
+  a, b = params
+  columns = []
+  for start in range(0, len(hashed), chunk):
+    part = hashed[start:start + chunk]
+    lengths = np.array([len(values) for values in part])
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    flat = np.concatenate(part)
+    values = (a[:, None] * flat[None, :] + b[:, None]) % np.uint64(PRIME)
+    columns.append(np.minimum.reduceat(values, offsets, axis=1))
+  return np.hstack(columns) if columns else np.empty((len(a), 0), dtype=np.uint64)
+
+def jaccard(left, right):
+  return len(left & right) / float(len(left | right))
+
+def find_duplicates(records, threshold=0.6, params=None, bands=8, max_bucket=500):
+  # records: (id, name) of one block. Yields (keep id, duplicate id, score)
+  # with the older (lower) id kept. Two kinds of buckets propose pairs: the
+  # same bag of tokens in any order, and the same minhash band
+  params = params if params is not None else minhash_params()
+  records = [(record_id, words) for record_id, words in ((record[0], tokens(record[1])) for record in records) if words]
+  if len(records) < 2:
+    return
+  grams = [shingles(words) for _, words in records]
+  matrix = signatures([hash_shingles(gram) for gram in grams], params)
+  rows = matrix.shape[0] // bands
+
+  buckets = defaultdict(list)
+  for i, (_, words) in enumerate(records):
+    buckets[('tokens', ' '.join(sorted(words)))].append(i)
+  for band in range(bands):
+    keys = matrix[band * rows:(band + 1) * rows].T
+    for i in range(len(records)):
+      buckets[(band, keys[i].tobytes())].append(i)
+
+  seen = set()
+  for members in buckets.values():
+    # a huge bucket is a common name pattern, not a duplicate group
+    if len(members) < 2 or len(members) > max_bucket:
+      continue
+    for x in range(len(members)):
+      for y in range(x + 1, len(members)):
+        i, j = members[x], members[y]
+        if (i, j) in seen:
+          continue
+        seen.add((i, j))
+        score = jaccard(grams[i], grams[j])
+        if score >= threshold:
+          left, right = records[i][0], records[j][0]
+          yield min(left, right), max(left, right), round(score, 4)
+
+def benchmark(records=1000000, blocks=2000, duplicate_rate=0.02, seed=0):
+  # synthetic names in city blocks with a share of them respelled, reports
+  # throughput and how many planted duplicates were found
+  import random
+  import time
+
+  random.seed(seed)
+  words = ['sound', 'hall', 'club', 'jazz', 'blue', 'note', 'guns', 'petals', 'park', 'square', 'live',
+           'music', 'coffee', 'red', 'rock', 'room', 'house', 'cellar', 'garden', 'barn', 'tavern', 'lounge']
+  def respell(name):
+    choice = random.random()
+    if choice < 0.4:
+      return name.replace(' ', "' ", 1)
+    if choice < 0.7:
+      return 'The ' + name
+    return name[:-1]
+
+  per_block = records // blocks
+  params = minhash_params()
+  started = time.perf_counter()
+  found = planted = 0
+  for block in range(blocks):
+    names = []
+    for i in range(per_block):
+      record_id = block * per_block + i
+      if names and random.random() < duplicate_rate:
+        names.append((record_id, respell(random.choice(names)[1])))
+        planted += 1
+      else:
+        names.append((record_id, ' '.join(random.choice(words) for _ in range(3)) + ' %d' % random.randint(1, 999)))
+    found += sum(1 for _ in find_duplicates(names, params=params))
+  elapsed = time.perf_counter() - started
+  return {
+    'records': records,
+    'blocks': blocks,
+    'seconds': elapsed,
+    'records_per_second': records / elapsed,
+    'planted_duplicates': planted,
+    'pairs_found': found,
+  }
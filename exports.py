@@ -0,0 +1,151 @@
+#----------------------------------------------------------------------------#
+# Bulk export.
+# Rows arrive as an iterator (a server side cursor in app.py) and leave as
+# chunks of CSV, JSON lines or Parquet bytes, batch rows at a time, so a
+# table is never held in memory whatever its size. Parquet needs pyarrow;
+# each batch becomes one row group.
+#----------------------------------------------------------------------------#
+
+import csv
+import io
+import itertools
+import json
+import time
+from datetime import date, datetime
+
+try:
+  import pyarrow
+  import pyarrow.parquet
+except ImportError: # pyarrow is optional, csv and jsonl work without it
+  pyarrow = None
+
+FORMATS = {
+  'csv': ('text/csv', 'csv'),
+  'jsonl': ('application/x-ndjson', 'jsonl'),
+  'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+def available_formats():
+  return [name for name in FORMATS if name != 'parquet' or pyarrow is not None]
+
+def batches(rows, size):
+  rows = iter(rows)
+  while True:
+    batch = list(itertools.islice(rows, size))
+    if not batch:
+      return
+    yield batch
+
+def text_value(value):
+  if isinstance(value, (datetime, date)):
+    return value.isoformat()
+  return value
+
+def csv_chunks(columns, rows, batch):
+  buffer = io.StringIO()
+  writer = csv.writer(buffer, lineterminator='\n')
+  writer.writerow([name for name, _ in columns])
+  for part in batches(rows, batch):
+    writer.writerows([text_value(value) for value in row] for row in part)
+    yield buffer.getvalue().encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate()
+  if buffer.tell():
+    yield buffer.getvalue().encode('utf-8')
+
+def jsonl_chunks(columns, rows, batch):
+  names = [name for name, _ in columns]
+  for part in batches(rows, batch):
+    lines = [json.dumps(dict(zip(names, [text_value(value) for value in row])), separators=(',', ':'))
+             for row in part]
+    yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+class ChunkSink(object):
+  # write-only file for pyarrow that hands back what was written so far,
+  # so a Parquet file can be streamed without a temporary file
+  closed = False
+
+  def __init__(self):
+    self.parts = []
+    self.position = 0
+
+  def write(self, data):
+    data = bytes(data)
+    self.parts.append(data)
+    self.position += len(data)
+    return len(data)
+
+  def tell(self):
+    return self.position
+
+  def writable(self):
+    return True
+
+  def seekable(self):
+    return False
+
+  def flush(self):
+    pass
+
+  def close(self):
+    self.closed = True
+
+  def take(self):
+    data = b''.join(self.parts)
+    self.parts = []
+    return data
+
+def arrow_schema(columns):
+  # column kinds as app.py names them -> arrow types
+  types = {'int': pyarrow.int64(), 'float': pyarrow.float64(), 'bool': pyarrow.bool_(),
+           'str': pyarrow.string(), 'datetime': pyarrow.timestamp('us'), 'date': pyarrow.date32()}
+  return pyarrow.schema([(name, types[kind]) for name, kind in columns])
+
+def parquet_chunks(columns, rows, batch):
+  if pyarrow is None:
+    raise ValueError('parquet export needs pyarrow')
+  schema = arrow_schema(columns)
+  sink = ChunkSink()
+  writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='snappy')
+  for part in batches(rows, batch):
+    writer.write_table(pyarrow.Table.from_arrays(
+      [pyarrow.array(values, type=field.type) for values, field in zip(zip(*part), schema)], schema=schema),
+      row_group_size=batch)
+    yield sink.take()
+  writer.close()
+  yield sink.take()
+
+WRITERS = {'csv': csv_chunks, 'jsonl': jsonl_chunks, 'parquet': parquet_chunks}
+
+def chunks(format, columns, rows, batch=10000):
+  # columns: [(name, kind)]; rows: tuples in column order
+  if format not in WRITERS or format not in available_formats():
+    raise ValueError('unknown or unavailable export format ' + format)
+  return WRITERS[format](columns, rows, batch)
+
+class Meter(object):
+  # counts rows and bytes flowing through an export, for the throughput report
+  def __init__(self):
+    self.rows = 0
+    self.bytes = 0
+    self.started = time.perf_counter()
+
+  def count_rows(self, rows):
+    for row in rows:
+      self.rows += 1
+      yield row
+
+  def count_bytes(self, chunks):
+    for chunk in chunks:
+      self.bytes += len(chunk)
+      yield chunk
+
+  def report(self):
+    seconds = time.perf_counter() - self.started
+    return {
+      'rows': self.rows,
+      'bytes': self.bytes,
+      'seconds': round(seconds, 3),
+      'rows_per_second': round(self.rows / seconds) if seconds else 0,
+      'mb_per_second': round(self.bytes / seconds / 1e6, 2) if seconds else 0,
+    }
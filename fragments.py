@@ -0,0 +1,117 @@
+#----------------------------------------------------------------------------#
+# Fragment cache.
+# {% cache 'name', id, version, ... %}...{% endcache %} renders its body once
+# per key and reuses the html across pages and requests. Keys carry the
+# versions (updated_at) of what the fragment prints, so an edit moves the key
+# and the old entry simply ages out. Entries are kept in LRU order within an
+# entry and a byte budget.
+#----------------------------------------------------------------------------#
+
+import sys
+import threading
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+class FragmentCache(object):
+
+  def __init__(self, max_entries=10000, max_bytes=16 * 1024 * 1024):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.entries = OrderedDict() # key -> (html, size)
+    self.size = 0
+    self.lock = threading.Lock()
+    self.hits = {} # fragment name -> count
+    self.misses = {}
+    self.evictions = 0
+    self.version = None
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        self.misses[key[0]] = self.misses.get(key[0], 0) + 1
+        return None
+      self.entries.move_to_end(key)
+      self.hits[key[0]] = self.hits.get(key[0], 0) + 1
+      return entry[0]
+
+  def set(self, key, html):
+    size = sys.getsizeof(html)
+    if size > self.max_bytes:
+      return
+    with self.lock:
+      previous = self.entries.pop(key, None)
+      if previous is not None:
+        self.size -= previous[1]
+      self.entries[key] = (html, size)
+      self.size += size
+      while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+        _, (_, evicted) = self.entries.popitem(last=False)
+        self.size -= evicted
+        self.evictions += 1
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.size = 0
+
+  def check(self, version):
+    # drops everything when something every fragment depends on moved,
+    # e.g. the thumbnail manifest
+    if version != self.version:
+      self.clear()
+      self.version = version
+
+  def stats(self):
+    with self.lock:
+      names = sorted(set(self.hits) | set(self.misses))
+      fragments = {}
+      for name in names:
+        hits, misses = self.hits.get(name, 0), self.misses.get(name, 0)
+        fragments[name] = dict(hits=hits, misses=misses, hit_ratio=hits / (hits + misses))
+      hits, misses = sum(self.hits.values()), sum(self.misses.values())
+      return dict(entries=len(self.entries), bytes=self.size, evictions=self.evictions,
+                  hits=hits, misses=misses, hit_ratio=hits / (hits + misses) if hits + misses else 0.0,
+                  fragments=fragments)
+
+def prometheus(stats, prefix='fyyur_fragment_cache_'):
+  lines = [
+    '# TYPE %sentries gauge' % prefix, '%sentries %d' % (prefix, stats['entries']),
+    '# TYPE %sbytes gauge' % prefix, '%sbytes %d' % (prefix, stats['bytes']),
+    '# TYPE %sevictions_total counter' % prefix, '%sevictions_total %d' % (prefix, stats['evictions']),
+  ]
+  for metric in ('hits', 'misses'):
+    lines.append('# TYPE %s%s_total counter' % (prefix, metric))
+    for name, values in stats['fragments'].items():
+      lines.append('%s%s_total{fragment="%s"} %d' % (prefix, metric, name, values[metric]))
+  return '\n'.join(lines) + '\n'
+
+class FragmentCacheExtension(Extension):
+  # the cache is environment.fragment_cache; left None the tag just renders its body
+  tags = {'cache'}
+
+  def __init__(self, environment):
+    super(FragmentCacheExtension, self).__init__(environment)
+    environment.extend(fragment_cache=None)
+
+  def parse(self, parser):
+    lineno = next(parser.stream).lineno
+    key = [parser.parse_expression()]
+    while parser.stream.skip_if('comma'):
+      key.append(parser.parse_expression())
+    body = parser.parse_statements(['name:endcache'], drop_needle=True)
+    return nodes.CallBlock(self.call_method('_render', [nodes.List(key)]), [], [], body).set_lineno(lineno)
+
+  def _render(self, key, caller):
+    cache = self.environment.fragment_cache
+    if cache is None:
+      return caller()
+    key = tuple(key)
+    html = cache.get(key)
+    if html is None:
+      html = str(caller())
+      cache.set(key, html)
+    return Markup(html)
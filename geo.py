@@ -0,0 +1,204 @@
+#----------------------------------------------------------------------------#
+# Geospatial helpers.
+# Geohash encoding for the indexed prefix search, an offline gazetteer for
+# geocoding city/state pairs and an in-memory KD-tree for databases without
+# a usable geohash index (SQLite in tests).
+#----------------------------------------------------------------------------#
+
+import csv
+import math
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_KM = 6371.0088
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 9 # stored geohash length, roughly 5m cells
+
+def encode(latitude, longitude, precision=PRECISION):
+  lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+  code, bits, bit_count, even = [], 0, 0, True
+  while len(code) < precision:
+    interval, value = (lng_range, longitude) if even else (lat_range, latitude)
+    middle = (interval[0] + interval[1]) / 2
+    bits <<= 1
+    if value >= middle:
+      bits |= 1
+      interval[0] = middle
+    else:
+      interval[1] = middle
+    even = not even
+    bit_count += 1
+    if bit_count == 5:
+      code.append(BASE32[bits])
+      bits, bit_count = 0, 0
+  return ''.join(code)
+
+def bounds(geohash):
+  # (south, west, north, east) of the cell
+  lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+  even = True
+  for char in geohash:
+    value = BASE32.index(char)
+    for shift in range(4, -1, -1):
+      interval = lng_range if even else lat_range
+      middle = (interval[0] + interval[1]) / 2
+      if value >> shift & 1:
+        interval[0] = middle
+      else:
+        interval[1] = middle
+      even = not even
+  return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+def neighbours(geohash):
+  # the cell itself and the 8 cells around it
+  south, west, north, east = bounds(geohash)
+  height, width = north - south, east - west
+  latitude, longitude = (south + north) / 2, (west + east) / 2
+  cells = set()
+  for dlat in (-height, 0, height):
+    for dlng in (-width, 0, width):
+      lat = latitude + dlat
+      if -90 <= lat <= 90:
+        lng = (longitude + dlng + 180) % 360 - 180
+        cells.add(encode(lat, lng, len(geohash)))
+  return sorted(cells)
+
+def precision_for_radius(latitude, longitude, radius_km):
+  # longest geohash whose 9 neighbouring cells still cover the whole circle
+  for precision in range(PRECISION, 0, -1):
+    if coverage_km(latitude, encode(latitude, longitude, precision)) >= radius_km:
+      return precision
+  return 1
+
+def haversine_km(lat1, lng1, lat2, lng2):
+  # works on floats and numpy arrays alike
+  lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+  a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+  return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+def load_gazetteer(path):
+  # csv with city,state,latitude,longitude columns -> {(city, state): (lat, lng)}
+  places = {}
+  with open(path, newline='', encoding='utf-8') as f:
+    for row in csv.DictReader(f):
+      places[row['city'].strip().lower(), row['state'].strip().upper()] = (float(row['latitude']), float(row['longitude']))
+  return places
+
+def to_xyz(latitudes, longitudes):
+  latitudes, longitudes = np.radians(latitudes), np.radians(longitudes)
+  return np.column_stack([np.cos(latitudes) * np.cos(longitudes),
+                          np.cos(latitudes) * np.sin(longitudes),
+                          np.sin(latitudes)])
+
+def chord(km):
+  # straight line distance through the unit sphere for an arc of km
+  return 2 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2)
+
+class KDIndex(object):
+  # points on the unit sphere, so euclidean neighbours are great circle neighbours
+
+  def __init__(self, ids, latitudes, longitudes):
+    self.ids = np.asarray(ids)
+    self.latitudes = np.asarray(latitudes, dtype=np.float64)
+    self.longitudes = np.asarray(longitudes, dtype=np.float64)
+    self.tree = cKDTree(to_xyz(self.latitudes, self.longitudes)) if len(self.ids) else None
+
+  def _results(self, latitude, longitude, positions):
+    distances = haversine_km(latitude, longitude, self.latitudes[positions], self.longitudes[positions])
+    order = np.argsort(distances, kind='stable')
+    return [(int(self.ids[positions[i]]), float(distances[i])) for i in order]
+
+  def nearest(self, latitude, longitude, k, radius_km=None):
+    if self.tree is None:
+      return []
+    bound = chord(radius_km) if radius_km else np.inf
+    _, positions = self.tree.query(to_xyz([latitude], [longitude])[0], k=min(k, len(self.ids)), distance_upper_bound=bound)
+    positions = np.atleast_1d(positions)
+    return self._results(latitude, longitude, positions[positions < len(self.ids)])
+
+  def within(self, latitude, longitude, radius_km):
+    if self.tree is None:
+      return []
+    positions = np.array(self.tree.query_ball_point(to_xyz([latitude], [longitude])[0], chord(radius_km)), dtype=np.int64)
+    return self._results(latitude, longitude, positions)
+
+def coverage_km(latitude, geohash):
+  # distance from a point in the cell to the outer edge of its 3x3 block,
+  # any venue closer than this is guaranteed to be in one of the 9 cells
+  south, west, north, east = bounds(geohash)
+  height = (north - south) * math.pi * EARTH_RADIUS_KM / 180
+  width = (east - west) * math.pi * EARTH_RADIUS_KM / 180 * math.cos(math.radians(min(abs(latitude) + (north - south), 90)))
+  return min(height, width)
+
+def nearest_by_prefix(candidates, latitude, longitude, k=10, radius_km=None, start_precision=6):
+  # candidates(cells) returns (id, latitude, longitude) rows whose geohash
+  # starts with any of the cells, i.e. one indexed range scan per cell.
+  # Widens the cells until the k nearest are guaranteed to be inside them.
+  # With radius_km every venue within it is returned when k is None
+  precision = precision_for_radius(latitude, longitude, radius_km) if radius_km else start_precision
+  while True:
+    geohash = encode(latitude, longitude, precision)
+    rows = candidates(neighbours(geohash))
+    if rows:
+      ids = np.array([row[0] for row in rows])
+      distances = haversine_km(latitude, longitude,
+                               np.array([row[1] for row in rows], dtype=np.float64),
+                               np.array([row[2] for row in rows], dtype=np.float64))
+    else:
+      ids, distances = np.array([], dtype=np.int64), np.array([])
+
+    if radius_km:
+      keep = distances <= radius_km
+      ids, distances = ids[keep], distances[keep]
+    order = np.argsort(distances, kind='stable')[:k]
+    enough = len(order) == k and distances[order[-1]] <= coverage_km(latitude, geohash)
+    if radius_km or enough or precision == 1:
+      return [(int(ids[i]), float(distances[i])) for i in order]
+    precision -= 1
+
+def benchmark(venues=1000000, queries=200, k=10, radius_km=25, seed=0):
+  # synthetic venues spread over the continental US; the geohash side keeps a
+  # sorted array and bisects it per cell, which is what a btree range scan does
+  import bisect
+  import time
+
+  random = np.random.default_rng(seed)
+  latitudes = random.uniform(25, 49, venues)
+  longitudes = random.uniform(-124, -67, venues)
+  ids = np.arange(venues)
+
+  started = time.perf_counter()
+  hashes = [encode(lat, lng) for lat, lng in zip(latitudes.tolist(), longitudes.tolist())]
+  order = sorted(range(venues), key=hashes.__getitem__)
+  sorted_hashes = [hashes[i] for i in order]
+  build_geohash = time.perf_counter() - started
+
+  started = time.perf_counter()
+  index = KDIndex(ids, latitudes, longitudes)
+  build_kdtree = time.perf_counter() - started
+
+  def candidates(cells):
+    rows = []
+    for cell in cells:
+      start = bisect.bisect_left(sorted_hashes, cell)
+      stop = bisect.bisect_left(sorted_hashes, cell + '~')
+      rows.extend((order[i], latitudes[order[i]], longitudes[order[i]]) for i in range(start, stop))
+    return rows
+
+  points = list(zip(random.uniform(26, 48, queries).tolist(), random.uniform(-123, -68, queries).tolist()))
+  results = {'venues': venues, 'queries': queries,
+             'build_geohash_s': build_geohash, 'build_kdtree_s': build_kdtree}
+  for name, search in (
+      ('geohash_nearest', lambda lat, lng: nearest_by_prefix(candidates, lat, lng, k)),
+      ('geohash_radius', lambda lat, lng: nearest_by_prefix(candidates, lat, lng, None, radius_km)),
+      ('kdtree_nearest', lambda lat, lng: index.nearest(lat, lng, k)),
+      ('kdtree_radius', lambda lat, lng: index.within(lat, lng, radius_km))):
+    timings = []
+    for lat, lng in points:
+      started = time.perf_counter()
+      search(lat, lng)
+      timings.append((time.perf_counter() - started) * 1000)
+    results[name + '_p50_ms'] = float(np.percentile(timings, 50))
+    results[name + '_p99_ms'] = float(np.percentile(timings, 99))
+  return results
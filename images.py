@@ -0,0 +1,147 @@
+#----------------------------------------------------------------------------#
+# Image pipeline.
+# Fetches remote image links once, validates them and stores fixed size
+# thumbnails on disk under content hash names, so pages serve them from
+# static/ instead of hotlinking the full size originals.
+#----------------------------------------------------------------------------#
+
+import hashlib
+import io
+import json
+import os
+import time
+import urllib.request
+
+try:
+  from PIL import Image
+except ImportError: # pillow is optional, originals are stored as is without it
+  Image = None
+
+MANIFEST = 'manifest.json'
+
+# magic bytes of the formats we accept when pillow is not installed
+SIGNATURES = [
+  (b'\xff\xd8\xff', 'jpg'),
+  (b'\x89PNG\r\n\x1a\n', 'png'),
+  (b'GIF87a', 'gif'),
+  (b'GIF89a', 'gif'),
+  (b'RIFF', 'webp'),
+]
+
+class ImageError(Exception):
+  pass
+
+def load_manifest(directory):
+  # maps every fetched url to the thumbnail file name stored in directory
+  path = os.path.join(directory, MANIFEST)
+  if not os.path.exists(path):
+    return {}
+  with open(path) as f:
+    return json.load(f)
+
+def save_manifest(directory, manifest):
+  # write to a temporary file first so readers never see a half written manifest
+  path = os.path.join(directory, MANIFEST)
+  with open(path + '.tmp', 'w') as f:
+    json.dump(manifest, f, indent=2, sort_keys=True)
+  os.replace(path + '.tmp', path)
+
+def fetch_image(url, timeout=10, max_bytes=10 * 1024 * 1024):
+  if not url or not url.startswith(('http://', 'https://')):
+    raise ImageError('Unsupported image link ' + str(url))
+
+  request = urllib.request.Request(url, headers={'User-Agent': 'fyyur-thumbnailer'})
+  with urllib.request.urlopen(request, timeout=timeout) as response:
+    data = response.read(max_bytes + 1)
+
+  if len(data) > max_bytes:
+    raise ImageError('Image at ' + url + ' is larger than ' + str(max_bytes) + ' bytes')
+  return data
+
+def sniff_extension(data):
+  for signature, extension in SIGNATURES:
+    if data.startswith(signature):
+      return extension
+  raise ImageError('Unrecognised image format')
+
+def make_thumbnail(data, size):
+  # returns (bytes, extension) of a thumbnail that fits in size, keeping aspect ratio
+  if Image is None:
+    return data, sniff_extension(data)
+
+  try:
+    image = Image.open(io.BytesIO(data))
+    image.verify()
+    # verify() leaves the image unusable, so it has to be reopened
+    image = Image.open(io.BytesIO(data))
+    image = image.convert('RGB')
+    image.thumbnail(size)
+  except Exception as e:
+    raise ImageError('Invalid image: ' + str(e))
+
+  output = io.BytesIO()
+  image.save(output, format='JPEG', quality=80, optimize=True, progressive=True)
+  return output.getvalue(), 'jpg'
+
+def store(directory, data, extension):
+  # content addressed, identical images fetched from different urls share one file
+  filename = hashlib.sha256(data).hexdigest()[:32] + '.' + extension
+  path = os.path.join(directory, filename)
+  if not os.path.exists(path):
+    with open(path + '.tmp', 'wb') as f:
+      f.write(data)
+    os.replace(path + '.tmp', path)
+  return filename
+
+def prefetch(urls, directory, size=(400, 400), timeout=10, refresh=False):
+  # fetches every url not already in the manifest, returns (fetched, skipped, failed)
+  os.makedirs(directory, exist_ok=True)
+  manifest = load_manifest(directory)
+  fetched, skipped, failed = 0, 0, []
+
+  for url in set(url for url in urls if url):
+    if url in manifest and not refresh and os.path.exists(os.path.join(directory, manifest[url])):
+      skipped += 1
+      continue
+    try:
+      thumbnail, extension = make_thumbnail(fetch_image(url, timeout), size)
+      manifest[url] = store(directory, thumbnail, extension)
+      fetched += 1
+    except Exception as e:
+      failed.append((url, str(e)))
+
+  save_manifest(directory, manifest)
+  return fetched, skipped, failed
+
+class ThumbnailIndex(object):
+  # in memory view of the manifest, reloaded when the file changes on disk;
+  # the file is looked at no more than every check_every seconds
+
+  def __init__(self, directory, check_every=0):
+    self.directory = directory
+    self.check_every = check_every
+    self.checked = None
+    self.mtime = None
+    self.manifest = {}
+
+  def refresh(self):
+    # mtime of the manifest, None while there is none
+    now = time.monotonic()
+    if self.checked is not None and now - self.checked < self.check_every:
+      return self.mtime
+    self.checked = now
+    path = os.path.join(self.directory, MANIFEST)
+    try:
+      mtime = os.path.getmtime(path)
+    except OSError:
+      self.manifest, self.mtime = {}, None
+      return None
+    if mtime != self.mtime:
+      self.manifest = load_manifest(self.directory)
+      self.mtime = mtime
+    return mtime
+
+  def lookup(self, url):
+    if self.refresh() is None:
+      return None
+    return self.manifest.get(url)
@@ -0,0 +1,56 @@
+#----------------------------------------------------------------------------#
+# Batch loaders.
+# DataLoader-style coalescing: resolvers only say which ids they want, and
+# every loader then fetches all of its wanted ids with one call. Loading an
+# entity may want others (a show wants its venue and artist), so loaders are
+# dispatched in rounds until nothing new is wanted. Results are memoised for
+# the lifetime of the loader, i.e. one request.
+#----------------------------------------------------------------------------#
+
+class Loader(object):
+
+  def __init__(self, fetch):
+    # fetch(ids) -> {id: value}, ids it does not return are cached as missing
+    self.fetch = fetch
+    self.cache = {}
+    self.pending = set()
+    self.calls = 0
+
+  def want(self, key):
+    if key not in self.cache:
+      self.pending.add(key)
+
+  def want_many(self, keys):
+    for key in keys:
+      self.want(key)
+
+  def dispatch(self):
+    # one fetch for everything wanted since the last dispatch
+    keys = self.pending - set(self.cache)
+    self.pending = set()
+    if not keys:
+      return False
+    self.calls += 1
+    found = self.fetch(sorted(keys))
+    for key in keys:
+      self.cache[key] = found.get(key)
+    return True
+
+  def get(self, key):
+    return self.cache.get(key)
+
+  def loaded(self):
+    return {key: value for key, value in self.cache.items() if value is not None}
+
+  def missing(self):
+    return sorted(key for key, value in self.cache.items() if value is None)
+
+def resolve(loaders):
+  # dispatches the loaders round by round until none has anything pending,
+  # returns the number of rounds
+  rounds = 0
+  while True:
+    dispatched = [loader.dispatch() for loader in loaders]
+    if not any(dispatched):
+      return rounds
+    rounds += 1
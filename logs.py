@@ -0,0 +1,99 @@
+#----------------------------------------------------------------------------#
+# Logging.
+# Request threads only put records on a queue; a listener thread formats
+# them as JSON lines and writes them to a rotating file, so a slow disk never
+# holds up a response.
+#----------------------------------------------------------------------------#
+
+import atexit
+import copy
+import json
+import logging
+import queue
+import traceback
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# LogRecord attributes that are not extra fields passed by the caller
+RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+class JSONFormatter(logging.Formatter):
+  # one object per line: time, level, logger, message, then the request
+  # context and any extra fields, and the traceback when there is one
+
+  def format(self, record):
+    data = {
+      'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+      'level': record.levelname,
+      'logger': record.name,
+      'message': record.getMessage(),
+    }
+    for key, value in vars(record).items():
+      if key not in RECORD_FIELDS and not key.startswith('_'):
+        data[key] = value
+    if record.exc_text:
+      data['exception'] = record.exc_text
+    elif record.exc_info:
+      data['exception'] = ''.join(traceback.format_exception(*record.exc_info))
+    return json.dumps(data, default=str, separators=(',', ':'))
+
+class ContextFilter(logging.Filter):
+  # adds context() to every record on the thread that logs it, e.g. the
+  # request id and route, which the listener thread can no longer see
+
+  def __init__(self, context):
+    super(ContextFilter, self).__init__()
+    self.context = context
+
+  def filter(self, record):
+    for key, value in self.context().items():
+      if not hasattr(record, key):
+        setattr(record, key, value)
+    return True
+
+class NonBlockingQueueHandler(QueueHandler):
+  # drops records instead of waiting when the listener has fallen behind
+
+  def __init__(self, records):
+    super(NonBlockingQueueHandler, self).__init__(records)
+    self.dropped = 0
+
+  def prepare(self, record):
+    # the traceback is rendered here, exc_info does not survive the queue
+    record = copy.copy(record)
+    if record.exc_info and not record.exc_text:
+      record.exc_text = ''.join(traceback.format_exception(*record.exc_info))
+    record.msg = record.getMessage()
+    record.args = None
+    record.exc_info = None
+    return record
+
+  def enqueue(self, record):
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      self.dropped += 1
+
+def setup(logger, path, level=logging.INFO, max_bytes=10 * 1024 * 1024, backup_count=5,
+          queue_size=10000, context=None, console=False):
+  # routes logger through a queue to a rotating JSON file (and the console in
+  # debug); returns the queue handler so callers can read its drop count
+  file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+  file_handler.setFormatter(JSONFormatter())
+  handlers = [file_handler]
+  if console:
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    handlers.append(stream_handler)
+
+  queue_handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+  if context is not None:
+    queue_handler.addFilter(ContextFilter(context))
+  logger.addHandler(queue_handler)
+  logger.setLevel(level)
+
+  listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+  listener.start()
+  # flush what is still queued when the process exits
+  atexit.register(listener.stop)
+  return queue_handler
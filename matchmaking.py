@@ -0,0 +1,151 @@
+#----------------------------------------------------------------------------#
+# Matchmaking.
+# Scores every artist seeking a venue against every venue seeking talent in
+# batch, using sparse genre membership matrices, location and show history.
+# The database side (loading rows, storing the top matches) lives in app.py.
+#----------------------------------------------------------------------------#
+
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+from scipy import sparse
+
+log = logging.getLogger(__name__)
+
+# weights of the score components, every component is in [0, 1]
+WEIGHTS = {
+  'genre': 0.6,    # cosine similarity of the genre sets
+  'city': 0.25,    # same city and state, half of it for the same state only
+  'history': 0.15, # shows the pair already played together, saturating at 3
+}
+
+# ids, city/state keys and L2 normalised genre membership rows aligned to ids
+Side = namedtuple('Side', 'ids index cities states genres')
+
+def build_side(rows, genre_pairs, genre_index):
+  # rows are (id, city, state), genre_pairs are (owner id, genre id)
+  ids = np.array([row[0] for row in rows], dtype=np.int64)
+  index = {owner_id: i for i, owner_id in enumerate(ids.tolist())}
+  cities = np.array([hash(((row[1] or '').lower(), (row[2] or '').upper())) for row in rows], dtype=np.int64)
+  states = np.array([hash((row[2] or '').upper()) for row in rows], dtype=np.int64)
+
+  pairs = [(index[owner_id], genre_index[genre_id]) for owner_id, genre_id in genre_pairs
+           if owner_id in index and genre_id in genre_index]
+  data = np.ones(len(pairs), dtype=np.float32)
+  row_ind = np.array([pair[0] for pair in pairs], dtype=np.int64)
+  col_ind = np.array([pair[1] for pair in pairs], dtype=np.int64)
+  genres = sparse.csr_matrix((data, (row_ind, col_ind)), shape=(len(ids), len(genre_index)))
+  genres.sum_duplicates()
+  genres.data[:] = 1
+
+  norms = np.sqrt(np.asarray(genres.sum(axis=1)).ravel())
+  norms[norms == 0] = 1
+  genres = sparse.diags(1 / norms).dot(genres).tocsr()
+  return Side(ids, index, cities, states, genres)
+
+def history_matrix(artists, venues, show_pairs):
+  # artists x venues sparse matrix of how many shows each pair played
+  pairs = [(artists.index[artist_id], venues.index[venue_id]) for artist_id, venue_id in show_pairs
+           if artist_id in artists.index and venue_id in venues.index]
+  data = np.ones(len(pairs), dtype=np.float32)
+  row_ind = np.array([pair[0] for pair in pairs], dtype=np.int64)
+  col_ind = np.array([pair[1] for pair in pairs], dtype=np.int64)
+  return sparse.csr_matrix((data, (row_ind, col_ind)), shape=(len(artists.ids), len(venues.ids)))
+
+def score_block(artists, venues, history, start, stop, weights=WEIGHTS):
+  # dense scores of artists[start:stop] against every venue
+  genre = artists.genres[start:stop].dot(venues.genres.T).toarray()
+  city = (artists.cities[start:stop, None] == venues.cities[None, :]).astype(np.float32)
+  state = (artists.states[start:stop, None] == venues.states[None, :]).astype(np.float32)
+  played = np.minimum(history[start:stop].toarray() / 3.0, 1.0)
+  return weights['genre'] * genre \
+       + weights['city'] * np.maximum(city, 0.5 * state) \
+       + weights['history'] * played
+
+def top_k(scores, k, axis):
+  # indices of the k best scores along axis, unordered
+  k = min(k, scores.shape[axis])
+  if k == 0:
+    return np.empty((0, scores.shape[1 - axis]) if axis == 0 else (scores.shape[0], 0), dtype=np.int64)
+  return np.argpartition(-scores, k - 1, axis=axis).take(np.arange(k), axis=axis)
+
+def top_matches(artists, venues, history, k=10, chunk=1024, weights=WEIGHTS):
+  # yields (artist id, venue id, score) for each artist's k best venues and
+  # each venue's k best artists, scoring chunk artists at a time to bound memory
+  if len(artists.ids) == 0 or len(venues.ids) == 0:
+    return
+
+  best_scores = np.full((0, len(venues.ids)), -np.inf, dtype=np.float32)
+  best_artists = np.empty((0, len(venues.ids)), dtype=np.int64)
+  columns = np.arange(len(venues.ids))
+
+  for start in range(0, len(artists.ids), chunk):
+    stop = min(start + chunk, len(artists.ids))
+    scores = score_block(artists, venues, history, start, stop, weights).astype(np.float32)
+
+    venue_picks = top_k(scores, k, axis=1)
+    for i in range(stop - start):
+      for j in venue_picks[i]:
+        yield int(artists.ids[start + i]), int(venues.ids[j]), float(scores[i, j])
+
+    # merge this chunk into the running k best artists of every venue
+    candidate_scores = np.vstack([best_scores, scores])
+    candidate_artists = np.vstack([best_artists, np.broadcast_to(np.arange(start, stop)[:, None], scores.shape)])
+    keep = top_k(candidate_scores, k, axis=0)
+    best_scores = candidate_scores[keep, columns]
+    best_artists = candidate_artists[keep, columns]
+
+  for i in range(best_scores.shape[0]):
+    for j in columns:
+      yield int(artists.ids[best_artists[i, j]]), int(venues.ids[j]), float(best_scores[i, j])
+
+class RefreshQueue(object):
+  # ids of written artists and venues, refreshed by refresh(key, artist_ids,
+  # venue_ids) on a thread of its own so a write only pays for a set update.
+  # Ids are queued per key (the shard they live on); ids written while a
+  # refresh runs are coalesced into the next one
+
+  def __init__(self, refresh, delay=1.0):
+    self.refresh = refresh
+    self.delay = delay
+    self.pending = {} # key -> (artist ids, venue ids)
+    self.lock = threading.Lock()
+    self.wakeup = threading.Event()
+    self.idle = threading.Event()
+    self.idle.set()
+    self.thread = None
+
+  def put(self, artist_ids=(), venue_ids=(), key=None):
+    with self.lock:
+      artists, venues = self.pending.setdefault(key, (set(), set()))
+      artists.update(artist_ids)
+      venues.update(venue_ids)
+      self.idle.clear()
+      if self.thread is None:
+        self.thread = threading.Thread(target=self.run, name='matches', daemon=True)
+        self.thread.start()
+    self.wakeup.set()
+
+  def run(self):
+    while True:
+      self.wakeup.wait()
+      # a burst of writes becomes one refresh
+      time.sleep(self.delay)
+      self.wakeup.clear()
+      with self.lock:
+        pending, self.pending = self.pending, {}
+      for key, (artists, venues) in pending.items():
+        try:
+          self.refresh(key, sorted(artists) or None, sorted(venues) or None)
+        except Exception:
+          log.exception('refreshing matches of %d artists and %d venues failed', len(artists), len(venues))
+      with self.lock:
+        if not self.pending:
+          self.idle.set()
+
+  def join(self, timeout=None):
+    # waits until everything queued so far is refreshed
+    return self.idle.wait(timeout)
@@ -0,0 +1,60 @@
+"""show rollups
+
+Revision ID: 0d6a5c3e9b72
+Revises: 8b4d2f6e1a37
+Create Date: 2026-10-19 19:41:06.215873
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0d6a5c3e9b72'
+down_revision = '8b4d2f6e1a37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Show_Rollup',
+    sa.Column('grain', sa.String(length=5), nullable=False),
+    sa.Column('dimension', sa.String(length=10), nullable=False),
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('bucket', sa.Date(), nullable=False),
+    sa.Column('shows', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('grain', 'dimension', 'key', 'bucket')
+    )
+    op.create_index('ix_Show_Rollup_grain_dimension_bucket', 'Show_Rollup', ['grain', 'dimension', 'bucket'], unique=False)
+    # the same counts "python3 app.py rollup" computes, keys as in rollups.keys()
+    op.execute('''
+      WITH shows AS (
+        SELECT s.venue_id, s.artist_id, s.show_date,
+               CASE WHEN trim(v.city) <> '' THEN trim(v.city) || ', ' || upper(trim(v.state)) END AS city
+        FROM (SELECT venue_id, artist_id, show_date, deleted_at FROM "Show"
+              UNION ALL
+              SELECT venue_id, artist_id, show_date, deleted_at FROM "Show_Archive") s
+        JOIN "Venue" v ON v.id = s.venue_id AND v.deleted_at IS NULL
+        JOIN "Artist" a ON a.id = s.artist_id AND a.deleted_at IS NULL
+        WHERE s.deleted_at IS NULL
+      ), genres AS (
+        SELECT shows.*, g.genre_id FROM shows JOIN "Artist_Genres" g ON g.artist_id = shows.artist_id
+      )
+      INSERT INTO "Show_Rollup" (grain, dimension, key, bucket, shows)
+      SELECT grain, dimension, key, date_trunc(grain, show_date)::date, count(*)
+      FROM (
+        SELECT 'all' AS dimension, '' AS key, show_date FROM shows
+        UNION ALL SELECT 'venue', venue_id::text, show_date FROM shows
+        UNION ALL SELECT 'artist', artist_id::text, show_date FROM shows
+        UNION ALL SELECT 'city', city, show_date FROM shows WHERE city IS NOT NULL
+        UNION ALL SELECT 'genre', genre_id::text, show_date FROM genres
+        UNION ALL SELECT 'genre_city', genre_id || '|' || city, show_date FROM genres WHERE city IS NOT NULL
+      ) facts
+      CROSS JOIN (VALUES ('day'), ('month')) grains (grain)
+      GROUP BY 1, 2, 3, 4
+    ''')
+
+
+def downgrade():
+    op.drop_index('ix_Show_Rollup_grain_dimension_bucket', table_name='Show_Rollup')
+    op.drop_table('Show_Rollup')
@@ -0,0 +1,35 @@
+"""artist venue match table
+
+Revision ID: 2e9f4c7b1a58
+Revises: 7d2c5a10e6b4
+Create Date: 2026-10-19 11:26:52.730194
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2e9f4c7b1a58'
+down_revision = '7d2c5a10e6b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Match',
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('artist_id', 'venue_id')
+    )
+    op.create_index('ix_Match_artist_id_score', 'Match', ['artist_id', 'score'], unique=False)
+    op.create_index('ix_Match_venue_id_score', 'Match', ['venue_id', 'score'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Match_venue_id_score', table_name='Match')
+    op.drop_index('ix_Match_artist_id_score', table_name='Match')
+    op.drop_table('Match')
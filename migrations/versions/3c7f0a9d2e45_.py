@@ -0,0 +1,70 @@
+"""soft delete
+
+Revision ID: 3c7f0a9d2e45
+Revises: e7a1c93f5d20
+Create Date: 2026-10-19 16:02:17.384551
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c7f0a9d2e45'
+down_revision = 'e7a1c93f5d20'
+branch_labels = None
+depends_on = None
+
+LIVE = sa.text('deleted_at IS NULL')
+DELETED = sa.text('deleted_at IS NOT NULL')
+
+
+def upgrade():
+    # nullable without a default, so adding the columns does not rewrite the tables;
+    # Show_Archive gets it too, its partitions are detached Show partitions
+    op.add_column('Venue', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.add_column('Artist', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.add_column('Show', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.add_column('Show_Archive', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+    # the read paths only ever see rows that are not deleted
+    op.drop_index('ix_Artist_name_id', table_name='Artist')
+    op.drop_index('ix_Artist_city_id', table_name='Artist')
+    op.drop_index('ix_Artist_state_name_id', table_name='Artist')
+    op.create_index('ix_Artist_name_id', 'Artist', ['name', 'id'], unique=False, postgresql_include=['city', 'state'], postgresql_where=LIVE)
+    op.create_index('ix_Artist_city_id', 'Artist', ['city', 'id'], unique=False, postgresql_include=['name', 'state'], postgresql_where=LIVE)
+    op.create_index('ix_Artist_state_name_id', 'Artist', ['state', 'name', 'id'], unique=False, postgresql_include=['city'], postgresql_where=LIVE)
+    op.drop_index('ix_Show_artist_id_show_date', table_name='Show')
+    op.drop_index('ix_Show_venue_id_show_date', table_name='Show')
+    op.create_index('ix_Show_artist_id_show_date', 'Show', ['artist_id', 'show_date'], unique=False, postgresql_where=LIVE)
+    op.create_index('ix_Show_venue_id_show_date', 'Show', ['venue_id', 'show_date'], unique=False, postgresql_where=LIVE)
+    op.create_index('ix_Venue_city_state_id', 'Venue', ['city', 'state', 'id'], unique=False, postgresql_where=LIVE)
+
+    # small indexes over the deleted rows for the purge command and the show filter
+    op.create_index('ix_Venue_deleted_at', 'Venue', ['deleted_at'], unique=False, postgresql_where=DELETED)
+    op.create_index('ix_Artist_deleted_at', 'Artist', ['deleted_at'], unique=False, postgresql_where=DELETED)
+    op.create_index('ix_Show_deleted_at', 'Show', ['deleted_at'], unique=False, postgresql_where=DELETED)
+
+
+def downgrade():
+    op.drop_index('ix_Show_deleted_at', table_name='Show')
+    op.drop_index('ix_Artist_deleted_at', table_name='Artist')
+    op.drop_index('ix_Venue_deleted_at', table_name='Venue')
+
+    op.drop_index('ix_Venue_city_state_id', table_name='Venue')
+    op.drop_index('ix_Show_venue_id_show_date', table_name='Show')
+    op.drop_index('ix_Show_artist_id_show_date', table_name='Show')
+    op.create_index('ix_Show_artist_id_show_date', 'Show', ['artist_id', 'show_date'], unique=False)
+    op.create_index('ix_Show_venue_id_show_date', 'Show', ['venue_id', 'show_date'], unique=False)
+    op.drop_index('ix_Artist_state_name_id', table_name='Artist')
+    op.drop_index('ix_Artist_city_id', table_name='Artist')
+    op.drop_index('ix_Artist_name_id', table_name='Artist')
+    op.create_index('ix_Artist_name_id', 'Artist', ['name', 'id'], unique=False, postgresql_include=['city', 'state'])
+    op.create_index('ix_Artist_city_id', 'Artist', ['city', 'id'], unique=False, postgresql_include=['name', 'state'])
+    op.create_index('ix_Artist_state_name_id', 'Artist', ['state', 'name', 'id'], unique=False, postgresql_include=['city'])
+
+    # soft deleted rows come back as live ones
+    op.drop_column('Show_Archive', 'deleted_at')
+    op.drop_column('Show', 'deleted_at')
+    op.drop_column('Artist', 'deleted_at')
+    op.drop_column('Venue', 'deleted_at')
@@ -0,0 +1,32 @@
+"""covering indexes for the artists directory
+
+Revision ID: 4b8e1f2a9c3d
+Revises: 93e1320517fd
+Create Date: 2026-10-19 09:12:41.508113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b8e1f2a9c3d'
+down_revision = '93e1320517fd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Artist_name_id', 'Artist', ['name', 'id'], unique=False, postgresql_include=['city', 'state'])
+    op.create_index('ix_Artist_city_id', 'Artist', ['city', 'id'], unique=False, postgresql_include=['name', 'state'])
+    op.create_index('ix_Artist_state_name_id', 'Artist', ['state', 'name', 'id'], unique=False, postgresql_include=['city'])
+    op.create_index('ix_Show_artist_id_show_date', 'Show', ['artist_id', 'show_date'], unique=False)
+    op.create_index('ix_Artist_Genres_genre_id_artist_id', 'Artist_Genres', ['genre_id', 'artist_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Artist_Genres_genre_id_artist_id', table_name='Artist_Genres')
+    op.drop_index('ix_Show_artist_id_show_date', table_name='Show')
+    op.drop_index('ix_Artist_state_name_id', table_name='Artist')
+    op.drop_index('ix_Artist_city_id', table_name='Artist')
+    op.drop_index('ix_Artist_name_id', table_name='Artist')
@@ -0,0 +1,27 @@
+"""venue and artist versions
+
+Revision ID: 4f1e9d7c2b86
+Revises: e7c3b19a4f52
+Create Date: 2026-10-19 22:14:52.903126
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f1e9d7c2b86'
+down_revision = 'e7c3b19a4f52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # a constant default, so postgres adds the columns without rewriting the tables
+    op.add_column('Venue', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('Artist', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('Artist', 'version')
+    op.drop_column('Venue', 'version')
@@ -0,0 +1,30 @@
+"""venue coordinates and geohash
+
+Revision ID: 5a3d9e8b2f61
+Revises: 2e9f4c7b1a58
+Create Date: 2026-10-19 12:41:05.118342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a3d9e8b2f61'
+down_revision = '2e9f4c7b1a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('geohash', sa.String(length=12), nullable=True))
+    op.create_index('ix_Venue_geohash', 'Venue', ['geohash'], unique=False, postgresql_ops={'geohash': 'varchar_pattern_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_Venue_geohash', table_name='Venue')
+    op.drop_column('Venue', 'geohash')
+    op.drop_column('Venue', 'longitude')
+    op.drop_column('Venue', 'latitude')
@@ -0,0 +1,46 @@
+"""genre closure table
+
+Revision ID: 7d2c5a10e6b4
+Revises: 4b8e1f2a9c3d
+Create Date: 2026-10-19 10:03:17.224871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2c5a10e6b4'
+down_revision = '4b8e1f2a9c3d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Lookup_Closure',
+    sa.Column('ancestor_id', sa.Integer(), nullable=False),
+    sa.Column('descendant_id', sa.Integer(), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ancestor_id'], ['Lookup.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['descendant_id'], ['Lookup.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id')
+    )
+    op.create_index('ix_Lookup_Closure_descendant_id', 'Lookup_Closure', ['descendant_id', 'ancestor_id'], unique=False)
+    op.create_index('ix_Venue_Genres_genre_id_venue_id', 'Venue_Genres', ['genre_id', 'venue_id'], unique=False)
+    # backfill from the existing adjacency list
+    op.execute('''
+      WITH RECURSIVE tree(ancestor_id, descendant_id, depth) AS (
+        SELECT id, id, 0 FROM "Lookup"
+        UNION ALL
+        SELECT tree.ancestor_id, child.id, tree.depth + 1
+        FROM tree JOIN "Lookup" child ON child.parent_id = tree.descendant_id
+      )
+      INSERT INTO "Lookup_Closure" (ancestor_id, descendant_id, depth)
+      SELECT ancestor_id, descendant_id, depth FROM tree
+    ''')
+
+
+def downgrade():
+    op.drop_index('ix_Venue_Genres_genre_id_venue_id', table_name='Venue_Genres')
+    op.drop_index('ix_Lookup_Closure_descendant_id', table_name='Lookup_Closure')
+    op.drop_table('Lookup_Closure')
@@ -0,0 +1,36 @@
+"""merge suggestions
+
+Revision ID: 8b4d2f6e1a37
+Revises: 3c7f0a9d2e45
+Create Date: 2026-10-19 18:24:51.902316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4d2f6e1a37'
+down_revision = '3c7f0a9d2e45'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Merge_Suggestion',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('entity', sa.String(length=20), nullable=False),
+    sa.Column('keep_id', sa.Integer(), nullable=False),
+    sa.Column('duplicate_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('entity', 'keep_id', 'duplicate_id', name='uq_Merge_Suggestion_pair')
+    )
+    op.create_index('ix_Merge_Suggestion_status_score', 'Merge_Suggestion', ['status', 'score'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Merge_Suggestion_status_score', table_name='Merge_Suggestion')
+    op.drop_table('Merge_Suggestion')
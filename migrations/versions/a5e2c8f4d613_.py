@@ -0,0 +1,39 @@
+"""updated at
+
+Revision ID: a5e2c8f4d613
+Revises: 0d6a5c3e9b72
+Create Date: 2026-10-19 20:37:12.508194
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5e2c8f4d613'
+down_revision = '0d6a5c3e9b72'
+branch_labels = None
+depends_on = None
+
+# a stable default, so postgres records it once instead of rewriting the tables;
+# the application sets the value itself from then on
+NOW = sa.text("(now() at time zone 'utc')")
+TABLES = ('Venue', 'Artist', 'Show', 'Show_Archive')
+
+
+def upgrade():
+    # Show_Archive too, its partitions move between it and Show
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=NOW))
+        op.alter_column(table, 'updated_at', server_default=None)
+    op.create_index('ix_Venue_updated_at', 'Venue', ['updated_at'], unique=False)
+    op.create_index('ix_Artist_updated_at', 'Artist', ['updated_at'], unique=False)
+    op.create_index('ix_Show_updated_at', 'Show', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Show_updated_at', table_name='Show')
+    op.drop_index('ix_Artist_updated_at', table_name='Artist')
+    op.drop_index('ix_Venue_updated_at', table_name='Venue')
+    for table in reversed(TABLES):
+        op.drop_column(table, 'updated_at')
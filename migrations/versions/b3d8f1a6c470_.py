@@ -0,0 +1,28 @@
+"""shard replication cursors
+
+Revision ID: b3d8f1a6c470
+Revises: 4f1e9d7c2b86
+Create Date: 2026-10-19 23:05:11.274836
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d8f1a6c470'
+down_revision = '4f1e9d7c2b86'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Shard_Cursor',
+    sa.Column('name', sa.String(length=20), nullable=False),
+    sa.Column('seq', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('Shard_Cursor')
@@ -0,0 +1,92 @@
+"""partition Show by month on show_date
+
+Revision ID: c41b7e6d0f92
+Revises: 5a3d9e8b2f61
+Create Date: 2026-10-19 14:02:33.904517
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41b7e6d0f92'
+down_revision = '5a3d9e8b2f61'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 12
+
+
+def month_start(date, months=0):
+    index = date.year * 12 + date.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def upgrade():
+    connection = op.get_bind()
+
+    # keep the old table aside under names that do not clash with the new one
+    op.execute('ALTER TABLE "Show" RENAME TO "Show_Old"')
+    op.execute('ALTER TABLE "Show_Old" RENAME CONSTRAINT "Show_pkey" TO "Show_Old_pkey"')
+    op.execute('DROP INDEX "ix_Show_artist_id_show_date"')
+
+    # partition keys must be part of the primary key
+    for table in ('Show', 'Show_Archive'):
+        op.execute('''
+          CREATE TABLE "%s" (
+            id integer NOT NULL DEFAULT nextval('"Show_id_seq"'),
+            venue_id integer NOT NULL REFERENCES "Venue" (id),
+            artist_id integer NOT NULL REFERENCES "Artist" (id),
+            show_date timestamp without time zone NOT NULL,
+            PRIMARY KEY (id, show_date)
+          ) PARTITION BY RANGE (show_date)
+        ''' % table)
+    op.execute('CREATE TABLE "Show_default" PARTITION OF "Show" DEFAULT')
+    op.execute('CREATE TABLE "Show_Archive_default" PARTITION OF "Show_Archive" DEFAULT')
+
+    # one partition per month from the oldest show up to a year ahead
+    oldest = connection.execute(sa.text('SELECT min(show_date) FROM "Show_Old"')).scalar() or datetime.now()
+    start, last = month_start(oldest), month_start(datetime.now(), MONTHS_AHEAD)
+    while start <= last:
+        end = month_start(start, 1)
+        op.execute("CREATE TABLE \"Show_y%04dm%02d\" PARTITION OF \"Show\" FOR VALUES FROM ('%s') TO ('%s')"
+                   % (start.year, start.month, start.isoformat(), end.isoformat()))
+        start = end
+
+    op.execute('INSERT INTO "Show" (id, venue_id, artist_id, show_date) SELECT id, venue_id, artist_id, show_date FROM "Show_Old"')
+    # the sequence would be dropped along with the old table otherwise
+    op.execute('ALTER SEQUENCE "Show_id_seq" OWNED BY "Show".id')
+    op.drop_table('Show_Old')
+
+    op.create_index('ix_Show_artist_id_show_date', 'Show', ['artist_id', 'show_date'], unique=False)
+    op.create_index('ix_Show_venue_id_show_date', 'Show', ['venue_id', 'show_date'], unique=False)
+    op.create_index('ix_Show_Archive_artist_id_show_date', 'Show_Archive', ['artist_id', 'show_date'], unique=False)
+    op.create_index('ix_Show_Archive_venue_id_show_date', 'Show_Archive', ['venue_id', 'show_date'], unique=False)
+
+
+def downgrade():
+    op.execute('''
+      CREATE TABLE "Show_Old" (
+        id integer NOT NULL DEFAULT nextval('"Show_id_seq"'),
+        venue_id integer NOT NULL REFERENCES "Venue" (id),
+        artist_id integer NOT NULL REFERENCES "Artist" (id),
+        show_date timestamp without time zone NOT NULL,
+        CONSTRAINT "Show_Old_pkey" PRIMARY KEY (id)
+      )
+    ''')
+    op.execute('''
+      INSERT INTO "Show_Old" (id, venue_id, artist_id, show_date)
+      SELECT id, venue_id, artist_id, show_date FROM "Show"
+      UNION ALL
+      SELECT id, venue_id, artist_id, show_date FROM "Show_Archive"
+    ''')
+    op.execute('ALTER SEQUENCE "Show_id_seq" OWNED BY "Show_Old".id')
+    # dropping the partitioned parents drops every partition with them
+    op.drop_table('Show_Archive')
+    op.drop_table('Show')
+    op.execute('ALTER TABLE "Show_Old" RENAME TO "Show"')
+    op.execute('ALTER TABLE "Show" RENAME CONSTRAINT "Show_Old_pkey" TO "Show_pkey"')
+    op.create_index('ix_Show_artist_id_show_date', 'Show', ['artist_id', 'show_date'], unique=False)
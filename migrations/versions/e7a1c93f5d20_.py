@@ -0,0 +1,50 @@
+"""change feed
+
+Revision ID: e7a1c93f5d20
+Revises: c41b7e6d0f92
+Create Date: 2026-10-19 15:20:48.662930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a1c93f5d20'
+down_revision = 'c41b7e6d0f92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Change',
+    sa.Column('seq', sa.BigInteger(), nullable=False),
+    sa.Column('entity', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('op', sa.String(length=10), nullable=False),
+    sa.Column('changed_at', sa.DateTime(), nullable=False),
+    sa.Column('data', sa.JSON(), nullable=True),
+    sa.PrimaryKeyConstraint('seq')
+    )
+    op.create_index('ix_Change_changed_at', 'Change', ['changed_at'], unique=False)
+    # existing rows enter the feed as creates, so a client starting at seq 0 sees everything
+    op.execute('''
+      INSERT INTO "Change" (entity, entity_id, op, changed_at, data)
+      SELECT 'venue', id, 'create', now() at time zone 'utc', to_json(v)::jsonb - 'id' - 'latitude' - 'longitude' - 'geohash'
+      FROM "Venue" v ORDER BY id
+    ''')
+    op.execute('''
+      INSERT INTO "Change" (entity, entity_id, op, changed_at, data)
+      SELECT 'artist', id, 'create', now() at time zone 'utc', to_json(a)::jsonb - 'id'
+      FROM "Artist" a ORDER BY id
+    ''')
+    op.execute('''
+      INSERT INTO "Change" (entity, entity_id, op, changed_at, data)
+      SELECT 'show', id, 'create', now() at time zone 'utc', json_build_object('venue_id', venue_id, 'artist_id', artist_id, 'show_date', show_date)
+      FROM "Show" ORDER BY id
+    ''')
+
+
+def downgrade():
+    op.drop_index('ix_Change_changed_at', table_name='Change')
+    op.drop_table('Change')
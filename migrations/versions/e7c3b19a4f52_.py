@@ -0,0 +1,82 @@
+"""natural keys and idempotency keys
+
+Revision ID: e7c3b19a4f52
+Revises: a5e2c8f4d613
+Create Date: 2026-10-19 21:02:37.480915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7c3b19a4f52'
+down_revision = 'a5e2c8f4d613'
+branch_labels = None
+depends_on = None
+
+
+# live rows sharing a natural key are merged into the oldest one first, the
+# way the "merge" command does it: shows and genres move over, matches go and
+# the others are soft deleted. "python3 app.py rollup" recounts the stats after
+MERGE = '''
+  CREATE TEMP TABLE merged AS
+  SELECT id, keep_id FROM (
+    SELECT id, min(id) OVER (PARTITION BY {key}) AS keep_id FROM "{table}" WHERE deleted_at IS NULL
+  ) ranked WHERE id <> keep_id;
+  UPDATE "Show" s SET {owner} = m.keep_id, updated_at = now() AT TIME ZONE 'utc' FROM merged m WHERE s.{owner} = m.id;
+  UPDATE "Show_Archive" s SET {owner} = m.keep_id, updated_at = now() AT TIME ZONE 'utc' FROM merged m WHERE s.{owner} = m.id;
+  INSERT INTO "{table}_Genres" ({owner}, genre_id)
+  SELECT m.keep_id, g.genre_id FROM "{table}_Genres" g JOIN merged m ON m.id = g.{owner}
+  ON CONFLICT DO NOTHING;
+  DELETE FROM "{table}_Genres" g USING merged m WHERE g.{owner} = m.id;
+  DELETE FROM "Match" x USING merged m WHERE x.{owner} = m.id;
+  UPDATE "{table}" t SET deleted_at = now() AT TIME ZONE 'utc', updated_at = now() AT TIME ZONE 'utc'
+  FROM merged m WHERE t.id = m.id;
+  INSERT INTO "Change" (entity, entity_id, op, changed_at)
+  SELECT '{entity}', id, 'delete', now() AT TIME ZONE 'utc' FROM merged;
+  DROP TABLE merged;
+'''
+
+# then of every show listed more than once only the first stays
+DEDUPLICATE_SHOWS = '''
+  UPDATE "{table}" SET deleted_at = now() AT TIME ZONE 'utc', updated_at = now() AT TIME ZONE 'utc'
+  WHERE id IN (
+    SELECT id FROM (
+      SELECT id, row_number() OVER (PARTITION BY venue_id, artist_id, show_date ORDER BY id) AS n
+      FROM "{table}" WHERE deleted_at IS NULL
+    ) ranked WHERE n > 1
+  )
+'''
+
+
+def upgrade():
+    op.create_table('Idempotency_Key',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('endpoint', sa.String(length=40), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index('ix_Idempotency_Key_expires_at', 'Idempotency_Key', ['expires_at'], unique=False)
+
+    op.execute(MERGE.format(table='Venue', entity='venue', owner='venue_id', key='name, address, city, state'))
+    op.execute(MERGE.format(table='Artist', entity='artist', owner='artist_id', key='name, city, state'))
+    op.execute(DEDUPLICATE_SHOWS.format(table='Show'))
+    op.execute(DEDUPLICATE_SHOWS.format(table='Show_Archive'))
+
+    op.create_index('uq_Venue_natural_key', 'Venue', ['name', 'address', 'city', 'state'], unique=True,
+                    postgresql_where=sa.text('deleted_at IS NULL'))
+    op.create_index('uq_Artist_natural_key', 'Artist', ['name', 'city', 'state'], unique=True,
+                    postgresql_where=sa.text('deleted_at IS NULL'))
+    # on the partitioned parent, so every monthly partition gets its copy
+    op.create_index('uq_Show_natural_key', 'Show', ['venue_id', 'artist_id', 'show_date'], unique=True,
+                    postgresql_where=sa.text('deleted_at IS NULL'))
+
+
+def downgrade():
+    op.drop_index('uq_Show_natural_key', table_name='Show')
+    op.drop_index('uq_Artist_natural_key', table_name='Artist')
+    op.drop_index('uq_Venue_natural_key', table_name='Venue')
+    op.drop_index('ix_Idempotency_Key_expires_at', table_name='Idempotency_Key')
+    op.drop_table('Idempotency_Key')
@@ -0,0 +1,178 @@
+#----------------------------------------------------------------------------#
+# Prefix index.
+# Sorted arrays of lowercased keys answering prefix queries with a binary
+# search, used for autocomplete. Every word start of a label is a key, so
+# "mus" finds "The Musical Hop".
+#----------------------------------------------------------------------------#
+
+import bisect
+import heapq
+import re
+import sys
+import threading
+from collections import namedtuple
+
+WORD_START = re.compile(r'(?:^|(?<=[\s\-&/(]))\w', re.UNICODE)
+
+def keys_for(label):
+  label = label.lower()
+  return sorted(set(label[match.start():] for match in WORD_START.finditer(label)))
+
+# what a search reads, never changed once published: the large sorted arrays,
+# a small sorted delta of recent additions, and the ids (id()) of array
+# entries removed since the arrays were built
+View = namedtuple('View', 'keys entries delta_keys delta_entries removed')
+
+class PrefixIndex(object):
+  # keys[i] belongs to entries[i]; entries are (id, label) and shared between
+  # the keys of one label. Writers serialise on the lock and publish a new
+  # View with a single assignment, so a search takes no lock and always sees
+  # one consistent view. A write only copies the delta, which is merged into
+  # new arrays once it holds compact_at keys and removals
+
+  def __init__(self, compact_at=1024):
+    self.view = View([], [], [], [], frozenset())
+    self.labels = {}
+    self.compact_at = compact_at
+    self.lock = threading.Lock()
+
+  def build(self, items):
+    # items are (id, label), replaces the whole index in one go
+    pairs = []
+    labels = {}
+    for entry_id, label in items:
+      if not label:
+        continue
+      entry = (entry_id, label)
+      labels[entry_id] = entry
+      pairs.extend((key, entry) for key in keys_for(label))
+    pairs.sort(key=lambda pair: pair[0])
+    view = View([pair[0] for pair in pairs], [pair[1] for pair in pairs], [], [], frozenset())
+    with self.lock:
+      self.view, self.labels = view, labels
+
+  def add(self, entry_id, label):
+    with self.lock:
+      view = self._without(self.view, entry_id)
+      if label:
+        entry = (entry_id, label)
+        self.labels[entry_id] = entry
+        delta = sorted(list(zip(view.delta_keys, view.delta_entries)) + [(key, entry) for key in keys_for(label)],
+                       key=lambda pair: pair[0])
+        view = view._replace(delta_keys=[pair[0] for pair in delta], delta_entries=[pair[1] for pair in delta])
+      self._publish(view)
+
+  def remove(self, entry_id):
+    with self.lock:
+      self._publish(self._without(self.view, entry_id))
+
+  def _without(self, view, entry_id):
+    # the view without the entry, dropped from the delta or tombstoned in the arrays
+    entry = self.labels.pop(entry_id, None)
+    if entry is None:
+      return view
+    if any(other is entry for other in view.delta_entries):
+      kept = [(key, other) for key, other in zip(view.delta_keys, view.delta_entries) if other is not entry]
+      return view._replace(delta_keys=[pair[0] for pair in kept], delta_entries=[pair[1] for pair in kept])
+    return view._replace(removed=view.removed | {id(entry)})
+
+  def _publish(self, view):
+    if len(view.delta_keys) + len(view.removed) >= self.compact_at:
+      removed = view.removed
+      pairs = list(heapq.merge(((key, entry) for key, entry in zip(view.keys, view.entries) if id(entry) not in removed),
+                               zip(view.delta_keys, view.delta_entries), key=lambda pair: pair[0]))
+      view = View([pair[0] for pair in pairs], [pair[1] for pair in pairs], [], [], frozenset())
+    self.view = view
+
+  def search(self, prefix, limit=10):
+    # [(id, label)] of labels with a word starting with prefix, alphabetical by matched key
+    prefix = prefix.strip().lower()
+    if not prefix:
+      return []
+    view = self.view
+
+    def scan(keys, entries):
+      position = bisect.bisect_left(keys, prefix)
+      while position < len(keys) and keys[position].startswith(prefix):
+        if id(entries[position]) not in view.removed:
+          yield keys[position], entries[position]
+        position += 1
+
+    seen, results = set(), []
+    for _, entry in heapq.merge(scan(view.keys, view.entries), scan(view.delta_keys, view.delta_entries),
+                                key=lambda pair: pair[0]):
+      if entry[0] not in seen:
+        seen.add(entry[0])
+        results.append(entry)
+        if len(results) == limit:
+          break
+    return results
+
+  def __len__(self):
+    return len(self.labels)
+
+  def memory(self):
+    # bytes held by the arrays, the keys and the entries (labels counted once)
+    view = self.view
+    total = sum(sys.getsizeof(array) for array in view[:4]) + sys.getsizeof(self.labels)
+    total += sum(sys.getsizeof(key) for key in view.keys) + sum(sys.getsizeof(key) for key in view.delta_keys)
+    for entry in self.labels.values():
+      total += sys.getsizeof(entry) + sys.getsizeof(entry[1])
+    return total
+
+class Autocomplete(object):
+  # one prefix index per kind of thing
+
+  KINDS = ('venue', 'artist', 'city', 'genre')
+
+  def __init__(self):
+    self.indexes = {kind: PrefixIndex() for kind in self.KINDS}
+
+  def search(self, prefix, kinds=None, limit=10):
+    kinds = kinds or self.KINDS
+    results = []
+    for kind in kinds:
+      for entry_id, label in self.indexes[kind].search(prefix, limit):
+        results.append({'kind': kind, 'id': entry_id, 'label': label})
+    if len(kinds) > 1:
+      results.sort(key=lambda result: result['label'].lower())
+    return results[:limit]
+
+  def memory(self):
+    return {kind: index.memory() for kind, index in self.indexes.items()}
+
+def benchmark(entries=1000000, queries=2000, seed=0):
+  import random
+  import time
+
+  random.seed(seed)
+  syllables = ['ka', 'lo', 'mi', 'ra', 'the', 'son', 'band', 'hop', 'jazz', 'club', 'live', 'bar', 'sound', 'wave']
+  names = [(i, ' '.join(''.join(random.choice(syllables) for _ in range(random.randint(1, 3)))
+                        for _ in range(random.randint(1, 3))).title()) for i in range(entries)]
+
+  index = PrefixIndex()
+  started = time.perf_counter()
+  index.build(names)
+  build = time.perf_counter() - started
+
+  prefixes = [name[:random.randint(1, 4)] for _, name in random.sample(names, queries)]
+  timings = []
+  for prefix in prefixes:
+    started = time.perf_counter()
+    index.search(prefix)
+    timings.append((time.perf_counter() - started) * 1000)
+  timings.sort()
+
+  started = time.perf_counter()
+  index.add(entries, 'Freshly Added Venue')
+  insert = (time.perf_counter() - started) * 1000
+
+  return {
+    'entries': entries,
+    'keys': len(index.view.keys) + len(index.view.delta_keys),
+    'build_s': build,
+    'memory_mb': index.memory() / 1024 / 1024,
+    'search_p50_ms': timings[len(timings) // 2],
+    'search_p99_ms': timings[int(len(timings) * 0.99) - 1],
+    'insert_ms': insert,
+  }
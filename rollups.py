@@ -0,0 +1,91 @@
+#----------------------------------------------------------------------------#
+# Show rollups.
+# Show counts per day and month bucket for every venue, artist, genre, city
+# and genre in a city, kept as deltas applied to a small table, so /stats
+# reads a few hundred rollup rows whatever the number of shows. The table
+# itself is written by app.py.
+#----------------------------------------------------------------------------#
+
+from collections import Counter
+from datetime import date, datetime
+
+GRAINS = ('day', 'month')
+# 'all' holds the totals per bucket, key ''
+DIMENSIONS = ('all', 'venue', 'artist', 'genre', 'city', 'genre_city')
+
+def bucket(grain, when):
+  # the date a show is counted under
+  if grain == 'month':
+    return date(when.year, when.month, 1)
+  return date(when.year, when.month, when.day)
+
+def keys(venue_id, artist_id, city, genre_ids):
+  # (dimension, key) pairs one show counts towards; the artist's genres
+  # decide the genre of a show, the venue's city its city
+  pairs = [('all', ''), ('venue', str(venue_id)), ('artist', str(artist_id))]
+  if city:
+    pairs.append(('city', city))
+  for genre_id in genre_ids:
+    pairs.append(('genre', str(genre_id)))
+    if city:
+      pairs.append(('genre_city', '%d|%s' % (genre_id, city)))
+  return pairs
+
+def increments(shows, sign=1, counts=None):
+  # shows: (venue_id, artist_id, show_date, city, genre ids) tuples;
+  # returns {(grain, dimension, key, bucket): delta}
+  counts = Counter() if counts is None else counts
+  for venue_id, artist_id, show_date, city, genre_ids in shows:
+    buckets = [(grain, bucket(grain, show_date)) for grain in GRAINS]
+    for dimension, key in keys(venue_id, artist_id, city, genre_ids):
+      for grain, start in buckets:
+        counts[grain, dimension, key, start] += sign
+  return counts
+
+def benchmark(sizes=(10000, 100000, 1000000), venues=1000, queries=20, seed=0):
+  # the "busiest venues over a quarter" question answered by a GROUP BY over
+  # shows and over the monthly venue rollup, at growing show counts
+  import random
+  import sqlite3
+  import time
+  from datetime import timedelta
+
+  random.seed(seed)
+  start = datetime(2024, 1, 1)
+  results = {}
+  for size in sizes:
+    connection = sqlite3.connect(':memory:')
+    connection.execute('CREATE TABLE shows (venue_id INTEGER, artist_id INTEGER, show_date TEXT)')
+    connection.execute('CREATE INDEX ix_shows_show_date ON shows (show_date, venue_id)')
+    connection.execute('CREATE TABLE rollup (grain TEXT, dimension TEXT, key TEXT, bucket TEXT, shows INTEGER, '
+                       'PRIMARY KEY (grain, dimension, key, bucket))')
+    connection.execute('CREATE INDEX ix_rollup_bucket ON rollup (grain, dimension, bucket)')
+    rows = [(random.randrange(venues), random.randrange(venues * 10),
+             start + timedelta(minutes=random.randrange(2 * 365 * 24 * 60))) for _ in range(size)]
+    connection.executemany('INSERT INTO shows VALUES (?, ?, ?)',
+                           ((venue_id, artist_id, when.isoformat(' ')) for venue_id, artist_id, when in rows))
+    counts = increments((venue_id, artist_id, when, None, ()) for venue_id, artist_id, when in rows)
+    connection.executemany('INSERT INTO rollup VALUES (?, ?, ?, ?, ?)',
+                           ((grain, dimension, key, when.isoformat(), shows)
+                            for (grain, dimension, key, when), shows in counts.items()
+                            if grain == 'month' and dimension == 'venue'))
+    connection.commit()
+
+    def timed(sql, lower, upper):
+      began = time.perf_counter()
+      connection.execute(sql, (lower, upper)).fetchall()
+      return time.perf_counter() - began
+
+    raw = rollup = 0
+    for _ in range(queries):
+      quarter = start + timedelta(days=random.randrange(0, 600))
+      lower, upper = bucket('month', quarter), bucket('month', quarter + timedelta(days=92))
+      raw += timed('SELECT venue_id, count(*) FROM shows WHERE show_date >= ? AND show_date < ? '
+                   'GROUP BY venue_id ORDER BY 2 DESC LIMIT 10', lower.isoformat(), upper.isoformat())
+      rollup += timed("SELECT key, sum(shows) FROM rollup WHERE grain = 'month' AND dimension = 'venue' "
+                      "AND bucket >= ? AND bucket < ? GROUP BY key ORDER BY 2 DESC LIMIT 10",
+                      lower.isoformat(), upper.isoformat())
+    results['shows_%d_raw_ms' % size] = raw / queries * 1000
+    results['shows_%d_rollup_ms' % size] = rollup / queries * 1000
+    connection.close()
+  return results
@@ -0,0 +1,131 @@
+#----------------------------------------------------------------------------#
+# Sharding.
+# Venues, with their shows and genre rows, live on the shard of their state's
+# region; artists and the genre lookup are copied to every shard so a shard
+# answers its venue pages with local joins. New ids come from a range owned
+# by the shard, so the id of a row tells where it is. Rows copied over from
+# the single database keep their ids and are found by asking every shard.
+# Listings over all shards are read in parallel and merged, see gather().
+#----------------------------------------------------------------------------#
+
+import heapq
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# census regions
+REGIONS = {
+  'west': ('AK', 'AZ', 'CA', 'CO', 'HI', 'ID', 'MT', 'NV', 'NM', 'OR', 'UT', 'WA', 'WY'),
+  'midwest': ('IL', 'IN', 'IA', 'KS', 'MI', 'MN', 'MO', 'NE', 'ND', 'OH', 'SD', 'WI'),
+  'south': ('AL', 'AR', 'DE', 'DC', 'FL', 'GA', 'KY', 'LA', 'MD', 'MS', 'NC', 'OK', 'SC', 'TN', 'TX', 'VA', 'WV'),
+  'northeast': ('CT', 'ME', 'MA', 'NH', 'NJ', 'NY', 'PA', 'RI', 'VT'),
+}
+STATE_REGIONS = {state: region for region, states in REGIONS.items() for state in states}
+
+def parse_urls(text):
+  # "west=sqlite:///west.db,east=postgresql://..." -> ordered {name: url}
+  shards = OrderedDict()
+  for part in (text or '').split(','):
+    if part.strip():
+      name, _, url = part.partition('=')
+      shards[name.strip()] = url.strip()
+  return shards
+
+class ShardSet(object):
+
+  def __init__(self, engines, regions=None, id_range=100000000):
+    self.engines = OrderedDict(engines)
+    self.names = list(self.engines)
+    # region -> shard name; a region without a shard of its own goes to the first
+    self.regions = dict(regions or {})
+    self.id_range = id_range
+    self.located = {} # (table, id) -> shard, of ids from before the split
+    self.lock = threading.Lock()
+    self.pool = ThreadPoolExecutor(max_workers=len(self.names), thread_name_prefix='shard')
+
+  def for_state(self, state):
+    region = STATE_REGIONS.get((state or '').strip().upper())
+    name = self.regions.get(region, region)
+    return name if name in self.engines else self.names[0]
+
+  def id_base(self, name):
+    # shard i owns ids [(i + 1) * id_range, (i + 2) * id_range)
+    return (self.names.index(name) + 1) * self.id_range
+
+  def for_id(self, id):
+    index = int(id) // self.id_range - 1
+    return self.names[index] if 0 <= index < len(self.names) else None
+
+  def locate(self, table, id):
+    # the shard holding a row, by its id range or by asking every shard once
+    name = self.for_id(id)
+    if name is not None:
+      return name
+    with self.lock:
+      name = self.located.get((table.name, id))
+    if name is None:
+      def holds(name, engine):
+        with engine.connect() as connection:
+          return connection.execute(table.select().with_only_columns([table.c.id]).where(table.c.id == id)).first()
+      name = next((name for name, row in self.scatter(holds) if row is not None), None)
+      if name is not None:
+        with self.lock:
+          self.located[(table.name, id)] = name
+    return name
+
+  def scatter(self, task, names=None):
+    # task(name, engine) on every shard at once -> [(name, result)] in shard order
+    names = names or self.names
+    futures = [self.pool.submit(task, name, self.engines[name]) for name in names]
+    return [(name, future.result()) for name, future in zip(names, futures)]
+
+  def gather(self, stream, key, buffer=1000):
+    # merges stream(name, engine) of every shard, each already sorted by key,
+    # into one sorted iterator. Every shard is read on its own thread into a
+    # bounded queue, so all of them run while the merge consumes
+    done = object()
+    stop = threading.Event()
+
+    def put(channel, item):
+      # False once the merge was abandoned
+      while not stop.is_set():
+        try:
+          channel.put(item, timeout=0.5)
+          return True
+        except queue.Full:
+          pass
+      return False
+
+    def produce(name, channel):
+      try:
+        for row in stream(name, self.engines[name]):
+          if not put(channel, row):
+            return
+        put(channel, done)
+      except BaseException as error:
+        put(channel, error)
+
+    def consume(channel):
+      while True:
+        item = channel.get()
+        if item is done:
+          return
+        if isinstance(item, BaseException):
+          raise item
+        yield item
+
+    channels = [queue.Queue(buffer) for _ in self.names]
+    for name, channel in zip(self.names, channels):
+      threading.Thread(target=produce, args=(name, channel), daemon=True, name='gather-' + name).start()
+    try:
+      for row in heapq.merge(*[consume(channel) for channel in channels], key=key):
+        yield row
+    finally:
+      # an abandoned merge (the client went away) lets the readers finish
+      stop.set()
+
+  def dispose(self):
+    self.pool.shutdown(wait=False)
+    for engine in self.engines.values():
+      engine.dispose()
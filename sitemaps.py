@@ -0,0 +1,87 @@
+#----------------------------------------------------------------------------#
+# Sitemaps.
+# URLs are streamed into urlset files of at most 50,000 entries, the limit of
+# the sitemap protocol, and a sitemap index lists the files. Each file is
+# written under a temporary name and only replaces the published one when
+# its content differs, so unchanged files keep their mtime (and crawlers'
+# conditional requests keep hitting). The urls come from app.py.
+#----------------------------------------------------------------------------#
+
+import filecmp
+import os
+from xml.sax.saxutils import escape
+
+MAX_URLS = 50000
+NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+def w3c_date(value):
+  return value.strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+def publish(temporary, path):
+  # True when path was created or changed
+  if os.path.exists(path) and filecmp.cmp(temporary, path, shallow=False):
+    os.remove(temporary)
+    return False
+  os.replace(temporary, path)
+  return True
+
+class SitemapWriter(object):
+  # name-1.xml, name-2.xml, ... each closed once it holds max_urls urls
+
+  def __init__(self, directory, name, max_urls=MAX_URLS):
+    self.directory = directory
+    self.name = name
+    self.max_urls = max_urls
+    self.output = None
+    self.count = 0
+    self.lastmod = None
+    self.parts = [] # (filename, newest lastmod, changed)
+
+  def add(self, loc, lastmod=None):
+    if self.output is None:
+      self.open()
+    self.output.write('<url><loc>%s</loc>%s</url>\n' % (
+      escape(loc), '<lastmod>%s</lastmod>' % w3c_date(lastmod) if lastmod else ''))
+    self.count += 1
+    if lastmod is not None and (self.lastmod is None or lastmod > self.lastmod):
+      self.lastmod = lastmod
+    if self.count >= self.max_urls:
+      self.finish()
+
+  def open(self):
+    filename = '%s-%d.xml' % (self.name, len(self.parts) + 1)
+    self.output = open(os.path.join(self.directory, filename + '.part'), 'w', encoding='utf-8')
+    self.output.write('<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="%s">\n' % NAMESPACE)
+    self.filename = filename
+
+  def finish(self):
+    self.output.write('</urlset>\n')
+    self.output.close()
+    path = os.path.join(self.directory, self.filename)
+    self.parts.append((self.filename, self.lastmod, publish(path + '.part', path)))
+    self.output, self.count, self.lastmod = None, 0, None
+
+  def close(self):
+    if self.output is not None:
+      self.finish()
+    return self.parts
+
+def write_index(directory, base_url, parts, filename='sitemap.xml'):
+  # parts: (filename, lastmod) of every urlset, linked under base_url
+  path = os.path.join(directory, filename)
+  with open(path + '.part', 'w', encoding='utf-8') as output:
+    output.write('<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="%s">\n' % NAMESPACE)
+    for name, lastmod in parts:
+      output.write('<sitemap><loc>%s</loc>%s</sitemap>\n' % (
+        escape('%s/%s' % (base_url.rstrip('/'), name)), '<lastmod>%s</lastmod>' % w3c_date(lastmod) if lastmod else ''))
+    output.write('</sitemapindex>\n')
+  return publish(path + '.part', path)
+
+def clean(directory, keep):
+  # removes urlset files of an earlier, larger catalogue
+  removed = 0
+  for name in os.listdir(directory):
+    if name.endswith(('.xml', '.part')) and name not in keep:
+      os.remove(os.path.join(directory, name))
+      removed += 1
+  return removed
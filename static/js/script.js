@@ -2,3 +2,45 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// type-ahead for the search boxes, fills the input's datalist from /autocomplete
+(function () {
+  var inputs = document.querySelectorAll('input[data-autocomplete]');
+  Array.prototype.forEach.call(inputs, function (input) {
+    var list = document.getElementById(input.getAttribute('list'));
+    var timer = null;
+    var last = '';
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      timer = setTimeout(function () {
+        var q = input.value.trim();
+        if (!q || q === last) return;
+        last = q;
+        fetch('/autocomplete?kind=' + input.getAttribute('data-autocomplete') + '&q=' + encodeURIComponent(q))
+          .then(function (response) { return response.json(); })
+          .then(function (data) {
+            if (data.q !== input.value.trim()) return;
+            list.innerHTML = '';
+            data.results.forEach(function (result) {
+              var option = document.createElement('option');
+              option.value = result.label;
+              list.appendChild(option);
+            });
+          });
+      }, 100);
+    });
+  });
+})();
+
+// delete buttons on the detail pages, the endpoint answers with where to go next
+(function () {
+  var buttons = document.querySelectorAll('button[data-delete]');
+  Array.prototype.forEach.call(buttons, function (button) {
+    button.addEventListener('click', function () {
+      if (!window.confirm('Delete this ' + button.textContent.replace('Delete ', '') + '?')) return;
+      fetch(button.getAttribute('data-delete'), { method: 'DELETE' })
+        .then(function (response) { return response.json(); })
+        .then(function (data) { window.location = data.redirect; });
+    });
+  });
+})();
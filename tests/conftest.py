@@ -0,0 +1,88 @@
+import inspect
+import os
+import sys
+import uuid
+
+import pytest
+from flask_migrate import upgrade
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+
+# flask_script still calls inspect.getargspec, which Python 3.11 removed
+if not hasattr(inspect, 'getargspec'):
+  inspect.getargspec = lambda f: tuple(inspect.getfullargspec(f))[:4]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# the app reads its shards at import, tests that shard set them up themselves
+os.environ.pop('FYYUR_SHARDS', None)
+
+import app as fyyur
+
+
+@pytest.fixture
+def app(tmp_path):
+  # every test runs against its own SQLite database, settings a test
+  # changes are put back afterwards
+  config = dict(fyyur.app.config)
+  fyyur.app.config.update(
+    SQLALCHEMY_DATABASE_URI='sqlite:///' + str(tmp_path / 'fyyur.db'),
+    TESTING=True,
+    WTF_CSRF_ENABLED=False,
+    # tests walk pages faster than any client budget allows
+    ADMISSION_ENABLED=False,
+    ICS_DIR=str(tmp_path / 'ics'),
+    # the queue's thread would outlive the test database
+    MATCHES_REFRESH_ON_WRITE=False,
+  )
+  with fyyur.app.app_context():
+    fyyur.db.create_all()
+    yield fyyur.app
+    fyyur.db.session.remove()
+    fyyur.db.drop_all()
+  # in-memory views of the database go with it
+  fyyur.autocomplete_index = None
+  fyyur.listing_catalogue.snapshot = None
+  fyyur.stats_cache.clear()
+  fyyur.fragment_cache.clear()
+  fyyur.venue_geo_index = None
+  fyyur.app.config.clear()
+  fyyur.app.config.update(config)
+
+
+@pytest.fixture
+def client(app):
+  return app.test_client()
+
+
+@pytest.fixture
+def genre(app):
+  genre = fyyur.Lookup(description='Jazz')
+  fyyur.db.session.add(genre)
+  fyyur.db.session.commit()
+  return genre.description
+
+
+@pytest.fixture
+def postgres_app():
+  # a fresh database built by the migrations, for what SQLite can't show
+  # (partitions, sequences); set FYYUR_TEST_POSTGRES to a server url to run these
+  url = os.environ.get('FYYUR_TEST_POSTGRES')
+  if not url:
+    pytest.skip('FYYUR_TEST_POSTGRES is not set')
+  server = create_engine(url, isolation_level='AUTOCOMMIT')
+  name = 'fyyur_test_' + uuid.uuid4().hex[:12]
+  server.execute('CREATE DATABASE ' + name)
+
+  config = dict(fyyur.app.config)
+  fyyur.app.config.update(SQLALCHEMY_DATABASE_URI=str(make_url(url).set(database=name)), TESTING=True)
+  try:
+    with fyyur.app.app_context():
+      upgrade(directory=os.path.join(fyyur.app.root_path, 'migrations'))
+      yield fyyur.app
+      fyyur.db.session.remove()
+      fyyur.db.engine.dispose()
+  finally:
+    fyyur.app.config.clear()
+    fyyur.app.config.update(config)
+    server.execute('DROP DATABASE IF EXISTS ' + name)
+    server.dispose()
@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+
+import admission
+import app as fyyur
+
+
+def test_bucket_allows_a_burst_then_refills():
+  store = admission.MemoryStore()
+  assert [store.take('a', 2, 3, 100)[0] for _ in range(4)] == [True, True, True, False]
+  allowed, wait = store.take('a', 2, 3, 100)
+  assert not allowed and wait == pytest.approx(0.5)
+  # half a second later one token is back, other clients have their own bucket
+  assert store.take('a', 2, 3, 100.5) == (True, 0)
+  assert store.take('b', 2, 3, 100.5) == (True, 0)
+
+
+def test_full_buckets_are_pruned():
+  store = admission.MemoryStore(max_keys=2)
+  store.take('a', 1, 5, 0)
+  store.take('b', 1, 5, 0)
+  store.take('c', 1, 5, 10)
+  assert set(store.buckets) == {'c'}
+
+
+def test_store_from_url():
+  assert isinstance(admission.store_from_url('memory'), admission.MemoryStore)
+  with pytest.raises(ValueError):
+    admission.store_from_url('memcached://localhost')
+
+
+def test_concurrency_is_capped_per_group():
+  limiter = admission.Limiter({'search': admission.Budget(2, None, None), 'detail': admission.Budget(1, None, None)},
+                              retry_after=3)
+  assert limiter.admit('search', 'a') is None and limiter.admit('search', 'b') is None
+  assert limiter.admit('search', 'c') == (503, 3)
+  # a full group does not hold up another
+  assert limiter.admit('detail', 'c') is None
+  limiter.release('search')
+  assert limiter.admit('search', 'c') is None
+
+  metrics = limiter.metrics()['search']
+  assert (metrics['in_flight'], metrics['peak_in_flight'], metrics['admitted'], metrics['shed_concurrency']) == (2, 2, 3, 1)
+
+
+def test_rate_shed_gives_back_the_slot():
+  limiter = admission.Limiter({'api': admission.Budget(5, 1, 1)})
+  assert limiter.admit('api', 'a') is None
+  limiter.release('api')
+  assert limiter.admit('api', 'a') == (429, 1)
+  assert limiter.metrics()['api']['in_flight'] == 0
+
+
+def test_unreachable_store_admits():
+  class Down(object):
+    def take(self, *args):
+      raise ConnectionError()
+  limiter = admission.Limiter({'api': admission.Budget(None, 1, 1)}, store=Down())
+  assert all(limiter.admit('api', 'a') is None for _ in range(3))
+
+
+def test_prometheus_format():
+  limiter = admission.Limiter({'search': admission.Budget(None, 2, 10)})
+  limiter.admit('search', 'a')
+  text = admission.prometheus(limiter.metrics())
+  assert 'fyyur_admission_admitted_total{group="search"} 1\n' in text
+  assert '# TYPE fyyur_admission_in_flight gauge\n' in text
+  # a disabled limit is left out
+  assert 'fyyur_admission_concurrency_limit{' not in text
+
+
+@pytest.fixture
+def limited(app, monkeypatch):
+  app.config['ADMISSION_ENABLED'] = True
+  limiter = admission.Limiter({'listing': admission.Budget(1, 0.01, 2), 'search': admission.Budget(None, None, None)})
+  monkeypatch.setattr(fyyur, 'limiter', limiter)
+  monkeypatch.setitem(app.config, 'ADMISSION_ROUTES', {'venues': 'listing', 'artists': 'listing'})
+  return limiter
+
+
+def test_over_rate_requests_get_429(client, limited):
+  assert [client.get('/venues').status_code for _ in range(3)] == [200, 200, 429]
+  response = client.get('/artists')
+  assert response.status_code == 429 and int(response.headers['Retry-After']) >= 1
+  # routes outside any group are not limited, and slots are released after each request
+  assert client.get('/').status_code == 200
+  assert limited.metrics()['listing']['in_flight'] == 0
+
+
+def test_busy_group_gets_503(client, limited):
+  # a request of the same group still in flight elsewhere
+  assert limited.admit('listing', 'other') is None
+  response = client.get('/venues')
+  assert response.status_code == 503 and response.headers['Retry-After'] == '1'
+  limited.release('listing')
+  assert client.get('/venues').status_code == 200
+
+
+def test_metrics_endpoint(client, limited):
+  client.get('/venues')
+  text = client.get('/metrics').get_data(as_text=True)
+  assert 'fyyur_admission_admitted_total{group="listing"} 1' in text
+  assert 'fyyur_log_records_dropped_total ' in text
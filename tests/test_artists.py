@@ -0,0 +1,99 @@
+import html
+import re
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fyyur
+from app import Artist, Show, Venue, db
+
+NAMES = ['Echo', 'Alpha', 'Delta', 'Bravo', 'Alpha', 'Foxtrot', 'Charlie']
+
+
+@pytest.fixture
+def artists(app):
+  app.config['ARTISTS_PER_PAGE'] = 2
+  venue = Venue(name='Hall', city='Austin', state='TX', address='1 Main St')
+  rows = [Artist(name=name, city='City %d' % (i % 2), state='TX') for i, name in enumerate(NAMES)]
+  db.session.add_all([venue] + rows)
+  db.session.flush()
+  # upcoming shows, 0 to 2 per artist so the busiest sort has ties
+  for i, artist in enumerate(rows):
+    for day in range(i % 3):
+      db.session.add(Show(venue_id=venue.id, artist_id=artist.id, show_date=datetime.now() + timedelta(days=day + 1)))
+  db.session.commit()
+  # (id, name, city, upcoming shows) as plain values, pages close the session
+  return [(artist.id, artist.name, artist.city, i % 3) for i, artist in enumerate(rows)]
+
+
+def use_snapshot(app, snapshot):
+  # built here rather than by the background thread, so the page reads this database
+  app.config['CATALOGUE_SNAPSHOT'] = snapshot
+  if snapshot:
+    fyyur.listing_catalogue.snapshot = fyyur.load_catalogue(fyyur.catalogue_version())
+    assert fyyur.catalogue_snapshot() is not None
+
+
+def page(client, url):
+  # (artist ids, next page url) of one page of the directory
+  body = client.get(url).get_data(as_text=True)
+  ids = [int(id) for id in re.findall(r'<a href="/artists/(\d+)">', body)]
+  next_page = re.search(r'<li class="next"><a href="([^"]+)">', body)
+  return ids, next_page and html.unescape(next_page.group(1))
+
+
+def walk(client, url):
+  ids, pages = [], 0
+  while url:
+    rows, url = page(client, url)
+    assert len(rows) <= 2
+    ids += rows
+    pages += 1
+  return ids, pages
+
+
+@pytest.mark.parametrize('snapshot', [False, True])
+@pytest.mark.parametrize('sort', ['name', 'city', 'upcoming'])
+def test_pages_cover_every_artist_once(app, client, artists, sort, snapshot):
+  use_snapshot(app, snapshot)
+  keys = {
+    'name': lambda artist: (artist[1], artist[0]),
+    'city': lambda artist: (artist[2], artist[0]),
+    'upcoming': lambda artist: (-artist[3], artist[0]),
+  }[sort]
+
+  ids, pages = walk(client, '/artists?sort=' + sort)
+
+  assert ids == [artist[0] for artist in sorted(artists, key=keys)]
+  assert pages == 4
+
+
+def test_next_page_carries_the_last_row(client, artists):
+  ids, next_page = page(client, '/artists')
+  name = dict(artist[:2] for artist in artists)[ids[-1]]
+  assert 'after_key=' + name in next_page and 'after_id=%d' % ids[-1] in next_page
+
+
+@pytest.mark.parametrize('snapshot', [False, True])
+def test_state_filter_is_kept_across_pages(app, client, artists, snapshot):
+  db.session.add_all([Artist(name='West %d' % i, city='Reno', state='NV') for i in range(3)])
+  db.session.commit()
+  use_snapshot(app, snapshot)
+
+  ids, pages = walk(client, '/artists?state=NV')
+  assert pages == 2
+  assert sorted(name for name, in db.session.query(Artist.name).filter(Artist.id.in_(ids))) == ['West 0', 'West 1', 'West 2']
+
+
+@pytest.mark.parametrize('snapshot', [False, True])
+@pytest.mark.parametrize('query', [
+  'sort=upcoming&after_key=many&after_id=3',
+  'sort=name&after_key=Alpha&after_id=x',
+  'sort=upcoming&after_key=1',
+])
+def test_malformed_cursor_serves_first_page(app, client, artists, query, snapshot):
+  use_snapshot(app, snapshot)
+  sort = query.split('&')[0]
+  response = client.get('/artists?' + query)
+  assert response.status_code == 200
+  assert page(client, '/artists?' + query)[0] == page(client, '/artists?' + sort)[0]
@@ -0,0 +1,130 @@
+import gzip
+import json
+import os
+import types
+
+import pytest
+
+import app as fyyur
+import assets
+
+
+@pytest.fixture
+def static(tmp_path):
+  folder = tmp_path / 'static'
+  (folder / 'css').mkdir(parents=True)
+  (folder / 'js').mkdir()
+  (folder / 'css' / 'a.css').write_text('/* header */\nbody {\n  color : red ;\n}\n\na :hover , b > i { margin: 0; }\n')
+  (folder / 'css' / 'b.css').write_text('p { padding: 1px; }\n')
+  (folder / 'js' / 'a.js').write_text('var a = 1\n')
+  (folder / 'js' / 'b.js').write_text('var b = 2;\n')
+  return str(folder)
+
+
+BUNDLES = {'site.css': ['css/a.css', 'css/b.css'], 'site.js': ['js/a.js', 'js/b.js']}
+
+
+def test_minify_css():
+  css = assets.minify_css('/* a\n comment */\nbody {\n  color : red ;\n}\na :hover , b > i { margin: 0; }')
+  # the space in "a :hover" is a descendant combinator and stays
+  assert css == 'body{color : red}a :hover,b>i{margin: 0}'
+
+
+def test_minify_css_keeps_strings_and_urls():
+  css = assets.minify_css(
+    'a::before { content : "a  ,  b /* x */" ; }\n'
+    'b { background: url( "x y.png" ) , url(a  b.png) ; }\n'
+    "i { font-family: 'A  >  B' ; } /* gone */"
+  )
+  assert css == (
+    'a::before{content : "a  ,  b /* x */"}'
+    'b{background: url( "x y.png" ),url(a  b.png)}'
+    "i{font-family: 'A  >  B'}"
+  )
+
+
+def test_build_writes_fingerprinted_and_compressed_bundles(static, tmp_path):
+  output = str(tmp_path / 'dist')
+  manifest = assets.build(static, output, BUNDLES)
+
+  assert set(manifest) == {'site.css', 'site.js'}
+  css = manifest['site.css']
+  assert css.startswith('site.') and css.endswith('.css') and len(css) == len('site.') + 12 + len('.css')
+  with open(os.path.join(output, css), 'rb') as f:
+    data = f.read()
+  assert data == b'body{color : red}a :hover,b>i{margin: 0}\np{padding: 1px}'
+  with open(os.path.join(output, css + '.gz'), 'rb') as f:
+    assert gzip.decompress(f.read()) == data
+  with open(os.path.join(output, assets.MANIFEST)) as f:
+    assert json.load(f) == manifest
+  # scripts are joined so a file without a trailing semicolon can't run into the next
+  with open(os.path.join(output, manifest['site.js']), 'rb') as f:
+    assert b'\n;' in f.read()
+
+
+def test_build_is_deterministic_and_clean_drops_old_bundles(static, tmp_path):
+  output = str(tmp_path / 'dist')
+  first = assets.build(static, output, BUNDLES)
+  assert assets.build(static, output, BUNDLES) == first
+
+  with open(os.path.join(static, 'css', 'b.css'), 'a') as f:
+    f.write('em { color: blue; }\n')
+  second = assets.build(static, output, BUNDLES)
+  assert second['site.css'] != first['site.css'] and second['site.js'] == first['site.js']
+
+  assert assets.clean(output, second) >= 2
+  assert not os.path.exists(os.path.join(output, first['site.css']))
+  assert not os.path.exists(os.path.join(output, first['site.css'] + '.gz'))
+  assert os.path.exists(os.path.join(output, second['site.css'] + '.gz'))
+
+
+@pytest.fixture
+def built(app, static, tmp_path, monkeypatch):
+  output = str(tmp_path / 'dist')
+  manifest = assets.build(static, output, BUNDLES)
+  monkeypatch.setitem(app.config, 'ASSETS_DIR', output)
+  monkeypatch.setattr(fyyur, 'asset_index', assets.AssetIndex(output))
+  monkeypatch.setitem(assets.BUNDLES, 'site.css', BUNDLES['site.css'])
+  return manifest
+
+
+def test_asset_urls_fall_back_to_sources(app, tmp_path, monkeypatch):
+  monkeypatch.setattr(fyyur, 'asset_index', assets.AssetIndex(str(tmp_path / 'missing')))
+  with app.test_request_context():
+    assert fyyur.asset_urls('main.css') == ['/static/' + source for source in assets.BUNDLES['main.css']]
+
+
+def test_dist_asset_serves_precompressed_copy(client, built):
+  with fyyur.app.test_request_context():
+    url, = fyyur.asset_urls('site.css')
+  assert url == '/static/dist/' + built['site.css']
+
+  response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+  assert response.headers['Content-Encoding'] == 'gzip'
+  assert gzip.decompress(response.get_data()).startswith(b'body{')
+  assert 'immutable' in response.headers['Cache-Control'] and 'Accept-Encoding' in response.headers['Vary']
+
+  plain = client.get(url)
+  assert 'Content-Encoding' not in plain.headers and plain.get_data().startswith(b'body{')
+
+
+def test_dist_asset_hides_manifest_and_copies(client, built):
+  assert client.get('/static/dist/' + assets.MANIFEST).status_code == 404
+  assert client.get('/static/dist/' + built['site.css'] + '.gz').status_code == 404
+
+
+def test_asset_index_checks_the_manifest_every_interval(tmp_path, monkeypatch):
+  clock, stats = [100.0], []
+  monkeypatch.setattr(assets, 'time', types.SimpleNamespace(monotonic=lambda: clock[0]))
+  getmtime = os.path.getmtime
+  monkeypatch.setattr(assets.os.path, 'getmtime', lambda path: stats.append(path) or getmtime(path))
+  index = assets.AssetIndex(str(tmp_path), check_every=5)
+  assert index.lookup('main.css') is None
+
+  (tmp_path / assets.MANIFEST).write_text(json.dumps({'main.css': 'main.1.css'}))
+  clock[0] += 1
+  # the missing manifest is remembered for the interval too
+  assert index.lookup('main.css') is None and len(stats) == 1
+  clock[0] += 4
+  assert [index.lookup('main.css') for _ in range(50)] == ['main.1.css'] * 50
+  assert len(stats) == 2
@@ -0,0 +1,150 @@
+import random
+import threading
+
+import pytest
+
+import app as fyyur
+import prefix_index
+from app import Artist, Lookup, Venue, db
+
+
+def test_keys_are_word_starts():
+  assert prefix_index.keys_for('The Musical Hop') == ['hop', 'musical hop', 'the musical hop']
+  assert prefix_index.keys_for('Rock-n-Roll & Blues') == ['blues', 'n-roll & blues', 'rock-n-roll & blues', 'roll & blues']
+
+
+def test_search_matches_any_word_once():
+  index = prefix_index.PrefixIndex()
+  index.build([(1, 'The Musical Hop'), (2, 'Park Square Live Music & Coffee'), (3, 'The Dueling Pianos Bar'), (4, '')])
+
+  assert index.search('mus') == [(2, 'Park Square Live Music & Coffee'), (1, 'The Musical Hop')]
+  assert index.search('  THE ') == [(3, 'The Dueling Pianos Bar'), (1, 'The Musical Hop')]
+  assert index.search('the', limit=1) == [(3, 'The Dueling Pianos Bar')]
+  assert index.search('usic') == [] and index.search('') == []
+  assert len(index) == 3
+
+
+def test_add_and_remove_keep_the_index_sorted():
+  index = prefix_index.PrefixIndex()
+  index.build([(1, 'Hall'), (2, 'Club')])
+  index.add(3, 'Hall of Fame')
+  index.add(1, 'Old Hall') # renamed
+  index.remove(2)
+  index.remove(42)
+
+  assert index.search('hall') == [(1, 'Old Hall'), (3, 'Hall of Fame')]
+  assert index.search('old') == [(1, 'Old Hall')] and index.search('club') == []
+  assert len(index) == 2
+
+
+def test_matches_a_linear_scan():
+  rng = random.Random(0)
+  words = ['jazz', 'club', 'the', 'hop', 'live', 'sound', 'bar', 'wave']
+  labels = {i: ' '.join(rng.choice(words).title() for _ in range(rng.randint(1, 3))) for i in range(500)}
+  index = prefix_index.PrefixIndex()
+  index.build(list(labels.items())[:300])
+  for entry_id in range(300, 500):
+    index.add(entry_id, labels[entry_id])
+  for entry_id in range(0, 500, 7):
+    index.remove(entry_id)
+    del labels[entry_id]
+
+  for prefix in ['j', 'ja', 'the h', 'so', 'wave', 'x']:
+    found = index.search(prefix, limit=1000)
+    expected = {entry_id for entry_id, label in labels.items()
+                if any(key.startswith(prefix) for key in prefix_index.keys_for(label))}
+    assert {entry_id for entry_id, label in found} == expected
+    assert len(found) == len(expected)
+
+
+def test_writes_publish_new_views_across_compaction():
+  rng = random.Random(1)
+  words = ['jazz', 'club', 'the', 'hop', 'live']
+  labels = {i: ' '.join(rng.choice(words).title() for _ in range(rng.randint(1, 3))) for i in range(50)}
+  index = prefix_index.PrefixIndex(compact_at=4)
+  index.build(list(labels.items()))
+  for step in range(300):
+    entry_id = rng.randrange(80)
+    before = index.view
+    frozen = (list(before.keys), list(before.entries), list(before.delta_keys), set(before.removed))
+    if rng.random() < 0.5:
+      labels[entry_id] = ' '.join(rng.choice(words).title() for _ in range(rng.randint(1, 3)))
+      index.add(entry_id, labels[entry_id])
+    else:
+      labels.pop(entry_id, None)
+      index.remove(entry_id)
+    # a search holding the old view never sees the write
+    assert (before.keys, before.entries, before.delta_keys, set(before.removed)) == frozen
+    assert len(index.view.delta_keys) + len(index.view.removed) < 4
+
+    for prefix in ['j', 'the', 'live h']:
+      expected = {entry_id for entry_id, label in labels.items()
+                  if any(key.startswith(prefix) for key in prefix_index.keys_for(label))}
+      assert sorted(entry_id for entry_id, label in index.search(prefix, limit=1000)) == sorted(expected)
+
+
+def test_searches_run_while_writing():
+  index = prefix_index.PrefixIndex(compact_at=16)
+  index.build([(i, 'Hall %d' % i) for i in range(200)])
+  errors = []
+
+  def search():
+    try:
+      for _ in range(300):
+        found = index.search('hall', limit=1000)
+        assert len({entry_id for entry_id, label in found}) == len(found)
+        assert all(label.lower().startswith('hall') for entry_id, label in found)
+        assert all(label.startswith('Club') for entry_id, label in index.search('club', limit=1000))
+    except Exception as error: # surfaced below, a thread's assert is otherwise lost
+      errors.append(error)
+
+  readers = [threading.Thread(target=search) for _ in range(4)]
+  for reader in readers:
+    reader.start()
+  for entry_id in range(200):
+    if entry_id % 2:
+      index.remove(entry_id)
+    else:
+      index.add(entry_id, 'Club %d' % entry_id)
+  for reader in readers:
+    reader.join()
+
+  assert errors == []
+  assert index.search('hall') == [] and len(index.search('club', limit=1000)) == 100
+
+
+def test_benchmark_reports_latency():
+  results = prefix_index.benchmark(entries=5000, queries=50)
+  assert results['entries'] == 5000 and results['keys'] >= 5000
+  assert results['search_p99_ms'] >= results['search_p50_ms'] >= 0 and results['memory_mb'] > 0
+
+
+@pytest.fixture
+def catalogue(app):
+  db.session.add(Lookup(description='Music'))
+  db.session.flush()
+  db.session.add(Lookup(description='Jazz', parent_id=Lookup.query.one().id))
+  db.session.add_all([Venue(name='The Jazz Hall', city='Austin', state='tx', address='1 Main St'),
+                      Artist(name='Jasmine Trio', city='Jackson', state='MS')])
+  db.session.commit()
+
+
+def suggest(client, **args):
+  return [(result['kind'], result['label']) for result in client.get('/autocomplete', query_string=args).get_json()['results']]
+
+
+def test_endpoint_suggests_every_kind(client, catalogue):
+  assert suggest(client, q='ja') == [('city', 'Jackson, MS'), ('artist', 'Jasmine Trio'), ('genre', 'Jazz'),
+                                     ('venue', 'The Jazz Hall')]
+  assert suggest(client, q='ja', kind='venue,genre') == [('genre', 'Jazz'), ('venue', 'The Jazz Hall')]
+  assert suggest(client, q='ja', limit=1) == [('city', 'Jackson, MS')]
+  assert suggest(client, q='aus') == [('city', 'Austin, TX')]
+
+
+def test_writes_update_the_built_index(client, catalogue):
+  assert suggest(client, q='blue', kind='artist') == []
+  client.post('/artists/create', data=dict(name='Blue Notes', city='Boise', state='ID', genres='Jazz', seeking_venue='No',
+                                           facebook_link='http://facebook.com/blue', website_link='http://blue.example.com',
+                                           image_link='http://blue.example.com/blue.png'))
+  assert suggest(client, q='blue', kind='artist') == [('artist', 'Blue Notes')]
+  assert suggest(client, q='boi', kind='city') == [('city', 'Boise, ID')]
@@ -0,0 +1,92 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import loaders
+from app import Artist, ArtistGenres, Lookup, Show, Venue, VenueGenres, db
+
+
+def test_loader_fetches_each_key_once():
+  fetched = []
+  def fetch(ids):
+    fetched.append(ids)
+    return {key: key * 10 for key in ids if key < 5}
+  loader = loaders.Loader(fetch)
+  loader.want_many([3, 1, 3, 7])
+  assert loader.dispatch() and fetched == [[1, 3, 7]]
+  loader.want_many([1, 2])
+  assert loader.dispatch() and fetched == [[1, 3, 7], [2]]
+  assert not loader.dispatch()
+  assert loader.loaded() == {1: 10, 2: 20, 3: 30} and loader.missing() == [7] and loader.calls == 2
+
+
+def test_resolve_runs_rounds_until_nothing_is_wanted():
+  children = loaders.Loader(lambda ids: {key: key for key in ids})
+  def fetch_parents(ids):
+    children.want_many(key + 100 for key in ids)
+    return {key: key for key in ids}
+  parents = loaders.Loader(fetch_parents)
+  parents.want_many([1, 2])
+  # children are dispatched after parents in the same round
+  assert loaders.resolve([parents, children]) == 1
+  assert sorted(children.loaded()) == [101, 102] and (parents.calls, children.calls) == (1, 1)
+
+
+@pytest.fixture
+def shows(app):
+  music = Lookup(description='Music')
+  db.session.add(music)
+  db.session.flush()
+  jazz = Lookup(description='Jazz', parent_id=music.id)
+  venues = [Venue(name='Hall %d' % i, city='Austin', state='TX', address='%d Main St' % i) for i in range(3)]
+  artists = [Artist(name='Artist %d' % i, city='Austin', state='TX') for i in range(4)]
+  db.session.add_all([jazz] + venues + artists)
+  db.session.flush()
+  db.session.add_all([VenueGenres(venue_id=venue.id, genre_id=jazz.id) for venue in venues] +
+                     [ArtistGenres(artist_id=artist.id, genre_id=music.id) for artist in artists])
+  show_list = [Show(venue_id=venues[i % 3].id, artist_id=artists[i % 4].id, show_date=datetime.now() + timedelta(days=i))
+               for i in range(20)]
+  db.session.add_all(show_list)
+  db.session.commit()
+  return [show.id for show in show_list], music.id, jazz.id
+
+
+def count_statements():
+  # of this thread only, the first request also warms the autocomplete index on another
+  statements = []
+  thread = threading.get_ident()
+  def record(connection, cursor, statement, *args):
+    if threading.get_ident() == thread:
+      statements.append(statement)
+  db.event.listen(db.engine, 'before_cursor_execute', record)
+  return statements
+
+
+def test_shows_bring_their_venues_artists_and_genres(client, shows):
+  show_ids, music_id, jazz_id = shows
+  statements = count_statements()
+  data = client.post('/api/v1/batch', json={'shows': show_ids + [999]}).get_json()
+
+  assert sorted(int(show_id) for show_id in data['shows']) == show_ids
+  assert len(data['venues']) == 3 and len(data['artists']) == 4
+  assert sorted(int(genre_id) for genre_id in data['genres']) == [music_id, jazz_id]
+  assert all(venue['genre_ids'] == [jazz_id] for venue in data['venues'].values())
+  assert data['missing'] == {'shows': [999]}
+  # shows, venues and their genres, artists and theirs, genres: whatever the number of ids
+  assert len(statements) == 6
+
+
+def test_query_args_and_ids_already_loaded(client, shows):
+  show_ids, music_id, jazz_id = shows
+  venue_id = client.post('/api/v1/batch', json={'shows': show_ids[:1]}).get_json()['shows'][str(show_ids[0])]['venue_id']
+  data = client.get('/api/v1/batch?shows=%d&venues=%d,998' % (show_ids[0], venue_id)).get_json()
+  assert list(data['venues']) == [str(venue_id)]
+  assert data['missing'] == {'shows': [], 'venues': [998]}
+
+
+def test_bad_requests(app, client, shows):
+  assert client.post('/api/v1/batch', json=[1, 2]).status_code == 400
+  assert client.get('/api/v1/batch?shows=1,x').status_code == 400
+  app.config['BATCH_MAX_IDS'] = 2
+  assert client.post('/api/v1/batch', json={'venues': [1, 2, 3]}).status_code == 400
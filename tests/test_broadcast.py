@@ -0,0 +1,141 @@
+import json
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fyyur
+import broadcast
+from app import Artist, Show, Venue, db
+
+
+def drain(subscription):
+  events = []
+  while True:
+    event = subscription.get(timeout=0)
+    if event is None:
+      return events
+    events.append(event)
+
+
+def test_delivery_follows_filters():
+  broadcaster = broadcast.Broadcaster()
+  everything = broadcaster.subscribe()
+  venue = broadcaster.subscribe(venue_id='7')
+  city = broadcaster.subscribe(city=' Austin ')
+  both = broadcaster.subscribe(venue_id=7, city='dallas')
+
+  assert broadcaster.deliver({'id': 1, 'venue_id': 7, 'city': 'AUSTIN'}) == 3
+  assert broadcaster.deliver({'id': 2, 'venue_id': 8, 'city': 'Dallas'}) == 1
+
+  assert [event['id'] for event in drain(everything)] == [1, 2]
+  assert [event['id'] for event in drain(venue)] == [1]
+  assert [event['id'] for event in drain(city)] == [1]
+  assert drain(both) == []
+
+
+def test_indexed_delivery_matches_every_filter():
+  rng = random.Random(0)
+  broadcaster = broadcast.Broadcaster(queue_size=1000)
+  subscriptions = []
+  for i in range(300):
+    filters = rng.choice([{}, {'venue_id': rng.randrange(10)}, {'city': 'city %d' % rng.randrange(5)},
+                          {'artist_id': rng.randrange(10), 'city': 'city %d' % rng.randrange(5)}])
+    subscriptions.append((filters, broadcaster.subscribe(**filters)))
+
+  events = [{'id': i, 'venue_id': rng.randrange(10), 'artist_id': rng.randrange(10), 'city': 'City %d' % rng.randrange(5)}
+            for i in range(200)]
+  for event in events:
+    broadcaster.deliver(event)
+
+  for filters, subscription in subscriptions:
+    expected = [event['id'] for event in events
+                if all(str(event[key]).lower() == str(value).lower() for key, value in filters.items())]
+    assert [event['id'] for event in drain(subscription)] == expected
+
+
+def test_slow_subscriber_is_dropped():
+  broadcaster = broadcast.Broadcaster(queue_size=2)
+  slow = broadcaster.subscribe(city='Austin')
+  for i in range(3):
+    broadcaster.deliver({'id': i, 'city': 'Austin'})
+
+  assert slow.closed and broadcaster.count() == 0
+  assert [event['id'] for event in drain(slow)] == [0, 1]
+
+
+def test_unsubscribe_empties_the_index():
+  broadcaster = broadcast.Broadcaster()
+  subscriptions = [broadcaster.subscribe(venue_id=1), broadcaster.subscribe(venue_id=1), broadcaster.subscribe()]
+  assert broadcaster.count() == 3
+  for subscription in subscriptions:
+    broadcaster.unsubscribe(subscription)
+  assert broadcaster.count() == 0 and broadcaster.index == {}
+
+
+def test_format_event():
+  text = broadcast.format_event({'id': 3, 'city': 'Austin'}, 12)
+  assert text == 'id: 12\nevent: show\ndata: {"id":3,"city":"Austin"}\n\n'
+  assert json.loads(text.split('data: ')[1]) == {'id': 3, 'city': 'Austin'}
+
+
+def test_load_test_reports_fan_out():
+  results = broadcast.load_test(subscribers=500, events=50, cities=5, venues=20)
+  assert results['subscribers'] == 500 and results['events'] == 50
+  # half the subscribers follow one of 5 cities, so every event reaches some
+  assert results['delivered'] >= 50
+  assert results['publish_p99_ms'] >= results['publish_p50_ms'] >= 0
+
+
+@pytest.fixture
+def listing(app):
+  app.config['BROADCAST_HEARTBEAT_SECONDS'] = 0.01
+  app.config['CHANGES_SETTLE_SECONDS'] = -5
+  venues = [Venue(name='Hall', city='Austin', state='TX', address='1 Main St'),
+            Venue(name='Club', city='Dallas', state='TX', address='2 Main St')]
+  artist = Artist(name='Band', city='Austin', state='TX')
+  db.session.add_all(venues + [artist])
+  db.session.commit()
+  return [venue.id for venue in venues], artist.id
+
+
+def list_show(client, venue_id, artist_id, days):
+  date = (datetime.now() + timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+  client.post('/shows/create', data=dict(venue_id=venue_id, artist_id=artist_id, start_time=date))
+
+
+def events(chunks, count):
+  # the next count show events of a stream, skipping heartbeats
+  found = []
+  for chunk in chunks:
+    chunk = chunk.decode()
+    if chunk.startswith('id: '):
+      lines = chunk.split('\n')
+      found.append((int(lines[0][4:]), json.loads(lines[2][6:])))
+      if len(found) == count:
+        return found
+  return found
+
+
+def test_stream_replays_missed_shows_then_goes_live(client, listing):
+  (austin, dallas), artist_id = listing
+  list_show(client, austin, artist_id, 1)
+  seen = fyyur.Change.query.one().seq
+  list_show(client, dallas, artist_id, 2)
+  list_show(client, austin, artist_id, 3)
+
+  response = client.get('/shows/stream?city=austin', headers={'Last-Event-ID': str(seen)}, buffered=False)
+  assert response.mimetype == 'text/event-stream'
+  chunks = iter(response.response)
+  assert next(chunks) == b'retry: 5000\n\n'
+
+  # only the Austin show listed after the client's last event is replayed
+  (seq, event), = events(chunks, 1)
+  assert seq > seen and event['venue_id'] == austin and event['city'] == 'Austin'
+
+  list_show(client, dallas, artist_id, 4)
+  list_show(client, austin, artist_id, 5)
+  (live_seq, live), = events(chunks, 1)
+  assert live_seq > seq and live['venue_id'] == austin and live['artist_name'] == 'Band'
+  response.close()
+  assert fyyur.broadcaster.count() == 0
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import calendars
+from app import Artist, Show, Venue, db
+
+
+def test_escape_and_fold():
+  assert calendars.escape('a;b,c\\d\ne') == 'a\;b\\,c\\\\d\\ne'
+  line = 'SUMMARY:' + 'é' * 60
+  folded = calendars.fold(line)
+  parts = folded.split('\r\n ')
+  assert ''.join(parts) == line
+  # 75 octets on the first line, 74 plus the leading space after it, no split characters
+  assert len(parts[0].encode('utf-8')) <= 75
+  assert all(len(part.encode('utf-8')) <= 74 for part in parts[1:])
+  assert calendars.fold('short') == 'short'
+
+
+def test_render():
+  event = calendars.Event('show-1@fyyur', datetime(2030, 5, 1, 20), datetime(2030, 5, 1, 23), datetime(2030, 4, 1, 12),
+                          'Band at Hall', 'Hall, Austin, TX', 'http://localhost/venues/1')
+  text = calendars.render('Hall', [event]).decode('utf-8')
+  assert text.startswith('BEGIN:VCALENDAR\r\nVERSION:2.0\r\n') and text.endswith('END:VCALENDAR\r\n')
+  assert 'DTSTART:20300501T200000\r\n' in text and 'DTSTAMP:20300401T120000Z\r\n' in text
+  assert 'LOCATION:Hall\\, Austin\\, TX\r\n' in text
+
+
+def test_unchanged_feeds_keep_their_etag(tmp_path):
+  path = str(tmp_path / 'feeds' / 'venue-1.ics')
+  etags = calendars.Etags()
+  assert calendars.write_if_changed(path, b'one')
+  first = etags.get(path)
+  assert not calendars.write_if_changed(path, b'one') and etags.get(path) == first
+  assert calendars.write_if_changed(path, b'two') and etags.get(path) != first
+
+
+@pytest.fixture
+def listing(app):
+  venue = Venue(name='Hall', city='Austin', state='TX', address='1 Main St')
+  artist = Artist(name='Band', city='Austin', state='TX')
+  db.session.add_all([venue, artist])
+  db.session.flush()
+  db.session.add_all([Show(venue_id=venue.id, artist_id=artist.id, show_date=datetime.now() + timedelta(days=1)),
+                      Show(venue_id=venue.id, artist_id=artist.id, show_date=datetime.now() - timedelta(days=1))])
+  db.session.commit()
+  return venue.id, artist.id
+
+
+def test_feeds_list_upcoming_shows(client, listing):
+  venue_id, artist_id = listing
+  for path in ['/venues/%d/shows.ics' % venue_id, '/artists/%d/shows.ics' % artist_id, '/cities/TX/Austin/shows.ics']:
+    response = client.get(path)
+    assert response.status_code == 200 and response.mimetype == 'text/calendar'
+    assert response.get_data(as_text=True).count('BEGIN:VEVENT') == 1
+  assert client.get('/venues/999/shows.ics').status_code == 404
+
+
+def test_polling_gets_304_until_a_show_is_added(client, listing):
+  venue_id, artist_id = listing
+  response = client.get('/venues/%d/shows.ics' % venue_id)
+  etag = response.headers['ETag']
+  assert client.get('/venues/%d/shows.ics' % venue_id, headers={'If-None-Match': etag}).status_code == 304
+
+  start = (datetime.now() + timedelta(days=2)).strftime('%Y-%m-%d %H:%M:%S')
+  client.post('/shows/create', data={'venue_id': venue_id, 'artist_id': artist_id, 'start_time': start})
+  response = client.get('/venues/%d/shows.ics' % venue_id, headers={'If-None-Match': etag})
+  assert response.status_code == 200 and response.get_data(as_text=True).count('BEGIN:VEVENT') == 2
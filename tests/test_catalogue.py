@@ -0,0 +1,116 @@
+import re
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fyyur
+import catalogue
+from app import Artist, Show, Venue, db
+
+
+class Source(object):
+  # a version the test moves by hand and a loader counting its calls
+  def __init__(self):
+    self.version, self.loads = 1, 0
+    self.loaded = threading.Event()
+
+  def load(self, version):
+    self.loads += 1
+    self.loaded.set()
+    return catalogue.build_snapshot(version, [], [], [], [])
+
+
+def test_refresh_only_rebuilds_when_the_version_moves():
+  source = Source()
+  listing = catalogue.Catalogue(source.load, lambda: source.version, max_age=300)
+  assert listing.refresh() and listing.snapshot.version == 1
+  assert not listing.refresh() and source.loads == 1
+
+  source.version = 2
+  first = listing.snapshot
+  assert listing.refresh() and listing.snapshot.version == 2 and listing.snapshot is not first
+
+  # upcoming counts age, so an old snapshot is rebuilt anyway
+  listing.snapshot.built_at -= 301
+  assert listing.refresh() and source.loads == 3
+
+
+def test_current_starts_the_thread_and_bump_wakes_it():
+  source = Source()
+  listing = catalogue.Catalogue(source.load, lambda: source.version, check_seconds=60)
+  listing.current()
+  assert source.loaded.wait(5)
+
+  source.loaded.clear()
+  source.version = 2
+  listing.bump()
+  assert source.loaded.wait(5)
+  for _ in range(100):
+    if listing.current().version == 2:
+      break
+    threading.Event().wait(0.01)
+  assert listing.current().version == 2
+
+
+def test_snapshot_records():
+  snapshot = catalogue.build_snapshot(7, [(1, 'Hall', 'Austin', 'TX', None), (2, 'Club', 'Austin', 'TX', 2), (3, 'Bar', 'Reno', 'NV', 1)],
+                                      [(1, 'Band', 'Austin', 'TX', 3), (2, 'Duo', 'Reno', 'NV', None)],
+                                      [(1, 'Jazz'), (1, 'Music')],
+                                      [(datetime(2030, 1, 1), 1, 'Hall', 1, 'Band', None,
+                                        5, datetime(2020, 1, 1), datetime(2020, 3, 1), datetime(2020, 2, 1))])
+  assert [(area.city, [venue.id for venue in area.venues]) for area in snapshot.areas] == [('Austin', [1, 2]), ('Reno', [3])]
+  assert [venue.num_upcoming_shows for area in snapshot.areas for venue in area.venues] == [0, 2, 1]
+  artists = snapshot.artist_page('upcoming', '', '', None, None, 10)
+  assert [(artist.id, artist.num_upcoming_shows, sorted(artist.genres)) for artist in artists] == \
+    [(1, 3, ['Jazz', 'Music']), (2, 0, [])]
+  # a show tile is versioned by whichever of show, venue and artist changed last
+  assert [(show.id, show.version) for show in snapshot.shows] == [(5, datetime(2020, 3, 1))]
+  # genre strings are shared between records
+  assert snapshot.rows() == 6
+
+
+def test_slotted_records_are_smaller():
+  sizes = catalogue.memory_per_rows(2000)
+  assert sizes['slots_bytes_per_100k'] < sizes['dict_bytes_per_100k']
+  assert sizes['slots_bytes_per_100k'] < sizes['object_bytes_per_100k']
+
+
+@pytest.fixture
+def listing(app):
+  venues = [Venue(name='Hall %d' % i, city=['Austin', 'Reno'][i % 2], state=['TX', 'NV'][i % 2],
+                  address='%d Main St' % i) for i in range(4)]
+  artists = [Artist(name='Artist %d' % i, city='Austin', state='TX', image_link='http://example.com/%d.png' % i)
+             for i in range(3)]
+  db.session.add_all(venues + artists)
+  db.session.flush()
+  for i in range(6):
+    db.session.add(Show(venue_id=venues[i % 4].id, artist_id=artists[i % 3].id,
+                        show_date=datetime.now() + timedelta(days=i - 2)))
+  db.session.commit()
+
+
+def render(app, client, path, snapshot):
+  app.config['CATALOGUE_SNAPSHOT'] = snapshot
+  if snapshot:
+    # built here rather than by the background thread, so the page reads this database
+    fyyur.listing_catalogue.snapshot = fyyur.load_catalogue(fyyur.catalogue_version())
+  return client.get(path).get_data(as_text=True)
+
+
+def test_shows_page_is_the_same_from_the_snapshot(app, client, listing):
+  database = render(app, client, '/shows', False)
+  assert database == render(app, client, '/shows', True)
+  assert len(re.findall(r'<h5><a href="/venues/\d+">', database)) == 6
+
+
+def test_venues_page_is_the_same_from_the_snapshot(app, client, listing):
+  # a city name shared by two states is two areas
+  db.session.add(Venue(name='Hall 9', city='Austin', state='MN', address='9 Main St'))
+  db.session.commit()
+  database = render(app, client, '/venues', False)
+  assert database == render(app, client, '/venues', True)
+  assert database.count('Austin, TX') == database.count('Austin, MN') == 1
+  # both paths count upcoming shows only; Hall 0 has one past and one upcoming
+  counts = {row.name: row.num_upcoming_shows for row in fyyur.venue_listing(db.session)}
+  assert (counts['Hall 0'], counts['Hall 1'], counts['Hall 9']) == (1, 1, 0)
@@ -0,0 +1,113 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fyyur
+from app import Change, Lookup, Venue, db
+
+Row = namedtuple('Row', 'seq entity entity_id op data')
+
+
+def test_compact_changes_keeps_one_delta_per_entity():
+  changes = [
+    Row(1, 'venue', 1, 'create', {'name': 'Hall'}),
+    Row(2, 'venue', 1, 'update', {'name': 'Hall Two'}),
+    Row(3, 'artist', 1, 'create', {'name': 'Band'}),
+    Row(4, 'venue', 2, 'update', {'name': 'Club'}),
+    Row(5, 'artist', 1, 'delete', None),
+    Row(6, 'venue', 2, 'delete', None),
+    Row(7, 'artist', 2, 'update', {'name': 'Duo'}),
+  ]
+  assert fyyur.compact_changes(changes) == [
+    # a create stays a create, with the latest data
+    {'seq': 2, 'entity': 'venue', 'id': 1, 'op': 'create', 'data': {'name': 'Hall Two'}},
+    # an update then a delete is a delete; created and deleted is dropped
+    {'seq': 6, 'entity': 'venue', 'id': 2, 'op': 'delete', 'data': None},
+    {'seq': 7, 'entity': 'artist', 'id': 2, 'op': 'update', 'data': {'name': 'Duo'}},
+  ]
+
+
+@pytest.fixture
+def feed(app, client):
+  # nothing is held back by the settle window unless a test asks for it
+  app.config['CHANGES_SETTLE_SECONDS'] = -5
+  db.session.add(Lookup(description='Jazz'))
+  db.session.commit()
+  return lambda **args: client.get('/api/v1/changes', query_string=args).get_json()
+
+
+def venue_form(**fields):
+  form = dict(name='Hall', city='Austin', state='TX', address='1 Main St', genres='Jazz',
+              seeking_talent='No', facebook_link='http://facebook.com/hall',
+              website_link='http://hall.example.com', image_link='http://hall.example.com/hall.png')
+  form.update(fields)
+  return form
+
+
+def test_feed_records_create_update_and_delete(client, feed):
+  client.post('/venues/create', data=venue_form())
+  venue_id = Venue.query.one().id
+  client.post('/venues/%d/edit' % venue_id, data=venue_form(name='Hall Two', version='1'))
+
+  changes = feed()['changes']
+  assert [(change['entity'], change['id'], change['op']) for change in changes] == [('venue', venue_id, 'create')]
+  assert changes[0]['data']['name'] == 'Hall Two' and changes[0]['data']['genres'] == ['Jazz']
+
+  since = feed()['next']
+  assert client.delete('/venues/%d' % venue_id).get_json()['success']
+  assert [(change['id'], change['op'], change['data']) for change in feed(since=since)['changes']] == \
+    [(venue_id, 'delete', None)]
+  # from the start the venue came and went, so there is nothing to sync
+  assert feed()['changes'] == []
+
+
+def test_cursor_pages_through_the_log(client, feed):
+  for i in range(5):
+    client.post('/venues/create', data=venue_form(name='Hall %d' % i))
+
+  since, names = 0, []
+  while True:
+    page = feed(since=since, limit=2)
+    assert len(page['changes']) <= 2
+    names += [change['data']['name'] for change in page['changes']]
+    assert page['next'] >= since
+    since = page['next']
+    if not page['has_more']:
+      break
+  assert names == ['Hall %d' % i for i in range(5)]
+  assert feed(since=since) == {'since': since, 'next': since, 'has_more': False, 'changes': []}
+
+
+def test_settle_window_holds_back_fresh_changes(app, client, feed):
+  client.post('/venues/create', data=venue_form())
+  app.config['CHANGES_SETTLE_SECONDS'] = 60
+  assert feed() == {'since': 0, 'next': 0, 'has_more': False, 'changes': []}
+
+  Change.query.update({'changed_at': datetime.utcnow() - timedelta(seconds=61)})
+  db.session.commit()
+  assert len(feed()['changes']) == 1
+
+
+def test_feed_records_artists_and_shows(client, feed):
+  client.post('/venues/create', data=venue_form())
+  client.post('/artists/create', data=dict(name='Band', city='Austin', state='TX', genres='Jazz', seeking_venue='No',
+                                           facebook_link='http://facebook.com/band', website_link='http://band.example.com',
+                                           image_link='http://band.example.com/band.png'))
+  venue_id, artist_id = Venue.query.one().id, fyyur.Artist.query.one().id
+  client.post('/shows/create', data=dict(venue_id=venue_id, artist_id=artist_id, start_time='2030-01-01 20:00:00'))
+
+  changes = feed()['changes']
+  assert [(change['entity'], change['op']) for change in changes] == \
+    [('venue', 'create'), ('artist', 'create'), ('show', 'create')]
+  assert changes[1]['id'] == artist_id and changes[1]['data']['seeking_venue'] is False
+  assert changes[2]['data']['show_date'] == '2030-01-01T20:00:00'
+  # form ids are numbers in the log like every other id
+  assert (changes[2]['data']['venue_id'], changes[2]['data']['artist_id']) == (venue_id, artist_id)
+
+
+def test_show_form_rejects_non_numeric_ids(client, feed):
+  body = client.post('/shows/create', data=dict(venue_id='x', artist_id='1', start_time='2030-01-01 20:00:00'),
+                     follow_redirects=True).get_data(as_text=True)
+  assert 'Validation error occurred' in body
+  assert feed()['changes'] == []
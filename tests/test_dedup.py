@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fyyur
+import dedup
+from app import Artist, Change, Lookup, MergeSuggestion, Show, Venue, VenueGenres, db
+
+
+def test_names_are_normalised():
+  assert dedup.tokens("The Guns N' Petals!") == ['guns', 'n', 'petals']
+  assert dedup.tokens('Café & Bar') == ['cafe', 'and', 'bar']
+  assert dedup.shingles(['ab']) == {' ab', 'ab '}
+
+
+def test_signature_similarity_follows_jaccard():
+  grams = [dedup.shingles(dedup.tokens(name)) for name in ['blue note jazz club', 'blue note jazz clubs',
+                                                           'red rock cellar']]
+  matrix = dedup.signatures([dedup.hash_shingles(gram) for gram in grams], dedup.minhash_params(k=256))
+  agreement = (matrix[:, 0] == matrix[:, 1]).mean()
+  assert agreement == pytest.approx(dedup.jaccard(grams[0], grams[1]), abs=0.1)
+  assert (matrix[:, 0] == matrix[:, 2]).mean() < 0.1
+
+
+def test_find_duplicates_keeps_the_older_row():
+  records = [(1, 'Blue Note Jazz Club'), (2, 'Red Rock Cellar'), (5, "The Blue Note Jazz Club"),
+             (7, 'Club Jazz Note Blue'), (9, 'Garden Tavern')]
+  pairs = sorted(dedup.find_duplicates(records))
+  assert [(keep, duplicate) for keep, duplicate, score in pairs] == [(1, 5), (1, 7), (5, 7)]
+  assert all(0.6 <= score <= 1 for _, _, score in pairs)
+  # nothing to compare in a block of one, or of names without words
+  assert list(dedup.find_duplicates([(1, 'Blue Note')])) == []
+  assert list(dedup.find_duplicates([(1, 'The'), (2, 'the')])) == []
+
+
+def test_large_buckets_are_skipped():
+  records = [(i, 'Sound Hall') for i in range(5)]
+  assert len(list(dedup.find_duplicates(records))) == 10
+  assert list(dedup.find_duplicates(records, max_bucket=4)) == []
+
+
+def test_benchmark_finds_planted_duplicates():
+  result = dedup.benchmark(records=2000, blocks=20)
+  assert result['planted_duplicates'] > 0 and result['pairs_found'] >= result['planted_duplicates'] * 0.8
+
+
+@pytest.fixture
+def duplicates(app):
+  jazz, blues = Lookup(description='Jazz'), Lookup(description='Blues')
+  keep = Venue(name='Blue Note Jazz Club', city='Austin', state='TX', address='1 Main St')
+  duplicate = Venue(name="The Blue Note Jazz Club", city=' austin', state='tx', address='1 Main St',
+                    phone='555-0100', seeking_talent=True)
+  elsewhere = Venue(name='Blue Note Jazz Club', city='Reno', state='NV', address='2 Main St')
+  artist = Artist(name='Band', city='Austin', state='TX')
+  db.session.add_all([jazz, blues, keep, duplicate, elsewhere, artist])
+  db.session.flush()
+  db.session.add_all([VenueGenres(venue_id=keep.id, genre_id=jazz.id), VenueGenres(venue_id=duplicate.id, genre_id=jazz.id),
+                      VenueGenres(venue_id=duplicate.id, genre_id=blues.id)] +
+                     [Show(venue_id=duplicate.id, artist_id=artist.id, show_date=datetime.now() + timedelta(days=i))
+                      for i in range(3)])
+  db.session.commit()
+  return keep.id, duplicate.id, elsewhere.id
+
+
+def test_suggestions_stay_within_a_city(app, duplicates):
+  keep_id, duplicate_id, elsewhere_id = duplicates
+  assert fyyur.find_merge_suggestions('venue', 0.6) == 1
+  assert [(s.keep_id, s.duplicate_id, s.status) for s in MergeSuggestion.query] == [(keep_id, duplicate_id, 'pending')]
+  # finding again replaces the pending rows
+  assert fyyur.find_merge_suggestions('venue', 0.6) == 1 and MergeSuggestion.query.count() == 1
+
+
+def test_merge_moves_shows_and_genres(app, duplicates):
+  keep_id, duplicate_id, elsewhere_id = duplicates
+  fyyur.find_merge_suggestions('venue', 0.6)
+  seq = db.session.query(db.func.max(Change.seq)).scalar() or 0
+  assert fyyur.merge_entities('venue', keep_id, duplicate_id) == 3
+
+  keep = Venue.query.get(keep_id)
+  assert Venue.query.get(duplicate_id) is None
+  assert [show.venue_id for show in Show.query] == [keep_id] * 3
+  genres = db.session.query(Lookup.description).join(VenueGenres).filter(VenueGenres.venue_id == keep_id)
+  assert sorted(row[0] for row in genres) == ['Blues', 'Jazz']
+  assert VenueGenres.query.filter_by(venue_id=duplicate_id).count() == 0
+  # blank fields are filled in, set ones are kept
+  assert (keep.phone, keep.address) == ('555-0100', '1 Main St')
+  assert MergeSuggestion.query.one().status == 'merged'
+
+  changes = Change.query.filter(Change.seq > seq).all()
+  assert sorted((change.entity, change.op) for change in changes) == \
+    [('show', 'update')] * 3 + [('venue', 'delete'), ('venue', 'update')]
+  # merged pairs are not suggested again
+  assert fyyur.find_merge_suggestions('venue', 0.6) == 0
+
+
+def test_merge_rejects_missing_rows(app, duplicates):
+  keep_id, duplicate_id, elsewhere_id = duplicates
+  with pytest.raises(ValueError):
+    fyyur.merge_entities('venue', keep_id, keep_id)
+  with pytest.raises(ValueError):
+    fyyur.merge_entities('venue', keep_id, 999)
+
+
+def test_merge_drops_shows_listed_at_both(app, duplicates):
+  keep_id, duplicate_id, elsewhere_id = duplicates
+  show = Show.query.filter_by(venue_id=duplicate_id).order_by(Show.show_date).first()
+  db.session.add(Show(venue_id=keep_id, artist_id=show.artist_id, show_date=show.show_date))
+  db.session.commit()
+
+  fyyur.merge_entities('venue', keep_id, duplicate_id)
+  # the same show was listed at both venues, it is kept once
+  assert Show.query.filter_by(venue_id=keep_id).count() == 3
+  assert Show.query.execution_options(include_deleted=True).count() == 4
@@ -0,0 +1,126 @@
+import pytest
+
+import app as fyyur
+from app import Artist, Change, Venue, VenueGenres, db
+
+
+@pytest.fixture
+def venue_id(app, genre):
+  venue = Venue(name='Hall', city='Austin', state='TX', address='1 Main St', seeking_talent=False)
+  db.session.add(venue)
+  db.session.flush()
+  db.session.add(VenueGenres(venue_id=venue.id, genre_id=fyyur.Lookup.query.one().id))
+  db.session.commit()
+  return venue.id
+
+
+@pytest.fixture
+def artist_id(app, genre):
+  artist = Artist(name='Band', city='Austin', state='TX', seeking_venue=False)
+  db.session.add(artist)
+  db.session.commit()
+  return artist.id
+
+
+def venue_form(version, **fields):
+  form = dict(version=str(version), name='Hall', city='Austin', state='TX', address='1 Main St', genres='Jazz',
+              seeking_talent='No', facebook_link='http://facebook.com/hall',
+              website_link='http://hall.example.com', image_link='http://hall.example.com/hall.png')
+  form.update(fields)
+  return form
+
+
+def artist_form(version, **fields):
+  form = dict(version=str(version), name='Band', city='Austin', state='TX', genres='Jazz', seeking_venue='No',
+              facebook_link='http://facebook.com/band', website_link='http://band.example.com',
+              image_link='http://band.example.com/band.png')
+  form.update(fields)
+  return form
+
+
+def saved(model, id):
+  db.session.remove()
+  return model.query.get(id)
+
+
+def test_edit_moves_the_version(client, venue_id):
+  response = client.post('/venues/%d/edit' % venue_id, data=venue_form(1, name='Hall Two'))
+
+  assert response.status_code == 302
+  venue = saved(Venue, venue_id)
+  assert (venue.name, venue.version) == ('Hall Two', 2)
+
+
+def test_stale_venue_edit_is_rejected(client, venue_id):
+  client.post('/venues/%d/edit' % venue_id, data=venue_form(1, name='Hall Two'))
+  changes = Change.query.count()
+
+  response = client.post('/venues/%d/edit' % venue_id, data=venue_form(1, name='Hall Three', phone='555'))
+
+  assert response.status_code == 409
+  body = response.get_data(as_text=True)
+  assert 'was changed by someone else' in body and 'Hall Two' in body
+  venue = saved(Venue, venue_id)
+  assert (venue.name, venue.phone, venue.version) == ('Hall Two', '', 2)
+  assert Change.query.count() == changes
+
+
+def test_stale_artist_edit_is_rejected(client, artist_id):
+  client.post('/artists/%d/edit' % artist_id, data=artist_form(1, city='Dallas'))
+
+  response = client.post('/artists/%d/edit' % artist_id, data=artist_form(1, name='Other Band'))
+
+  assert response.status_code == 409
+  artist = saved(Artist, artist_id)
+  assert (artist.name, artist.city, artist.version) == ('Band', 'Dallas', 2)
+
+
+def test_stale_edit_matching_the_saved_row_is_no_conflict(client, artist_id):
+  client.post('/artists/%d/edit' % artist_id, data=artist_form(1, city='Dallas'))
+
+  response = client.post('/artists/%d/edit' % artist_id, data=artist_form(1, city='Dallas'))
+
+  assert response.status_code == 302
+  assert saved(Artist, artist_id).version == 2
+
+
+def test_save_racing_the_edit_is_rejected(client, venue_id, monkeypatch):
+  # another request saves the venue after this one read it, so the version
+  # check in the UPDATE finds nothing to update
+  apply_edit = fyyur.apply_edit
+  def racing(entity, obj, values, genres):
+    table = Venue.__table__
+    with db.engine.begin() as connection:
+      connection.execute(table.update().where(table.c.id == obj.id).values(name='Racer', version=table.c.version + 1))
+    return apply_edit(entity, obj, values, genres)
+  monkeypatch.setattr(fyyur, 'apply_edit', racing)
+
+  response = client.post('/venues/%d/edit' % venue_id, data=venue_form(1, name='Hall Two'))
+
+  assert response.status_code == 409
+  venue = saved(Venue, venue_id)
+  assert (venue.name, venue.version) == ('Racer', 2)
+
+
+def test_edit_writes_only_what_changed(client, venue_id):
+  changes = Change.query.count()
+  genre_rows = [(row.venue_id, row.genre_id) for row in VenueGenres.query]
+
+  response = client.post('/venues/%d/edit' % venue_id, data=venue_form(1, phone='555-0100'))
+
+  assert response.status_code == 302
+  venue = saved(Venue, venue_id)
+  assert (venue.phone, venue.name) == ('555-0100', 'Hall')
+  # the genres were left alone, the feed records the one update
+  assert [(row.venue_id, row.genre_id) for row in VenueGenres.query] == genre_rows
+  assert [change.op for change in Change.query.all()[changes:]] == ['update']
+
+
+def test_edit_breaking_a_natural_key_is_reported(client, venue_id):
+  db.session.add(Venue(name='Club', city='Austin', state='TX', address='1 Main St'))
+  db.session.commit()
+
+  body = client.post('/venues/%d/edit' % venue_id, data=venue_form(1, name='Club'), follow_redirects=True).get_data(as_text=True)
+
+  assert 'Another venue Club is already listed at 1 Main St.' in body
+  assert saved(Venue, venue_id).name == 'Hall'
@@ -0,0 +1,97 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fyyur
+import exports
+from app import Artist, Show, Venue, db
+
+COLUMNS = [('id', 'int'), ('name', 'str'), ('when', 'datetime')]
+ROWS = [(i, 'Row, "%d"' % i, datetime(2030, 1, 1) + timedelta(hours=i)) for i in range(25)]
+
+
+def test_csv_is_written_in_batches():
+  chunks = list(exports.chunks('csv', COLUMNS, iter(ROWS), batch=10))
+  assert len(chunks) == 3
+  rows = list(csv.reader(io.StringIO(b''.join(chunks).decode('utf-8'))))
+  assert rows[0] == ['id', 'name', 'when'] and len(rows) == 26
+  assert rows[3] == ['2', 'Row, "2"', '2030-01-01T02:00:00']
+
+
+def test_jsonl_has_one_object_per_row():
+  lines = b''.join(exports.chunks('jsonl', COLUMNS, ROWS, batch=10)).decode('utf-8').splitlines()
+  assert [json.loads(line)['id'] for line in lines] == list(range(25))
+  assert json.loads(lines[1]) == {'id': 1, 'name': 'Row, "1"', 'when': '2030-01-01T01:00:00'}
+
+
+def test_parquet_row_groups():
+  parquet = pytest.importorskip('pyarrow.parquet')
+  data = b''.join(exports.chunks('parquet', COLUMNS, ROWS, batch=10))
+  table = parquet.ParquetFile(io.BytesIO(data))
+  assert table.metadata.num_row_groups == 3
+  assert table.read().column('id').to_pylist() == list(range(25))
+
+
+def test_unknown_format():
+  with pytest.raises(ValueError):
+    exports.chunks('xml', COLUMNS, ROWS)
+
+
+def test_meter_counts_rows_and_bytes():
+  meter = exports.Meter()
+  data = b''.join(meter.count_bytes(exports.chunks('csv', COLUMNS, meter.count_rows(ROWS))))
+  report = meter.report()
+  assert (report['rows'], report['bytes']) == (25, len(data))
+
+
+@pytest.fixture
+def catalogue(app):
+  venues = [Venue(name='Hall %d' % i, city='Austin', state='TX', address='%d Main St' % i) for i in range(3)]
+  artist = Artist(name='Band', city='Austin', state='TX')
+  db.session.add_all(venues + [artist])
+  db.session.flush()
+  db.session.add(Show(venue_id=venues[0].id, artist_id=artist.id, show_date=datetime(2030, 1, 1)))
+  db.session.commit()
+  return [venue.id for venue in venues]
+
+
+def test_export_endpoint(client, catalogue):
+  response = client.get('/api/v1/export/venue.csv')
+  assert response.headers['Content-Disposition'] == 'attachment; filename=venue.csv'
+  rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+  assert [int(row['id']) for row in rows] == catalogue and rows[0]['name'] == 'Hall 0'
+
+  response = client.get('/api/v1/export/show.jsonl', headers={'Accept-Encoding': 'gzip'})
+  assert response.headers['Content-Encoding'] == 'gzip'
+  assert [json.loads(line)['show_date'] for line in gzip.decompress(response.data).decode('utf-8').splitlines()] == \
+    ['2030-01-01T00:00:00']
+
+  assert client.get('/api/v1/export/nope.csv').status_code == 404
+  assert client.get('/api/v1/export/venue.xml').status_code == 404
+  assert client.get('/api/v1/export/venue.csv?since=yesterday-ish').status_code == 400
+
+
+def test_incremental_export_includes_deletions(client, catalogue):
+  since = datetime.utcnow()
+  venue = Venue.query.get(catalogue[1])
+  venue.name = 'Renamed'
+  db.session.commit()
+  client.delete('/venues/%d' % catalogue[2])
+
+  rows = list(csv.DictReader(io.StringIO(client.get('/api/v1/export/venue.csv',
+                                                    query_string={'since': since.isoformat()}).get_data(as_text=True))))
+  assert [(int(row['id']), row['name'], bool(row['deleted_at'])) for row in rows] == \
+    [(catalogue[1], 'Renamed', False), (catalogue[2], 'Hall 2', True)]
+  # a full export only has live rows
+  assert len(list(fyyur.export_rows('venue'))) == 2
+
+
+def test_export_command_writes_files(app, catalogue, tmp_path, capsys):
+  fyyur.export('venue,show', 'jsonl', None, str(tmp_path / 'exports'))
+  names = sorted(path.name for path in (tmp_path / 'exports').iterdir())
+  assert len(names) == 2 and names[0].startswith('show-') and names[1].endswith('.jsonl')
+  assert 'next incremental run' in capsys.readouterr().out
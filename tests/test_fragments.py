@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+
+import jinja2
+import pytest
+
+import app as fyyur
+import fragments
+from app import Artist, Show, Venue, db
+
+
+def test_least_recently_used_entries_go_first():
+  cache = fragments.FragmentCache(max_entries=2)
+  cache.set(('tile', 1), 'one')
+  cache.set(('tile', 2), 'two')
+  assert cache.get(('tile', 1)) == 'one'
+  cache.set(('tile', 3), 'three')
+  assert cache.get(('tile', 2)) is None and cache.get(('tile', 1)) == 'one' and cache.evictions == 1
+
+
+def test_byte_budget():
+  html = 'x' * 1000
+  cache = fragments.FragmentCache(max_bytes=3 * len(html) + 100)
+  for i in range(5):
+    cache.set(('tile', i), html)
+  assert len(cache.entries) < 5 and cache.size <= cache.max_bytes
+  # a fragment larger than the whole budget is not kept
+  cache.set(('huge',), 'x' * 10000)
+  assert cache.get(('huge',)) is None
+
+
+def test_check_drops_everything_when_the_version_moves():
+  cache = fragments.FragmentCache()
+  cache.check(1)
+  cache.set(('tile', 1), 'one')
+  cache.check(1)
+  assert cache.get(('tile', 1)) == 'one'
+  cache.check(2)
+  assert cache.get(('tile', 1)) is None and cache.size == 0
+
+
+def test_stats_and_prometheus():
+  cache = fragments.FragmentCache()
+  cache.get(('tile', 1))
+  cache.set(('tile', 1), 'one')
+  cache.get(('tile', 1))
+  stats = cache.stats()
+  assert (stats['hits'], stats['misses'], stats['hit_ratio']) == (1, 1, 0.5)
+  assert 'fyyur_fragment_cache_hits_total{fragment="tile"} 1' in fragments.prometheus(stats)
+
+
+def test_cache_tag_renders_once_per_key():
+  environment = jinja2.Environment(extensions=[fragments.FragmentCacheExtension])
+  template = environment.from_string("{% cache 'name', id %}<b>{{ render() }}</b>{% endcache %}")
+  calls = []
+  def render():
+    calls.append(1)
+    return len(calls)
+  # without a cache the body is simply rendered
+  assert template.render(id=1, render=render) == '<b>1</b>'
+
+  environment.fragment_cache = fragments.FragmentCache()
+  assert template.render(id=1, render=render) == '<b>2</b>'
+  assert template.render(id=1, render=render) == '<b>2</b>'
+  assert template.render(id=2, render=render) == '<b>3</b>'
+
+
+@pytest.fixture
+def listing(app):
+  venue = Venue(name='Hall', city='Austin', state='TX', address='1 Main St')
+  artist = Artist(name='Band', city='Austin', state='TX')
+  db.session.add_all([venue, artist])
+  db.session.flush()
+  db.session.add(Show(venue_id=venue.id, artist_id=artist.id, show_date=datetime.now() + timedelta(days=1)))
+  db.session.commit()
+  return venue.id, artist.id
+
+
+def test_an_edit_moves_the_tile_key(client, listing):
+  venue_id, artist_id = listing
+  assert 'Band' in client.get('/venues/%d' % venue_id).get_data(as_text=True)
+  hits = fyyur.fragment_cache.stats()['hits']
+  assert 'Band' in client.get('/venues/%d' % venue_id).get_data(as_text=True)
+  assert fyyur.fragment_cache.stats()['hits'] > hits
+
+  artist = Artist.query.get(artist_id)
+  artist.name = 'Renamed'
+  db.session.commit()
+  page = client.get('/venues/%d' % venue_id).get_data(as_text=True)
+  assert 'Renamed' in page and '>Band<' not in page
+  assert 'Renamed' in client.get('/shows').get_data(as_text=True)
+
+
+def test_show_tiles_are_keyed_on_the_version_of_the_view(client, listing):
+  venue_id, artist_id = listing
+  client.get('/venues/%d' % venue_id)
+  client.get('/artists/%d' % artist_id)
+  show = Show.query.one()
+  keys = [key for key in fyyur.fragment_cache.entries if key[0].endswith('show-tile')]
+  assert sorted(keys) == [('artist-show-tile', show.id, max(show.updated_at, show.venue.updated_at)),
+                          ('venue-show-tile', show.id, max(show.updated_at, show.artist.updated_at))]
+
+  # the artist page follows an edit of the venue
+  venue = Venue.query.get(venue_id)
+  venue.name = 'Renamed Hall'
+  db.session.commit()
+  page = client.get('/artists/%d' % artist_id).get_data(as_text=True)
+  assert 'Renamed Hall' in page and '>Hall<' not in page
@@ -0,0 +1,83 @@
+import re
+
+import pytest
+
+import app as fyyur
+from app import Artist, ArtistGenres, Lookup, LookupClosure, db
+
+
+def closure():
+  return sorted((row.ancestor_id, row.descendant_id, row.depth) for row in LookupClosure.query)
+
+
+@pytest.fixture
+def tree(app):
+  # Music > Rock > Punk, Music > Jazz
+  music = Lookup(description='Music')
+  db.session.add(music)
+  db.session.flush()
+  rock = Lookup(description='Rock n Roll', parent_id=music.id)
+  jazz = Lookup(description='Jazz', parent_id=music.id)
+  db.session.add_all([rock, jazz])
+  db.session.flush()
+  punk = Lookup(description='Punk', parent_id=rock.id)
+  db.session.add(punk)
+  db.session.commit()
+  return {lookup.description: lookup.id for lookup in (music, rock, jazz, punk)}
+
+
+def test_insert_adds_every_ancestor(tree):
+  music, rock, jazz, punk = tree['Music'], tree['Rock n Roll'], tree['Jazz'], tree['Punk']
+  assert closure() == sorted([
+    (music, music, 0), (rock, rock, 0), (jazz, jazz, 0), (punk, punk, 0),
+    (music, rock, 1), (music, jazz, 1), (rock, punk, 1), (music, punk, 2),
+  ])
+
+
+def test_move_and_delete_keep_the_closure_current(tree):
+  punk = Lookup.query.get(tree['Punk'])
+  punk.parent_id = tree['Jazz']
+  db.session.commit()
+  assert (tree['Jazz'], tree['Punk'], 1) in closure() and (tree['Rock n Roll'], tree['Punk'], 1) not in closure()
+
+  db.session.delete(punk)
+  db.session.commit()
+  assert all(tree['Punk'] not in row[:2] for row in closure())
+
+  # the incrementally kept rows are what a rebuild from parent_id gives
+  kept = closure()
+  fyyur.rebuild_lookup_closure(db.session.connection())
+  db.session.commit()
+  assert closure() == kept
+
+
+@pytest.fixture
+def artists(tree):
+  rows = {name: Artist(name=name, city='Austin', state='TX') for name in ('Rocker', 'Punk Band', 'Jazz Trio')}
+  db.session.add_all(rows.values())
+  db.session.flush()
+  for name, genre in (('Rocker', 'Rock n Roll'), ('Punk Band', 'Punk'), ('Jazz Trio', 'Jazz')):
+    db.session.add(ArtistGenres(artist_id=rows[name].id, genre_id=tree[genre]))
+  db.session.commit()
+  return {name: artist.id for name, artist in rows.items()}
+
+
+def test_genre_queries_include_subgenres(tree, artists):
+  assert sorted(artist.name for artist in fyyur.artists_in_genre(tree['Rock n Roll'])) == ['Punk Band', 'Rocker']
+  assert [artist.name for artist in fyyur.artists_in_genre(tree['Punk'])] == ['Punk Band']
+  assert len(fyyur.artists_in_genre(tree['Music']).all()) == 3
+
+
+def test_directory_genre_filter_includes_subgenres(client, artists):
+  body = client.get('/artists?genre=Rock n Roll').get_data(as_text=True)
+  ids = {int(id) for id in re.findall(r'<a href="/artists/(\d+)">', body)}
+  assert ids == {artists['Rocker'], artists['Punk Band']}
+
+
+def test_search_facets_count_subgenres(client, tree, artists):
+  facets = fyyur.genre_facets(ArtistGenres, ArtistGenres.artist_id, db.session.query(Artist.id))
+  # the root is not a facet, a parent counts the artists of its subgenres too
+  assert [(facet.description, facet.count) for facet in facets] == [('Rock n Roll', 2), ('Jazz', 1), ('Punk', 1)]
+
+  body = client.post('/artists/search', data={'search_term': '', 'genre_id': tree['Rock n Roll']}).get_data(as_text=True)
+  assert 'Rocker' in body and 'Punk Band' in body and 'Jazz Trio' not in body
@@ -0,0 +1,132 @@
+import random
+import re
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import app as fyyur
+import geo
+from app import Venue, db
+
+
+def test_encode_and_bounds():
+  assert geo.encode(57.64911, 10.40744, 11) == 'u4pruydqqvj'
+  south, west, north, east = geo.bounds('u4pruydqqvj')
+  assert south <= 57.64911 <= north and west <= 10.40744 <= east
+
+
+def test_neighbours_surround_the_cell():
+  cells = geo.neighbours('9v6kn')
+  assert len(cells) == 9 and '9v6kn' in cells
+  south, west, north, east = geo.bounds('9v6kn')
+  # the cell north of it starts where it ends
+  north_cell = geo.encode(north + (north - south) / 2, (west + east) / 2, 5)
+  assert north_cell in cells and geo.bounds(north_cell)[0] == pytest.approx(north)
+
+
+def test_haversine():
+  # Austin to Dallas
+  assert geo.haversine_km(30.2672, -97.7431, 32.7767, -96.7970) == pytest.approx(293, abs=2)
+
+
+@pytest.fixture
+def points():
+  rng = random.Random(0)
+  rows = [(i, rng.uniform(25, 49), rng.uniform(-124, -67)) for i in range(2000)]
+  return rows
+
+
+def brute_force(rows, latitude, longitude):
+  distances = geo.haversine_km(latitude, longitude, np.array([row[1] for row in rows]), np.array([row[2] for row in rows]))
+  return sorted(zip(distances.tolist(), [row[0] for row in rows]))
+
+
+def test_kd_index_matches_brute_force(points):
+  index = geo.KDIndex([row[0] for row in points], [row[1] for row in points], [row[2] for row in points])
+  expected = brute_force(points, 39.7392, -104.9903)
+
+  assert [id for id, distance in index.nearest(39.7392, -104.9903, 10)] == [id for distance, id in expected[:10]]
+  within = index.within(39.7392, -104.9903, 300)
+  assert [id for id, distance in within] == [id for distance, id in expected if distance <= 300]
+
+
+def test_prefix_search_matches_brute_force(points):
+  geohashes = [(row, geo.encode(row[1], row[2])) for row in points]
+  scanned = []
+
+  def candidates(cells):
+    scanned.append(len(cells))
+    return [row for row, geohash in geohashes if geohash.startswith(tuple(cells))]
+
+  for latitude, longitude in [(39.7392, -104.9903), (30.2672, -97.7431), (47.6062, -122.3321)]:
+    expected = brute_force(points, latitude, longitude)
+    found = geo.nearest_by_prefix(candidates, latitude, longitude, k=10)
+    assert [id for id, distance in found] == [id for distance, id in expected[:10]]
+    found = geo.nearest_by_prefix(candidates, latitude, longitude, k=None, radius_km=150)
+    assert [id for id, distance in found] == [id for distance, id in expected if distance <= 150]
+  # every scan is of a 3x3 block of cells
+  assert set(scanned) <= set(range(1, 10))
+
+
+@pytest.fixture
+def venues(app):
+  places = [('Austin', 'TX'), ('Dallas', 'TX'), ('Houston', 'TX'), ('San Antonio', 'TX'), ('Boston', 'MA'), ('Nowhere', 'TX')]
+  rows = [Venue(name='Hall %d' % i, city=city, state=state, address='%d Main St' % i) for i, (city, state) in enumerate(places)]
+  for venue in rows:
+    fyyur.geocode_venue(venue)
+  db.session.add_all(rows)
+  db.session.commit()
+  return {venue.city: venue.id for venue in rows}
+
+
+def near(client, **form):
+  body = client.post('/venues/search', data=dict(mode='near', **form)).get_data(as_text=True)
+  return [int(id) for id in re.findall(r'<a href="/venues/(\d+)">', body)]
+
+
+def test_geocode_from_gazetteer(venues):
+  austin = Venue.query.get(venues['Austin'])
+  assert (austin.latitude, austin.longitude) == pytest.approx((30.2672, -97.7431))
+  assert austin.geohash == geo.encode(30.2672, -97.7431)
+  assert Venue.query.get(venues['Nowhere']).geohash is None
+
+
+@pytest.mark.parametrize('index', ['kdtree', 'geohash'])
+def test_near_search_orders_by_distance(app, client, venues, index):
+  app.config['GEO_INDEX'] = index
+
+  assert near(client, search_term='Austin, TX')[:4] == [venues['Austin'], venues['San Antonio'], venues['Houston'], venues['Dallas']]
+  assert near(client, search_term='Austin, TX', radius_km=200) == [venues['Austin'], venues['San Antonio']]
+  assert near(client, search_term='', latitude=42.36, longitude=-71.06, radius_km=50) == [venues['Boston']]
+  assert near(client, search_term='Atlantis, ZZ') == []
+
+
+@pytest.mark.parametrize('index', ['kdtree', 'geohash'])
+def test_radius_search_is_not_capped_at_k(app, client, venues, index):
+  app.config.update(GEO_INDEX=index, GEO_NEAREST_K=1)
+
+  assert near(client, search_term='Austin, TX') == [venues['Austin']]
+  assert near(client, search_term='Austin, TX', radius_km=300) == \
+    [venues['Austin'], venues['San Antonio'], venues['Houston'], venues['Dallas']]
+
+
+def test_kd_index_follows_writes_of_other_processes(app, client, venues):
+  app.config['GEO_INDEX'] = 'kdtree'
+  assert near(client, search_term='Boston, MA', radius_km=50) == [venues['Boston']]
+  tree = fyyur.venue_geo_index
+
+  # another process moves a venue and deletes one: only the table changes
+  venue = Venue.__table__
+  with db.engine.begin() as connection:
+    connection.execute(venue.update().where(venue.c.id == venues['Dallas'])
+                                      .values(latitude=42.37, longitude=-71.1, updated_at=datetime.utcnow()))
+    connection.execute(venue.update().where(venue.c.id == venues['Houston']).values(deleted_at=datetime.utcnow()))
+  assert near(client, search_term='Boston, MA', radius_km=50) == [venues['Boston'], venues['Dallas']]
+  assert fyyur.venue_geo_index is not tree
+  assert venues['Houston'] not in near(client, search_term='Austin, TX')
+
+  # unchanged tables keep the tree
+  tree = fyyur.venue_geo_index
+  near(client, search_term='Austin, TX')
+  assert fyyur.venue_geo_index is tree
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fyyur
+from app import Artist, Change, IdempotencyKey, Show, Venue, VenueGenres, db
+
+
+def venue_form(**fields):
+  form = dict(name='Hall', city='Austin', state='TX', address='1 Main St', genres='Jazz',
+              seeking_talent='No', facebook_link='http://facebook.com/hall',
+              website_link='http://hall.example.com', image_link='http://hall.example.com/hall.png')
+  form.update(fields)
+  return form
+
+
+def artist_form(**fields):
+  form = dict(name='Band', city='Austin', state='TX', genres='Jazz', seeking_venue='No',
+              facebook_link='http://facebook.com/band', website_link='http://band.example.com',
+              image_link='http://band.example.com/band.png')
+  form.update(fields)
+  return form
+
+
+def test_resubmitted_venue_form_is_written_once(client, genre):
+  for attempt in range(2):
+    body = client.post('/venues/create', data=venue_form(idempotency_key='venue-1')).get_data(as_text=True)
+    assert 'Venue Hall was successfully listed!' in body
+
+  assert Venue.query.count() == 1
+  assert VenueGenres.query.count() == 1
+  assert Change.query.filter_by(entity='venue').count() == 1
+
+
+def test_idempotency_key_header_wins_over_form_field(client, genre):
+  for key in ('field-1', 'field-2'):
+    client.post('/artists/create', data=artist_form(idempotency_key=key), headers={'Idempotency-Key': 'artist-1'})
+
+  assert Artist.query.count() == 1
+  assert [key.key for key in IdempotencyKey.query] == ['artist-1']
+
+
+def test_already_listed_venue_with_new_key_writes_nothing(client, genre):
+  client.post('/venues/create', data=venue_form(idempotency_key='venue-1'))
+  body = client.post('/venues/create', data=venue_form(idempotency_key='venue-2')).get_data(as_text=True)
+
+  assert 'Venue Hall is already listed.' in body
+  assert Venue.query.count() == 1
+  assert VenueGenres.query.count() == 1
+
+
+def test_expired_key_is_claimed_again(app, client, genre):
+  client.post('/artists/create', data=artist_form(idempotency_key='artist-1'))
+  IdempotencyKey.query.filter_by(key='artist-1').update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+  db.session.commit()
+
+  body = client.post('/artists/create', data=artist_form(name='Other Band', idempotency_key='artist-1')).get_data(as_text=True)
+  assert 'Artist Other Band was successfully listed!' in body
+  assert Artist.query.count() == 2
+
+
+def test_resubmitted_show_form_is_written_once(client):
+  venue = Venue(name='Hall', city='Austin', state='TX', address='1 Main St')
+  artist = Artist(name='Band', city='Austin', state='TX')
+  db.session.add_all([venue, artist])
+  db.session.commit()
+  form = dict(venue_id=venue.id, artist_id=artist.id, start_time='2030-01-01 20:00:00')
+
+  for attempt in range(2):
+    body = client.post('/shows/create', data=dict(form, idempotency_key='show-1')).get_data(as_text=True)
+    assert 'Show was successfully listed!' in body
+  assert 'This show is already listed.' in client.post('/shows/create', data=dict(form, idempotency_key='show-2')).get_data(as_text=True)
+
+  assert Show.query.count() == 1
+
+
+def test_deleted_venue_can_be_listed_again(client, genre):
+  client.post('/venues/create', data=venue_form(idempotency_key='venue-1'))
+  client.delete('/venues/%d' % Venue.query.one().id)
+  body = client.post('/venues/create', data=venue_form(idempotency_key='venue-2')).get_data(as_text=True)
+
+  # the natural key is only unique among live rows
+  assert 'Venue Hall was successfully listed!' in body
+  assert Venue.query.count() == 1
+  assert Venue.query.execution_options(include_deleted=True).count() == 2
+
+
+def test_purge_drops_expired_keys(client, genre):
+  client.post('/artists/create', data=artist_form(idempotency_key='artist-1'))
+  client.post('/artists/create', data=artist_form(name='Other Band', idempotency_key='artist-2'))
+  IdempotencyKey.query.filter_by(key='artist-1').update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+  db.session.commit()
+
+  assert fyyur.purge_deleted(datetime.utcnow(), batch=10)['Idempotency_Key'] == 1
+  assert [key.key for key in IdempotencyKey.query] == ['artist-2']
@@ -0,0 +1,97 @@
+import io
+import os
+import threading
+import types
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import images
+
+PIL = pytest.importorskip('PIL.Image')
+
+
+def png(size):
+  output = io.BytesIO()
+  PIL.new('RGB', size, (200, 30, 30)).save(output, format='PNG')
+  return output.getvalue()
+
+
+@pytest.fixture
+def server():
+  # stands in for the remote hosts image links point to
+  files = {'/band.png': png((1200, 800)), '/copy.png': png((1200, 800)), '/page.html': b'<html></html>'}
+
+  class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      if self.path not in files:
+        self.send_error(404)
+        return
+      self.send_response(200)
+      self.send_header('Content-Length', str(len(files[self.path])))
+      self.end_headers()
+      self.wfile.write(files[self.path])
+
+    def log_message(self, *args):
+      pass
+
+  httpd = HTTPServer(('127.0.0.1', 0), Handler)
+  thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+  thread.start()
+  yield 'http://127.0.0.1:%d' % httpd.server_port
+  httpd.shutdown()
+  httpd.server_close()
+
+
+def test_fetch_image(server):
+  assert images.fetch_image(server + '/band.png').startswith(b'\x89PNG')
+
+
+def test_fetch_image_rejects_large_and_unsupported_links(server):
+  with pytest.raises(images.ImageError):
+    images.fetch_image(server + '/band.png', max_bytes=100)
+  with pytest.raises(images.ImageError):
+    images.fetch_image('ftp://example.com/band.png')
+
+
+def test_prefetch_stores_thumbnails_once(server, tmp_path):
+  urls = [server + '/band.png', server + '/copy.png', server + '/page.html', server + '/missing.png']
+  fetched, skipped, failed = images.prefetch(urls, str(tmp_path), size=(400, 400))
+
+  assert (fetched, skipped) == (2, 0)
+  assert sorted(url for url, error in failed) == [server + '/missing.png', server + '/page.html']
+
+  manifest = images.load_manifest(str(tmp_path))
+  # identical images share one content addressed file
+  assert manifest[server + '/band.png'] == manifest[server + '/copy.png']
+  thumbnail = PIL.open(os.path.join(str(tmp_path), manifest[server + '/band.png']))
+  assert thumbnail.format == 'JPEG' and max(thumbnail.size) == 400
+
+  assert images.prefetch(urls, str(tmp_path))[:2] == (0, 2)
+
+
+def test_thumbnail_index_follows_manifest(server, tmp_path):
+  index = images.ThumbnailIndex(str(tmp_path))
+  assert index.lookup(server + '/band.png') is None
+
+  images.prefetch([server + '/band.png'], str(tmp_path))
+  assert index.lookup(server + '/band.png') == images.load_manifest(str(tmp_path))[server + '/band.png']
+
+
+def test_thumbnail_index_checks_the_manifest_every_interval(tmp_path, monkeypatch):
+  clock, stats = [100.0], []
+  monkeypatch.setattr(images, 'time', types.SimpleNamespace(monotonic=lambda: clock[0]))
+  getmtime = os.path.getmtime
+  monkeypatch.setattr(images.os.path, 'getmtime', lambda path: stats.append(path) or getmtime(path))
+  index = images.ThumbnailIndex(str(tmp_path), check_every=5)
+
+  images.save_manifest(str(tmp_path), {'http://a/1.png': 'one.jpg'})
+  assert [index.lookup('http://a/1.png') for _ in range(50)] == ['one.jpg'] * 50
+  assert len(stats) == 1 and index.refresh() is not None
+
+  images.save_manifest(str(tmp_path), {'http://a/1.png': 'two.jpg'})
+  os.utime(str(tmp_path / images.MANIFEST), (0, 0))
+  clock[0] += 4
+  assert index.lookup('http://a/1.png') == 'one.jpg' and len(stats) == 1
+  clock[0] += 1
+  assert index.lookup('http://a/1.png') == 'two.jpg' and len(stats) == 2
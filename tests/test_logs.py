@@ -0,0 +1,103 @@
+import json
+import logging
+import queue
+import sys
+
+import pytest
+
+import logs
+
+
+def record(message='hello %s', args=('world',), exc_info=None, **extra):
+  entry = logging.LogRecord('fyyur', logging.ERROR, __file__, 1, message, args, exc_info)
+  entry.__dict__.update(extra)
+  return entry
+
+
+def failure():
+  try:
+    raise ValueError('bad')
+  except ValueError:
+    return sys.exc_info()
+
+
+def test_json_formatter_writes_one_object_per_record():
+  line = logs.JSONFormatter().format(record(exc_info=failure(), route='/venues', status=500))
+  assert '\n' not in line.replace('\\n', '')
+  data = json.loads(line)
+  assert (data['level'], data['logger'], data['message']) == ('ERROR', 'fyyur', 'hello world')
+  assert (data['route'], data['status']) == ('/venues', 500)
+  assert 'ValueError: bad' in data['exception']
+  assert data['time'].endswith('+00:00')
+  # the standard LogRecord attributes are not repeated
+  assert 'args' not in data and 'lineno' not in data
+
+
+def test_queue_handler_drops_instead_of_blocking():
+  handler = logs.NonBlockingQueueHandler(queue.Queue(2))
+  for _ in range(5):
+    handler.handle(record())
+  assert handler.queue.qsize() == 2 and handler.dropped == 3
+
+
+def test_queue_handler_renders_before_queueing():
+  handler = logs.NonBlockingQueueHandler(queue.Queue())
+  handler.handle(record(exc_info=failure()))
+  queued = handler.queue.get_nowait()
+  # what crosses the queue no longer needs the arguments or the live traceback
+  assert (queued.msg, queued.args, queued.exc_info) == ('hello world', None, None)
+  assert 'ValueError: bad' in queued.exc_text
+
+
+def test_context_filter_keeps_explicit_fields():
+  entry = record(route='/explicit')
+  assert logs.ContextFilter(lambda: {'route': '/context', 'request_id': 'abc'}).filter(entry)
+  assert (entry.route, entry.request_id) == ('/explicit', 'abc')
+
+
+def test_setup_writes_json_lines(tmp_path):
+  logger = logging.getLogger('fyyur.tests.setup')
+  logger.propagate = False
+  handler = logs.setup(logger, str(tmp_path / 'fyyur.log'), context=lambda: {'request_id': 'abc'})
+  try:
+    logger.info('first')
+    logger.debug('below the level')
+    logger.warning('second', extra={'status': 404})
+  finally:
+    logger.removeHandler(handler)
+    # the listener writes on its own thread; wait until it emptied the queue
+    handler.queue.join()
+
+  lines = [json.loads(line) for line in (tmp_path / 'fyyur.log').read_text().splitlines()]
+  assert [(line['message'], line['request_id']) for line in lines] == [('first', 'abc'), ('second', 'abc')]
+  assert lines[1]['status'] == 404
+
+
+class Captured(logging.Handler):
+  def __init__(self):
+    super(Captured, self).__init__()
+    self.records = []
+
+  def emit(self, record):
+    self.records.append(record)
+
+
+@pytest.fixture
+def captured(app):
+  # after the app's queue handler, whose filter adds the request context
+  handler = Captured()
+  root = logging.getLogger()
+  root.addHandler(handler)
+  yield handler.records
+  root.removeHandler(handler)
+
+
+def test_requests_are_logged_with_their_id(app, client, captured):
+  app.config['LOG_REQUESTS'] = True
+  response = client.get('/venues', headers={'X-Request-ID': 'req-1'})
+  assert response.headers['X-Request-ID'] == 'req-1'
+  assert client.get('/venues').headers['X-Request-ID'] != 'req-1'
+
+  logged = [entry for entry in captured if getattr(entry, 'request_id', None) == 'req-1']
+  assert [(entry.route, entry.method, entry.status) for entry in logged] == [('/venues', 'GET', 200)]
+  assert logged[0].duration_ms >= 0
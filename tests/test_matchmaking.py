@@ -0,0 +1,208 @@
+import random
+
+import numpy as np
+import pytest
+
+import app as fyyur
+import matchmaking
+from app import Artist, ArtistGenres, Lookup, Match, Show, Venue, VenueGenres, db
+
+GENRES = {genre_id: i for i, genre_id in enumerate(range(1, 9))}
+
+
+def random_sides(artists=60, venues=40, seed=0):
+  # random rows in a handful of cities, with genres and some show history
+  rng = random.Random(seed)
+  cities = [('Austin', 'TX'), ('Dallas', 'TX'), ('Reno', 'NV'), ('Boston', 'MA')]
+  artist_rows = [(i, *rng.choice(cities)) for i in range(1, artists + 1)]
+  venue_rows = [(100 + i, *rng.choice(cities)) for i in range(1, venues + 1)]
+  artist_genres = [(row[0], genre) for row in artist_rows for genre in rng.sample(list(GENRES), rng.randint(0, 3))]
+  venue_genres = [(row[0], genre) for row in venue_rows for genre in rng.sample(list(GENRES), rng.randint(1, 3))]
+  shows = [(rng.choice(artist_rows)[0], rng.choice(venue_rows)[0]) for i in range(80)]
+
+  artist_side = matchmaking.build_side(artist_rows, artist_genres, GENRES)
+  venue_side = matchmaking.build_side(venue_rows, venue_genres, GENRES)
+  return artist_side, venue_side, matchmaking.history_matrix(artist_side, venue_side, shows)
+
+
+def test_score_components():
+  artists = matchmaking.build_side([(1, 'Austin', 'TX'), (2, 'Reno', 'NV')], [(1, 1), (1, 2), (2, 3)], GENRES)
+  venues = matchmaking.build_side([(10, 'austin', 'tx'), (11, 'Dallas', 'TX')], [(10, 1), (11, 3)], GENRES)
+  history = matchmaking.history_matrix(artists, venues, [(2, 11)] * 5)
+  scores = matchmaking.score_block(artists, venues, history, 0, 2)
+  weights = matchmaking.WEIGHTS
+
+  # cosine of {1, 2} and {1}, same city ignoring case
+  assert scores[0, 0] == pytest.approx(weights['genre'] / np.sqrt(2) + weights['city'])
+  # same state only counts half
+  assert scores[0, 1] == pytest.approx(0.5 * weights['city'])
+  # same genre, history saturates at 3 shows
+  assert scores[1, 1] == pytest.approx(weights['genre'] + weights['history'])
+  assert scores[1, 0] == pytest.approx(0)
+
+
+def test_top_matches_holds_both_sides_top_k():
+  artists, venues, history = random_sides()
+  k = 5
+  scores = matchmaking.score_block(artists, venues, history, 0, len(artists.ids))
+  pairs = {(artist_id, venue_id): score for artist_id, venue_id, score
+           in matchmaking.top_matches(artists, venues, history, k=k, chunk=7)}
+
+  for i, artist_id in enumerate(artists.ids.tolist()):
+    found = sorted((score for (a, v), score in pairs.items() if a == artist_id), reverse=True)[:k]
+    assert found == pytest.approx(sorted(scores[i], reverse=True)[:k], abs=1e-6)
+  for j, venue_id in enumerate(venues.ids.tolist()):
+    found = sorted((score for (a, v), score in pairs.items() if v == venue_id), reverse=True)[:k]
+    assert found == pytest.approx(sorted(scores[:, j], reverse=True)[:k], abs=1e-6)
+  for (artist_id, venue_id), score in pairs.items():
+    assert score == pytest.approx(scores[artists.index[artist_id], venues.index[venue_id]], abs=1e-6)
+
+
+def test_top_k_with_fewer_candidates_than_k():
+  scores = np.array([[0.3, 0.9], [0.1, 0.2]])
+  assert sorted(matchmaking.top_k(scores, 5, axis=1)[0].tolist()) == [0, 1]
+  assert matchmaking.top_k(scores, 1, axis=0).tolist() == [[0, 0]]
+
+
+@pytest.fixture
+def listings(app):
+  app.config['MATCHES_PER_ENTITY'] = 2
+  genres = [Lookup(description=name) for name in ('Jazz', 'Blues', 'Folk')]
+  db.session.add_all(genres)
+  db.session.flush()
+  rng = random.Random(1)
+  artists = [Artist(name='Artist %d' % i, city=rng.choice(['Austin', 'Reno']), state=rng.choice(['TX', 'NV']),
+                    seeking_venue=i % 5 != 0) for i in range(12)]
+  venues = [Venue(name='Venue %d' % i, city=rng.choice(['Austin', 'Reno']), state=rng.choice(['TX', 'NV']),
+                  address='%d Main St' % i, seeking_talent=i % 4 != 0) for i in range(8)]
+  db.session.add_all(artists + venues)
+  db.session.flush()
+  for artist in artists:
+    db.session.add(ArtistGenres(artist_id=artist.id, genre_id=rng.choice(genres).id))
+  for venue in venues:
+    db.session.add(VenueGenres(venue_id=venue.id, genre_id=rng.choice(genres).id))
+  db.session.commit()
+  return [artist.id for artist in artists], [venue.id for venue in venues]
+
+
+def stored():
+  return {(match.artist_id, match.venue_id): match.score for match in Match.query}
+
+
+def test_full_rescore_stores_only_seeking_pairs(listings):
+  artist_ids, venue_ids = listings
+  fyyur.refresh_matches()
+  pairs = stored()
+
+  assert pairs
+  seeking_artists = {id for id, in db.session.query(Artist.id).filter(Artist.seeking_venue.is_(True))}
+  seeking_venues = {id for id, in db.session.query(Venue.id).filter(Venue.seeking_talent.is_(True))}
+  assert {artist_id for artist_id, venue_id in pairs} <= seeking_artists
+  assert {venue_id for artist_id, venue_id in pairs} <= seeking_venues
+  for artist_id in seeking_artists:
+    assert 1 <= sum(1 for a, v in pairs if a == artist_id) <= len(seeking_venues)
+
+
+def test_detail_page_lists_stored_matches(client, listings):
+  fyyur.refresh_matches()
+  artist_id, venue_id = max(stored().items(), key=lambda item: item[1])[0]
+  name = Venue.query.get(venue_id).name
+  assert name in client.get('/artists/%d' % artist_id).get_data(as_text=True)
+
+
+def ranks(pairs, k):
+  # the stored rows among the k best of their artist or of their venue
+  kept = set()
+  for side in (0, 1):
+    lists = {}
+    for pair, score in pairs.items():
+      lists.setdefault(pair[side], []).append((-score, pair[1 - side], pair))
+    for rows in lists.values():
+      kept.update(pair for _, _, pair in sorted(rows)[:k])
+  return kept
+
+
+def test_incremental_refresh_keeps_lists_at_k(listings):
+  artist_ids, venue_ids = listings
+  fyyur.refresh_matches()
+  genre_ids = [genre.id for genre in Lookup.query]
+  rng = random.Random(2)
+  for round in range(5):
+    # move a few genres and refresh just those rows
+    artist_id, venue_id = rng.choice(artist_ids), rng.choice(venue_ids)
+    ArtistGenres.query.filter_by(artist_id=artist_id).update({'genre_id': rng.choice(genre_ids)})
+    VenueGenres.query.filter_by(venue_id=venue_id).update({'genre_id': rng.choice(genre_ids)})
+    db.session.commit()
+    fyyur.refresh_matches(artist_ids=[artist_id], venue_ids=[venue_id])
+    pairs = stored()
+    # nothing is kept that is not among the k best of one of its sides
+    assert set(pairs) == ranks(pairs, 2)
+
+
+def best_scores(pairs, k):
+  # every artist's and venue's k best stored scores, what a refresh must get right
+  lists = {}
+  for (artist_id, venue_id), score in pairs.items():
+    lists.setdefault(('artist', artist_id), []).append(round(score, 6))
+    lists.setdefault(('venue', venue_id), []).append(round(score, 6))
+  return {key: sorted(scores, reverse=True)[:k] for key, scores in lists.items()}
+
+
+def test_incremental_refresh_equals_a_full_rescore(listings):
+  artist_ids, venue_ids = listings
+  fyyur.refresh_matches()
+  genre_ids = [genre.id for genre in Lookup.query]
+  rng = random.Random(3)
+  for round in range(12):
+    # rows fall out of lists when an entity changes genre or stops seeking
+    if round % 2:
+      venue_id = rng.choice(venue_ids)
+      VenueGenres.query.filter_by(venue_id=venue_id).update({'genre_id': rng.choice(genre_ids)})
+      Venue.query.get(venue_id).seeking_talent = rng.random() < 0.7
+      db.session.commit()
+      fyyur.refresh_matches(venue_ids=[venue_id])
+    else:
+      changed = rng.sample(artist_ids, 2)
+      for artist_id in changed:
+        ArtistGenres.query.filter_by(artist_id=artist_id).update({'genre_id': rng.choice(genre_ids)})
+        Artist.query.get(artist_id).seeking_venue = rng.random() < 0.7
+      db.session.commit()
+      fyyur.refresh_matches(artist_ids=changed)
+    incremental = stored()
+    assert set(incremental) == ranks(incremental, 2)
+
+    fyyur.refresh_matches()
+    assert best_scores(incremental, 2) == best_scores(stored(), 2)
+
+
+def test_refresh_queue_coalesces_writes():
+  calls = []
+  def refresh(key, artist_ids, venue_ids):
+    calls.append((key, artist_ids, venue_ids))
+    if key == 'broken':
+      raise ValueError('shard down')
+  queue = matchmaking.RefreshQueue(refresh, delay=0.05)
+  queue.put([1], key='west')
+  queue.put([2, 1], [5], key='west')
+  queue.put(venue_ids=[7], key='broken')
+  queue.put([3], key=None)
+  assert queue.join(5)
+  assert sorted(calls, key=repr) == sorted([('west', [1, 2], [5]), ('broken', None, [7]), (None, [3], None)], key=repr)
+
+  # a failed refresh does not stop the thread
+  queue.put([4])
+  assert queue.join(5) and calls[-1] == (None, [4], None)
+
+
+def test_writes_queue_a_refresh(app, listings, monkeypatch):
+  artist_ids, venue_ids = listings
+  app.config['MATCHES_REFRESH_ON_WRITE'] = True
+  monkeypatch.setattr(fyyur.match_queue, 'delay', 0)
+  fyyur.refresh_matches()
+  Match.query.delete()
+  db.session.commit()
+
+  fyyur.refresh_matches_after_write(artist_ids=artist_ids[1:2])
+  assert fyyur.match_queue.join(5)
+  db.session.remove()
+  assert {artist_id for artist_id, venue_id in stored()} == {artist_ids[1]}
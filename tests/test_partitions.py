@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import app as fyyur
+from app import Artist, Show, ShowArchive, Venue, db
+
+
+def test_month_start():
+  assert fyyur.month_start(datetime(2024, 12, 31, 23, 59)) == datetime(2024, 12, 1)
+  assert fyyur.month_start(datetime(2024, 12, 15), 1) == datetime(2025, 1, 1)
+  assert fyyur.month_start(datetime(2024, 1, 15), -13) == datetime(2022, 12, 1)
+  assert fyyur.partition_name(datetime(2024, 3, 1)) == 'Show_y2024m03'
+
+
+def test_detail_pages_read_archived_past_shows(client):
+  venue = Venue(name='Hall', city='Austin', state='TX', address='1 Main St')
+  artist = Artist(name='Band', city='Austin', state='TX')
+  db.session.add_all([venue, artist])
+  db.session.flush()
+  db.session.add(Show(venue_id=venue.id, artist_id=artist.id, show_date=datetime(2020, 1, 1)))
+  db.session.add(ShowArchive(venue_id=venue.id, artist_id=artist.id, show_date=datetime(2010, 1, 1)))
+  db.session.commit()
+
+  body = client.get('/venues/%d' % venue.id).get_data(as_text=True)
+  assert '2 Past Shows' in body
+
+
+def partitions(parent):
+  return [name for name, start in fyyur.show_partitions(db.session.connection(), parent)]
+
+
+def test_partitions_are_created_ahead_and_archived(postgres_app):
+  this_month = fyyur.month_start(datetime.now())
+  venue = Venue(name='Hall', city='Austin', state='TX', address='1 Main St')
+  artist = Artist(name='Band', city='Austin', state='TX')
+  db.session.add_all([venue, artist])
+  db.session.flush()
+  old, later = fyyur.month_start(this_month, -30), fyyur.month_start(this_month, 20)
+  for date in (old, later, this_month):
+    db.session.add(Show(venue_id=venue.id, artist_id=artist.id, show_date=date))
+  db.session.commit()
+  # both fall outside the partitions the migration made, so into the default one
+  assert db.session.execute('SELECT count(*) FROM "Show_default"').scalar() == 2
+
+  created, archived = fyyur.maintain_show_partitions(ahead=3, retain=24)
+
+  assert fyyur.partition_name(later) in created and fyyur.partition_name(old) in created
+  assert archived == [fyyur.partition_name(old)]
+  assert db.session.execute('SELECT count(*) FROM "Show_default"').scalar() == 0
+  assert fyyur.partition_name(old) in partitions('Show_Archive')
+  assert fyyur.partition_name(old) not in partitions('Show')
+  assert [show.show_date for show in ShowArchive.query] == [old]
+  assert sorted(show.show_date for show in Show.query) == [this_month, later]
+
+  # a second run has nothing left to do
+  assert fyyur.maintain_show_partitions(ahead=3, retain=24) == ([], [])
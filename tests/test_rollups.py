@@ -0,0 +1,79 @@
+from datetime import date, datetime
+
+import pytest
+
+import app as fyyur
+import rollups
+from app import Artist, ArtistGenres, Lookup, Show, ShowRollup, Venue, db
+
+
+def test_a_show_counts_towards_every_dimension():
+  assert rollups.keys(1, 2, 'Austin, TX', [7]) == [('all', ''), ('venue', '1'), ('artist', '2'), ('city', 'Austin, TX'),
+                                                   ('genre', '7'), ('genre_city', '7|Austin, TX')]
+  counts = rollups.increments([(1, 2, datetime(2030, 5, 3, 20), None, ()), (1, 3, datetime(2030, 5, 9), None, ())])
+  assert counts['month', 'venue', '1', date(2030, 5, 1)] == 2
+  assert counts['day', 'venue', '1', date(2030, 5, 3)] == 1
+  counts = rollups.increments([(1, 2, datetime(2030, 5, 3), None, ())], -1, counts)
+  assert counts['month', 'venue', '1', date(2030, 5, 1)] == 1 and counts['day', 'artist', '2', date(2030, 5, 3)] == 0
+
+
+def test_benchmark_reports_both_paths():
+  result = rollups.benchmark(sizes=(2000,), venues=20, queries=2)
+  assert set(result) == {'shows_2000_raw_ms', 'shows_2000_rollup_ms'}
+
+
+def rollup_rows():
+  return {(row.grain, row.dimension, row.key, row.bucket): row.shows for row in ShowRollup.query if row.shows}
+
+
+@pytest.fixture
+def catalogue(app):
+  jazz = Lookup(description='Jazz')
+  hall = Venue(name='Hall', city='Austin', state='TX', address='1 Main St')
+  club = Venue(name='Club', city='Reno', state='NV', address='2 Main St')
+  band = Artist(name='Band', city='Austin', state='TX')
+  db.session.add_all([jazz, hall, club, band])
+  db.session.flush()
+  db.session.add(ArtistGenres(artist_id=band.id, genre_id=jazz.id))
+  db.session.commit()
+  return hall.id, club.id, band.id, jazz.id
+
+
+def test_writes_keep_the_rollup_in_step(app, catalogue):
+  hall_id, club_id, band_id, jazz_id = catalogue
+  shows = [Show(venue_id=hall_id, artist_id=band_id, show_date=datetime(2030, 5, day)) for day in (1, 2, 3)]
+  db.session.add_all(shows)
+  db.session.commit()
+  assert rollup_rows()['month', 'genre_city', '%d|Austin, TX' % jazz_id, date(2030, 5, 1)] == 3
+
+  # loaded first like the edit handlers do, the hook reads the old values from the history
+  shows = Show.query.order_by(Show.show_date).all()
+  shows[0].show_date = datetime(2030, 6, 1)
+  shows[1].venue_id = club_id
+  shows[2].deleted_at = datetime.utcnow()
+  db.session.commit()
+  counted = rollup_rows()
+  assert counted['month', 'venue', str(hall_id), date(2030, 6, 1)] == 1
+  assert counted['month', 'city', 'Reno, NV', date(2030, 5, 1)] == 1
+  assert ('month', 'venue', str(hall_id), date(2030, 5, 1)) not in counted
+
+  # the incremental counts are what a full recount gives
+  fyyur.rebuild_rollups()
+  assert rollup_rows() == counted
+
+
+def test_stats_api(client, catalogue):
+  hall_id, club_id, band_id, jazz_id = catalogue
+  db.session.add_all([Show(venue_id=venue_id, artist_id=band_id, show_date=datetime(2030, month, 1))
+                      for venue_id, month in [(hall_id, 5), (hall_id, 6), (club_id, 6)]])
+  db.session.commit()
+
+  data = client.get('/api/v1/stats?from=2030-05-01&to=2030-06-30').get_json()
+  assert [(row['label'], row['shows']) for row in data['top']] == [('Hall', 2), ('Club', 1)]
+  assert [(row['bucket'], row['shows']) for row in data['series']] == [('2030-05-01', 1), ('2030-06-01', 2)]
+  data = client.get('/api/v1/stats?dimension=genre&grain=day&from=2030-06-01&to=2030-06-01&limit=1').get_json()
+  assert data['top'] == [{'key': str(jazz_id), 'label': 'Jazz', 'shows': 2}]
+
+  assert 'Hall' in client.get('/stats?from=2030-05-01&to=2030-06-30').get_data(as_text=True)
+  for query in ['dimension=nope', 'grain=week', 'from=2030-07-01&to=2030-06-01', 'limit=0', 'to=June']:
+    assert client.get('/api/v1/stats?' + query).status_code == 400
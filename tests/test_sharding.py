@@ -0,0 +1,256 @@
+import re
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+
+import app as fyyur
+import shards
+from app import Artist, Show, Venue, db
+
+
+def test_parse_urls_keeps_the_order():
+  assert list(shards.parse_urls(' west=sqlite:///w.db, south = sqlite:///s.db,')) == ['west', 'south']
+  assert shards.parse_urls('') == {}
+
+
+def test_states_go_to_the_shard_of_their_region():
+  shard_set = shards.ShardSet([('west', None), ('south', None)], regions={'midwest': 'west'}, id_range=100)
+  assert [shard_set.for_state(state) for state in ('CA', ' tx ', 'OH', 'NY', None)] == \
+    ['west', 'south', 'west', 'west', 'west']
+  assert (shard_set.id_base('west'), shard_set.id_base('south')) == (100, 200)
+  assert [shard_set.for_id(id) for id in (5, 100, 199, 250, 300)] == [None, 'west', 'west', 'south', None]
+
+
+def test_gather_merges_sorted_streams():
+  shard_set = shards.ShardSet([('a', None), ('b', None), ('c', None)])
+  streams = {'a': [1, 4, 7], 'b': [2, 5, 8, 9], 'c': []}
+  assert list(shard_set.gather(lambda name, engine: iter(streams[name]), key=lambda row: row, buffer=1)) == \
+    [1, 2, 4, 5, 7, 8, 9]
+
+  def failing(name, engine):
+    if name == 'b':
+      raise ValueError('shard down')
+    return iter(streams[name])
+  with pytest.raises(ValueError):
+    list(shard_set.gather(failing, key=lambda row: row))
+
+
+@pytest.fixture
+def sharded(app, tmp_path, monkeypatch):
+  # two SQLite files as shards of the test database, split like "shard_split" would
+  engines = [(name, create_engine('sqlite:///' + str(tmp_path / (name + '.db')))) for name in ('west', 'south')]
+  shard_set = shards.ShardSet(engines, regions={'midwest': 'west', 'northeast': 'south'}, id_range=1000)
+  monkeypatch.setattr(fyyur, 'shard_set', shard_set)
+  yield shard_set
+  db.session.remove()
+  shard_set.dispose()
+
+
+def rows(shard_set, name, model):
+  # ids (the first primary key column) straight from a database, None names the main one
+  column = list(model.__table__.primary_key.columns)[0]
+  with (shard_set.engines[name] if name else db.engine).connect() as connection:
+    return connection.execute(db.select([column]).order_by(column)).scalars().all()
+
+
+@pytest.fixture
+def split(sharded):
+  artist = Artist(name='Band', city='Austin', state='TX')
+  db.session.add(fyyur.Lookup(description='Jazz'))
+  venues = [Venue(name='Hall', city='Austin', state='TX', address='1 Main St'),
+            Venue(name='Club', city='Los Angeles', state='CA', address='2 Main St')]
+  db.session.add_all(venues + [artist])
+  db.session.flush()
+  db.session.add_all([Show(venue_id=venue.id, artist_id=artist.id, show_date=datetime.now() + timedelta(days=i + 1))
+                      for i, venue in enumerate(venues)])
+  db.session.commit()
+  ids = venues[0].id, venues[1].id, artist.id
+  db.session.remove()
+  assert fyyur.split_shards(batch=1) == {'west': 1, 'south': 1}
+  return ids
+
+
+def test_split_copies_venues_to_their_region(sharded, split):
+  hall_id, club_id, artist_id = split
+  assert rows(sharded, 'south', Venue) == [hall_id] and rows(sharded, 'west', Venue) == [club_id]
+  assert len(rows(sharded, 'south', Show)) == len(rows(sharded, 'west', Show)) == 1
+  # artists are on every shard
+  assert rows(sharded, 'south', Artist) == rows(sharded, 'west', Artist) == [artist_id]
+  assert sharded.locate(Venue.__table__, hall_id) == 'south'
+  # running again keeps what the shards hold
+  assert fyyur.split_shards() == {'west': 1, 'south': 1}
+  assert rows(sharded, 'south', Venue) == [hall_id]
+
+
+def create_venue(client, name, city, state, headers=None):
+  client.post('/venues/create', data=dict(name=name, city=city, state=state, address='3 Main St', genres='Jazz',
+                                          seeking_talent='No', facebook_link='http://facebook.com/bar',
+                                          website_link='http://bar.example.com', image_link='http://bar.example.com/bar.png'),
+              headers=headers)
+
+
+def test_new_venues_and_shows_are_written_to_their_shard(client, sharded, split):
+  hall_id, club_id, artist_id = split
+  create_venue(client, 'Bar', 'Reno', 'NV')
+  venue_id = rows(sharded, 'west', Venue)[-1]
+  # the id tells the shard, the main database never saw the venue
+  assert sharded.for_id(venue_id) == 'west' and venue_id not in rows(sharded, None, Venue)
+
+  client.post('/shows/create', data=dict(venue_id=venue_id, artist_id=artist_id,
+                                         start_time=(datetime.now() + timedelta(days=5)).strftime('%Y-%m-%d %H:%M:%S')))
+  assert len(rows(sharded, 'west', Show)) == 2
+  assert 'Band' in client.get('/venues/%d' % venue_id).get_data(as_text=True)
+  assert client.get('/venues/%d' % hall_id).status_code == 200
+
+
+def test_listings_read_every_shard(client, sharded, split):
+  hall_id, club_id, artist_id = split
+  page = client.get('/shows').get_data(as_text=True)
+  assert page.index('/venues/%d"' % hall_id) < page.index('/venues/%d"' % club_id)
+  page = client.get('/venues').get_data(as_text=True)
+  assert '/venues/%d"' % hall_id in page and '/venues/%d"' % club_id in page
+  assert '2 Upcoming Shows' in client.get('/artists/%d' % artist_id).get_data(as_text=True)
+
+
+def test_artist_edits_reach_every_shard(client, sharded, split):
+  hall_id, club_id, artist_id = split
+  client.post('/artists/%d/edit' % artist_id, data=dict(version='1', name='Renamed', city='Austin', state='TX',
+                                                        genres='Jazz', seeking_venue='No',
+                                                        facebook_link='http://facebook.com/band',
+                                                        website_link='http://band.example.com',
+                                                        image_link='http://band.example.com/band.png'))
+  for name in ('west', 'south'):
+    with sharded.engines[name].connect() as connection:
+      assert connection.execute(db.select([Artist.__table__.c.name])).scalar() == 'Renamed'
+
+
+def test_log_keys_and_rollups_stay_on_the_main_database(app, client, sharded, split):
+  hall_id, club_id, artist_id = split
+  app.config['CHANGES_SETTLE_SECONDS'] = -5
+  create_venue(client, 'Bar', 'Reno', 'NV', headers={'Idempotency-Key': 'bar-1'})
+  create_venue(client, 'Bar', 'Reno', 'NV', headers={'Idempotency-Key': 'bar-1'})
+  venue_id = rows(sharded, 'west', Venue)[-1]
+  assert rows(sharded, 'west', Venue) == [club_id, venue_id]
+  show_date = datetime.now() + timedelta(days=5)
+  client.post('/shows/create', data=dict(venue_id=venue_id, artist_id=artist_id,
+                                         start_time=show_date.strftime('%Y-%m-%d %H:%M:%S')))
+
+  for name in ('west', 'south'):
+    assert rows(sharded, name, fyyur.Change) == [] and rows(sharded, name, fyyur.ShowRollup) == []
+  assert 'bar-1' in rows(sharded, None, fyyur.IdempotencyKey)
+  feed = client.get('/api/v1/changes').get_json()['changes']
+  assert [(change['entity'], change['id']) for change in feed][-2:] == [('venue', venue_id), ('show', rows(sharded, 'west', Show)[-1])]
+
+  stats = client.get('/api/v1/stats', query_string={'dimension': 'venue', 'grain': 'day', 'limit': 5,
+                                                    'to': (show_date + timedelta(days=5)).strftime('%Y-%m-%d')}).get_json()
+  assert {row['label']: row['shows'] for row in stats['top']} == {'Hall': 1, 'Club': 1, 'Bar': 1}
+  # a rebuild counts the shows of every shard
+  fyyur.rebuild_rollups()
+  fyyur.stats_cache.clear()
+  assert client.get('/api/v1/stats', query_string={'dimension': 'all', 'grain': 'day', 'to': (show_date + timedelta(days=5)).strftime('%Y-%m-%d')})\
+               .get_json()['series'][-1]['shows'] == 1
+  assert sum(row['shows'] for row in client.get('/api/v1/stats', query_string={
+    'dimension': 'venue', 'grain': 'day', 'to': (show_date + timedelta(days=5)).strftime('%Y-%m-%d')}).get_json()['top']) == 3
+
+
+def test_venues_added_after_the_split_are_found(app, client, sharded, split, tmp_path):
+  hall_id, club_id, artist_id = split
+  create_venue(client, 'Hall of Fame', 'Reno', 'NV')
+  venue_id = rows(sharded, 'west', Venue)[-1]
+
+  page = client.post('/venues/search', data=dict(search_term='Hall')).get_data(as_text=True)
+  assert '/venues/%d"' % hall_id in page and '/venues/%d"' % venue_id in page
+  assert '/venues/%d"' % club_id not in page
+  jazz_id = rows(sharded, None, fyyur.Lookup)[0]
+  page = client.post('/venues/search', data=dict(search_term='Hall', genre_id=jazz_id)).get_data(as_text=True)
+  assert '/venues/%d"' % hall_id not in page and '/venues/%d"' % venue_id in page
+
+  fyyur.autocomplete_index = None
+  assert [result['id'] for result in client.get('/autocomplete', query_string={'q': 'hall', 'kind': 'venue'})
+                                           .get_json()['results']] == [hall_id, venue_id]
+  assert 'Reno, NV' in fyyur.autocomplete().indexes['city'].labels
+
+  app.config.update(SITEMAP_DIR=str(tmp_path / 'sitemaps'), SITE_URL='http://example.com')
+  fyyur.generate_sitemaps()
+  venues = (tmp_path / 'sitemaps' / 'venues-1.xml').read_text()
+  assert [int(venue) for venue in re.findall(r'/venues/(\d+)<', venues)] == [hall_id, club_id, venue_id]
+
+  assert [row[0] for row in fyyur.export_rows('venue')] == [hall_id, club_id, venue_id]
+  assert len(list(fyyur.export_rows('show'))) == 2
+
+
+
+def artist_names(shard_set):
+  names = {}
+  for name in shard_set.names:
+    with shard_set.engines[name].connect() as connection:
+      names[name] = connection.execute(db.select([Artist.__table__.c.name]).order_by(Artist.__table__.c.id)).scalars().all()
+  return names
+
+
+def shard_cursors(shard_set):
+  cursors = []
+  for name in shard_set.names:
+    with shard_set.engines[name].connect() as connection:
+      cursors.append(connection.execute(db.select([fyyur.ShardCursor.__table__.c.seq])).scalar())
+  return cursors
+
+
+def last_seq(shard_set):
+  return (rows(shard_set, None, fyyur.Change) or [0])[-1]
+
+
+def edit_artist(client, artist_id, name):
+  client.post('/artists/%d/edit' % artist_id, data=dict(version='1', name=name, city='Austin', state='TX',
+                                                        genres='Jazz', seeking_venue='No',
+                                                        facebook_link='http://facebook.com/band',
+                                                        website_link='http://band.example.com',
+                                                        image_link='http://band.example.com/band.png'))
+
+
+def test_failed_copies_are_replayed(app, client, sharded, split, monkeypatch):
+  hall_id, club_id, artist_id = split
+  app.config['CHANGES_SETTLE_SECONDS'] = -5
+  split_seq = last_seq(sharded)
+  assert shard_cursors(sharded) == [split_seq, split_seq]
+
+  def down(connection, artist_ids):
+    raise IOError('shard down')
+  replicate = fyyur.replicate_artists
+  monkeypatch.setattr(fyyur, 'replicate_artists', down)
+  edit_artist(client, artist_id, 'Renamed')
+  # the edit is saved, the shards are behind
+  assert last_seq(sharded) > split_seq
+  assert artist_names(sharded) == {'west': ['Band'], 'south': ['Band']}
+  assert shard_cursors(sharded) == [split_seq, split_seq]
+
+  monkeypatch.setattr(fyyur, 'replicate_artists', replicate)
+  assert fyyur.catch_up_shards() == {'west': 1, 'south': 1}
+  assert artist_names(sharded) == {'west': ['Renamed'], 'south': ['Renamed']}
+  last = last_seq(sharded)
+  assert shard_cursors(sharded) == [last, last]
+  assert fyyur.catch_up_shards() == {'west': 0, 'south': 0}
+
+
+def test_unsettled_changes_are_copied_again(app, client, sharded, split):
+  hall_id, club_id, artist_id = split
+  app.config['CHANGES_SETTLE_SECONDS'] = 60
+  split_seq = last_seq(sharded)
+  edit_artist(client, artist_id, 'Renamed')
+  assert artist_names(sharded) == {'west': ['Renamed'], 'south': ['Renamed']}
+  # a transaction with a lower seq may still commit, the cursor waits
+  assert shard_cursors(sharded) == [split_seq, split_seq]
+  assert fyyur.catch_up_shards(batch=1) == {'west': 1, 'south': 1}
+
+  # an artist purged from the main database leaves the shards too
+  app.config['CHANGES_SETTLE_SECONDS'] = -5
+  with db.engine.begin() as connection:
+    connection.execute(fyyur.ArtistGenres.__table__.delete())
+    connection.execute(Artist.__table__.delete())
+    connection.execute(fyyur.Change.__table__.insert(), entity='artist', entity_id=artist_id, op='delete',
+                       changed_at=datetime.utcnow())
+  fyyur.catch_up_shards(batch=1)
+  assert artist_names(sharded) == {'west': [], 'south': []}
+  assert shard_cursors(sharded) == [last_seq(sharded)] * 2
@@ -0,0 +1,79 @@
+import os
+import re
+from datetime import datetime
+
+import pytest
+
+import app as fyyur
+import sitemaps
+from app import Artist, Venue, db
+
+
+def urls(path):
+  with open(path, encoding='utf-8') as sitemap:
+    return re.findall(r'<loc>([^<]*)</loc>', sitemap.read())
+
+
+def test_writer_splits_at_max_urls(tmp_path):
+  writer = sitemaps.SitemapWriter(str(tmp_path), 'venues', max_urls=2)
+  for i in range(5):
+    writer.add('http://example.com/venues/%d?a=1&b=2' % i, datetime(2030, 1, i + 1))
+  parts = writer.close()
+  assert [(name, lastmod.day, changed) for name, lastmod, changed in parts] == \
+    [('venues-1.xml', 2, True), ('venues-2.xml', 4, True), ('venues-3.xml', 5, True)]
+  assert urls(str(tmp_path / 'venues-1.xml')) == ['http://example.com/venues/0?a=1&amp;b=2',
+                                                  'http://example.com/venues/1?a=1&amp;b=2']
+  assert '<lastmod>2030-01-05T00:00:00+00:00</lastmod>' in (tmp_path / 'venues-3.xml').read_text()
+
+
+def test_unchanged_files_are_not_replaced(tmp_path):
+  def write():
+    writer = sitemaps.SitemapWriter(str(tmp_path), 'pages')
+    writer.add('http://example.com/')
+    return writer.close()
+  write()
+  os.utime(str(tmp_path / 'pages-1.xml'), (0, 0))
+  assert write() == [('pages-1.xml', None, False)]
+  assert os.path.getmtime(str(tmp_path / 'pages-1.xml')) == 0
+  assert not any(name.endswith('.part') for name in os.listdir(str(tmp_path)))
+
+
+def test_index_and_clean(tmp_path):
+  assert sitemaps.write_index(str(tmp_path), 'http://example.com/static/sitemaps/', [('pages-1.xml', None)])
+  assert urls(str(tmp_path / 'sitemap.xml')) == ['http://example.com/static/sitemaps/pages-1.xml']
+  (tmp_path / 'venues-9.xml').write_text('')
+  assert sitemaps.clean(str(tmp_path), {'sitemap.xml'}) == 1 and os.listdir(str(tmp_path)) == ['sitemap.xml']
+
+
+@pytest.fixture
+def sitemap_dir(app, tmp_path):
+  directory = os.path.join(app.static_folder, 'sitemaps-test-%s' % tmp_path.name)
+  app.config.update(SITEMAP_DIR=directory, SITEMAP_MAX_URLS=3, SITEMAP_CHUNK_SIZE=2, SITE_URL='http://example.com/')
+  yield directory
+  for name in os.listdir(directory):
+    os.remove(os.path.join(directory, name))
+  os.rmdir(directory)
+
+
+def test_generate_sitemaps(client, sitemap_dir):
+  venues = [Venue(name='Hall %d' % i, city='Austin', state='TX', address='%d Main St' % i) for i in range(4)]
+  db.session.add_all(venues + [Artist(name='Band', city='Austin', state='TX')])
+  db.session.commit()
+  venue_ids = [venue.id for venue in venues]
+  client.delete('/venues/%d' % venue_ids[3])
+
+  parts, removed = fyyur.generate_sitemaps()
+  assert [name for name, _, _ in parts] == ['pages-1.xml', 'pages-2.xml', 'venues-1.xml', 'artists-1.xml']
+  assert urls(os.path.join(sitemap_dir, 'venues-1.xml')) == \
+    ['http://example.com/venues/%d' % venue_id for venue_id in venue_ids[:3]]
+
+  index = client.get('/sitemap.xml')
+  assert index.mimetype == 'application/xml'
+  base = 'http://example.com/static/' + os.path.basename(sitemap_dir)
+  assert re.findall(r'<loc>([^<]*)</loc>', index.get_data(as_text=True)) == [base + '/' + name for name, _, _ in parts]
+  assert 'Sitemap: http://example.com/sitemap.xml' in client.get('/robots.txt').get_data(as_text=True)
+
+  # a smaller catalogue leaves no stale urlsets behind
+  fyyur.app.config['SITEMAP_MAX_URLS'] = 10
+  parts, removed = fyyur.generate_sitemaps()
+  assert removed == 1 and not os.path.exists(os.path.join(sitemap_dir, 'pages-2.xml'))
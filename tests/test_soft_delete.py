@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as fyyur
+from app import Artist, Match, Show, ShowArchive, Venue, VenueGenres, db
+
+
+@pytest.fixture
+def listing(app):
+  venue = Venue(name='Hall', city='Austin', state='TX', address='1 Main St')
+  other = Venue(name='Club', city='Austin', state='TX', address='2 Main St')
+  artist = Artist(name='Band', city='Austin', state='TX')
+  db.session.add_all([venue, other, artist])
+  db.session.flush()
+  shows = [Show(venue_id=venue.id, artist_id=artist.id, show_date=datetime.now() + timedelta(days=1)),
+           Show(venue_id=other.id, artist_id=artist.id, show_date=datetime.now() + timedelta(days=2))]
+  db.session.add_all(shows)
+  db.session.commit()
+  ids = venue.id, other.id, artist.id, shows[0].id, shows[1].id
+  db.session.remove()
+  return ids
+
+
+def test_deleted_venue_is_only_marked(client, listing):
+  venue_id, other_id, artist_id, show_id, other_show_id = listing
+  assert client.delete('/venues/%d' % venue_id).get_json()['success']
+
+  venue = Venue.query.execution_options(include_deleted=True).get(venue_id)
+  assert venue is not None and venue.deleted_at is not None
+  assert Show.query.execution_options(include_deleted=True).get(show_id).deleted_at is None
+
+
+def test_deleted_venue_and_its_shows_are_hidden(client, listing):
+  venue_id, other_id, artist_id, show_id, other_show_id = listing
+  assert '/venues/%d"' % venue_id in client.get('/shows').get_data(as_text=True)
+  client.delete('/venues/%d' % venue_id)
+
+  assert Venue.query.get(venue_id) is None
+  assert [venue.id for venue in Venue.query.all()] == [other_id]
+  # the show of the deleted venue goes with it, loaded directly or through a relationship
+  assert [show.id for show in Show.query.all()] == [other_show_id]
+  assert [show.id for show in Artist.query.get(artist_id).shows] == [other_show_id]
+
+  assert client.get('/venues/%d' % venue_id).status_code == 404
+  assert '/venues/%d"' % venue_id not in client.get('/venues').get_data(as_text=True)
+  assert '/venues/%d"' % venue_id not in client.get('/shows').get_data(as_text=True)
+
+
+def test_deleted_artist_and_show_are_hidden(client, listing):
+  venue_id, other_id, artist_id, show_id, other_show_id = listing
+  client.delete('/shows/%d' % show_id)
+  assert [show.id for show in Show.query.all()] == [other_show_id]
+
+  assert '/artists/%d"' % artist_id in client.get('/artists').get_data(as_text=True)
+  client.delete('/artists/%d' % artist_id)
+  assert Artist.query.get(artist_id) is None
+  assert Show.query.all() == []
+  assert client.get('/artists/%d' % artist_id).status_code == 404
+  assert '/artists/%d"' % artist_id not in client.get('/artists').get_data(as_text=True)
+
+
+def test_include_deleted_sees_everything(client, listing):
+  venue_id, other_id, artist_id, show_id, other_show_id = listing
+  client.delete('/venues/%d' % venue_id)
+  client.delete('/artists/%d' % artist_id)
+
+  assert sorted(venue.id for venue in Venue.query.execution_options(include_deleted=True)) == [venue_id, other_id]
+  assert [artist.id for artist in Artist.query.execution_options(include_deleted=True)] == [artist_id]
+  assert sorted(show.id for show in Show.query.execution_options(include_deleted=True)) == [show_id, other_show_id]
+
+
+def test_purge_removes_old_deletions_in_batches(client, listing):
+  venue_id, other_id, artist_id, show_id, other_show_id = listing
+  db.session.add_all([VenueGenres(venue_id=venue_id, genre_id=1),
+                      ShowArchive(venue_id=venue_id, artist_id=artist_id, show_date=datetime(2010, 1, 1))])
+  db.session.commit()
+  client.delete('/venues/%d' % venue_id)
+  # a row the delete's own match refresh left behind
+  db.session.add(Match(artist_id=artist_id, venue_id=venue_id, score=1.0))
+  db.session.commit()
+
+  # nothing was deleted before the cutoff yet
+  assert sum(fyyur.purge_deleted(datetime.utcnow() - timedelta(days=1), batch=1).values()) == 0
+  counts = fyyur.purge_deleted(datetime.utcnow() + timedelta(seconds=1), batch=1)
+  assert counts == {'Show': 1, 'Show_Archive': 1, 'Venue_Genres': 1, 'Artist_Genres': 0, 'Match': 1,
+                    'Venue': 1, 'Artist': 0, 'Idempotency_Key': 0}
+
+  assert Venue.query.execution_options(include_deleted=True).get(venue_id) is None
+  assert [show.id for show in Show.query.execution_options(include_deleted=True)] == [other_show_id]
+  assert ShowArchive.query.count() == VenueGenres.query.count() == Match.query.count() == 0
+  assert Artist.query.get(artist_id) is not None
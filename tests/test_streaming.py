@@ -0,0 +1,41 @@
+import zlib
+
+import pytest
+
+from app import Artist, db
+
+
+@pytest.fixture
+def artists(app):
+  app.config['STREAM_BUFFER_SIZE'] = 5
+  app.config['ARTISTS_PER_PAGE'] = 200
+  db.session.add_all([Artist(name='Artist %03d' % i, city='Austin', state='TX') for i in range(200)])
+  db.session.commit()
+
+
+def test_gzip_stream_matches_plain_page(client, artists):
+  plain = client.get('/artists')
+  assert plain.is_streamed and 'Content-Encoding' not in plain.headers
+  assert 'Accept-Encoding' in plain.headers['Vary']
+
+  compressed = client.get('/artists', headers={'Accept-Encoding': 'gzip'})
+  assert compressed.headers['Content-Encoding'] == 'gzip'
+  assert zlib.decompress(compressed.get_data(), 16 + zlib.MAX_WBITS) == plain.get_data()
+  assert plain.get_data(as_text=True).count('Artist ') >= 200
+
+
+def test_every_gzip_chunk_decodes_on_arrival(client, artists):
+  # sync flushed, so a browser can render each chunk without waiting for the rest
+  response = client.get('/artists', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+  decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+  chunks = [chunk for chunk in response.response if chunk]
+  assert len(chunks) > 10
+
+  html = b''
+  for chunk in chunks[:-1]:
+    decoded = decompressor.decompress(chunk)
+    assert decoded
+    html += decoded
+  html += decompressor.decompress(chunks[-1]) + decompressor.flush()
+  response.close()
+  assert html.count(b'Artist ') >= 200